@@ -1,21 +1,12 @@
-import sqlite3
+from db import open_write_connection
+from schema import reset_schema
 
-# Création de la base de données
-conn = sqlite3.connect("recrutement.db")
+# Création de la base de données (connexion d'écriture, journal WAL)
+conn = open_write_connection()
 cur = conn.cursor()
 
-# Création de la table avec la nouvelle colonne "periode_recrutement"
-cur.execute("DROP TABLE IF EXISTS kpi_recrutement")
-cur.execute("""
-    CREATE TABLE kpi_recrutement (
-        rh_nom TEXT,
-        mois TEXT,
-        kpi_nom TEXT,
-        valeur INTEGER,
-        commentaire TEXT,
-        periode_recrutement TEXT
-    )
-""")
+# Création du schéma en étoile (dimensions, faits indexés) et de la vue kpi_recrutement
+reset_schema(conn)
 
 # Données des recruteurs
 donnees = []
@@ -100,7 +91,7 @@ for kpi, j, a, s, com in samya_data:
     donnees.append(("Samya", "Août", kpi, a, com, periodes["Samya"]))
     donnees.append(("Samya", "Septembre", kpi, s, com, periodes["Samya"]))
 
-# Insertion des données
+# Insertion des données (via la vue kpi_recrutement, qui alimente dimensions et faits)
 cur.executemany("""
     INSERT INTO kpi_recrutement (rh_nom, mois, kpi_nom, valeur, commentaire, periode_recrutement)
     VALUES (?, ?, ?, ?, ?, ?)
@@ -113,7 +104,7 @@ print("✅ Base de données créée avec succès")
 print(f"Total d'enregistrements insérés: {len(donnees)}")
 
 print("\nRécapitulatif par recruteur:")
-for rh in ["Inès", "Marienne", "Pauline", "Samya"]:
+for rh in ["Inès", "Mariéme", "Pauline", "Samya"]:
     cur.execute("SELECT COUNT(*) FROM kpi_recrutement WHERE rh_nom = ?", (rh,))
     count = cur.fetchone()[0]
     periode = periodes[rh]
@@ -1,47 +1,32 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-import matplotlib.pyplot as plt
-import os
-import re
-from dotenv import load_dotenv
-from groq import Groq
+from llm_cache import get_cache
+from charts import render_chart
+from sql_guard import GuardError
+from results import fetch_page, aggregate_trends
+import tracing
+from tracing import span, trace
+from conversation import Conversation
+import warmup
+from insights import query_insights, format_insights
+from core import (MODEL, extract_sql, extract_kpi_name, create_completion, build_prompt, repair_sql, data_version,
+                  get_router, get_prompt_builder, get_dispatcher)
 
 # --- Configurations ---
-load_dotenv()
-API_KEY = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=API_KEY)
-
-conn = sqlite3.connect('recrutement.db', check_same_thread=False)
-
-KPI_LIST = [
-    "Nb de candidats contactés",
-    "Nb entretiens candidats Salariés",
-    "Nb entretiens candidats Sous-Traitants",
-    "Nb de candidats recrutés Salariés",
-    "Nb de candidats intégrés Sous Traitants",
-    "Nombre de présentations clients",
-    "Nb de refus CDI Salariés",
-    "Nombre de KO candidat à la suite d'une présentation client",
-    "Nombre de KO client à la suite d'une présentation client"
-]
+# Client Groq, pool SQLite, routeur, réécriture et garde sont créés par core à la première question,
+# une seule fois pour tout le processus (et non à chaque rerun Streamlit)
 
-# --- Fonctions ---
+# Durée de vie des résultats mis en cache et nombre de réponses gardées par session
+CACHE_TTL = 600
+SESSION_MAX_ANSWERS = 20
 
-def get_schema():
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA table_info(kpi_recrutement)")
-    schema = cursor.fetchall()
-    return "\n".join([f"- {col[1]} ({col[2]})" for col in schema])
+# --- Fonctions ---
 
-def ask_llm(user_input):
-    system_prompt = f"""
+def ask_llm(user_input, correction=None, history=None):
+    # Seuls les KPI, recruteurs et périodes utiles à la question sont décrits (prompt_builder.py)
+    system_prompt, fingerprint = build_prompt("""
 Tu es un assistant RH intelligent. Tu as accès à une base de données SQLite avec la table `kpi_recrutement`.
-Voici son schéma :
-{get_schema()}
-
-Liste des KPI disponibles :
-{', '.join(KPI_LIST)}
+{contexte}
 
 Si la question de l'utilisateur est une salutation, une question générale ou un remerciement, réponds simplement de manière naturelle sans SQL.
 
@@ -49,58 +34,193 @@ Si c’est une question demandant une analyse de données RH, génère une répo
 
 Réponds toujours en français.
 Si tu ne connais pas la réponse, ne génère pas de réponses aléatoires ou fausses.
-"""
+""", user_input)
 
-    response = client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=[
+    def call_llm():
+        # Question de suivi : les échanges précédents (bornés) accompagnent la question complétée
+        question = f"{history}\n\nQuestion : {user_input}" if history else user_input
+        messages = [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_input}
-        ],
-        temperature=0.5,
-        max_tokens=800
+            {"role": "user", "content": question}
+        ]
+        if correction:
+            # Relance avec la requête fautive et l'erreur SQLite précise
+            failed_sql, error = correction
+            messages += [
+                {"role": "assistant", "content": f"```sql\n{failed_sql}\n```"},
+                {"role": "user", "content": f"Cette requête échoue avec l'erreur : {error}. Corrige-la."}
+            ]
+        response = create_completion(
+            model=MODEL,
+            messages=messages,
+            temperature=0.5,
+            max_tokens=800
+        )
+        return response.choices[0].message.content.strip()
+
+    # Les réponses sont mises en cache : les questions répétées ne repassent pas par Groq
+    if correction:
+        # La réponse corrigée remplace celle dont la requête échouait
+        answer = call_llm()
+        get_cache().set("app.ask_llm", user_input, fingerprint, answer)
+        return answer
+    return get_cache().get_or_compute("app.ask_llm", user_input, fingerprint, call_llm)
+
+def prepare_sql(question, sql):
+    """Requête réparée localement ; l'assistant n'est relancé, avec l'erreur, qu'en dernier recours"""
+    def retry(failed_sql, error):
+        return extract_sql(ask_llm(question, (failed_sql, error))) or failed_sql
+    return repair_sql(sql, retry=retry).sql
+
+def render_trends(pivot, kpi_name):
+    # Rendu PNG hors écran, mis en cache par charts.py
+    return render_chart(
+        pivot,
+        kind="line",
+        title=f"Évolution de {kpi_name} par recruteur",
+        legend_title="rh_nom",
+        figsize=(10, 5),
+        rotation=45,
+        grid_axis=None,
     )
-    return response.choices[0].message.content.strip()
-
-def extract_sql(response_text):
-    if "```sql" in response_text:
-        start = response_text.find("```sql") + 6
-        end = response_text.find("```", start)
-        return response_text[start:end].strip()
-    return None
-
-def escape_apostrophes_in_sql(sql: str) -> str:
-    # Double les apostrophes à l’intérieur des chaînes SQL pour éviter les erreurs
-    def replacer(match):
-        content = match.group(1)
-        escaped = content.replace("'", "''")
-        return f"'{escaped}'"
-    
-    pattern = r"'([^']*)'"
-    return re.sub(pattern, replacer, sql)
-
-def execute_sql(sql):
+
+# --- Cache des réponses ---
+# `version` (core.data_version) fait partie de la clé : après un chargement, rien n'est servi des anciennes données
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def run_question(question, history, version):
+    """Question autonome -> réponse et SQL réparé, partagé entre toutes les sessions"""
+    route = get_router().route(question)
+    if route:
+        description, llm_response = route.describe(), None
+        sql_query, params = route.sql, route.params
+    else:
+        description, llm_response = None, ask_llm(question, history=history)
+        with span("nettoyage"):
+            sql_query, params = extract_sql(llm_response), None
+        if sql_query:
+            sql_query = prepare_sql(question, sql_query)
+    return description, llm_response, sql_query, params
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_page(sql, params, number, version):
+    """Une page du résultat (seule cette page est lue en mémoire) et l'erreur éventuelle"""
+    try:
+        return fetch_page(sql, params, number), None
+    except GuardError as e:
+        return None, f"requête stoppée, {e.reason}"
+    except Exception as e:
+        return None, str(e)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_trends(sql, params, version):
+    """Totaux par mois et recruteur calculés bloc par bloc sur tout le résultat, et l'erreur éventuelle"""
     try:
-        sql = escape_apostrophes_in_sql(sql)
-        return pd.read_sql_query(sql, conn)
+        return aggregate_trends(sql, params), None
     except Exception as e:
-        st.error(f"Erreur SQL : {e}")
-        return pd.DataFrame()
-
-def visualize(df, kpi_name):
-    if df.empty or not all(c in df.columns for c in ['mois', 'rh_nom', 'valeur']):
-        return None
-    pivot = df.pivot_table(index='mois', columns='rh_nom', values='valeur', aggfunc='sum').fillna(0)
-    fig, ax = plt.subplots(figsize=(10, 5))
-    pivot.plot(kind='line', ax=ax, marker='o')
-    ax.set_title(f"Évolution de {kpi_name} par recruteur")
-    ax.set_xlabel("Mois")
-    ax.set_ylabel("Valeur")
-    plt.xticks(rotation=45)
-    return fig
+        return None, str(e)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_insights(sql, params, version):
+    """Classements, variations et entonnoir du résultat (cache insights.db par version des données), et l'erreur"""
+    try:
+        return query_insights(sql, params), None
+    except Exception as e:
+        return None, str(e)
+
+def get_answer(question):
+    """Réponse mémorisée dans la session : un rerun sans nouvelle question ne coûte rien.
+
+    Une question de suivi ("et pour août ?") est d'abord complétée par le contexte de la conversation.
+    """
+    answers = st.session_state.setdefault("reponses", {})
+    conversation = st.session_state.setdefault("conversation", Conversation())
+    resolution = conversation.resolve(question, get_prompt_builder())
+    key = resolution.text
+    if key not in answers:
+        # Question de référence préparée par warmup.py pour la version courante des données
+        prepared = None if resolution.follow_up else warmup.lookup(key)
+        # Trace de la question : les étapes absentes ont été servies par le cache Streamlit
+        with trace(question, "app"):
+            tracing.annotate(question_de_suivi=resolution.follow_up, reponse_preparee=prepared is not None)
+            if prepared:
+                description, llm_response, sql_query, params = prepared.describe(), None, prepared.sql, prepared.params
+                first_page, error = prepared.page(), None
+                kpi, fig, warning = prepared.kpi, prepared.chart, None
+            else:
+                version = data_version()
+                with st.spinner("Réflexion en cours..."):
+                    description, llm_response, sql_query, params = run_question(key, resolution.history, version)
+                    first_page, error = load_page(sql_query, params, 0, version) if sql_query else (None, None)
+                kpi = extract_kpi_name(key, default=None)
+                fig, warning = None, None
+                if kpi and first_page and first_page.rows:
+                    trends, warning = load_trends(sql_query, params, version)
+                    if trends and trends.totals:
+                        fig = render_trends(trends.pivot(), kpi)
+        answers[key] = {
+            "cle": key,
+            "suivi": resolution.follow_up,
+            "description": description,
+            "llm_response": llm_response,
+            "sql": sql_query,
+            "params": params,
+            "error": error,
+            "kpi": kpi,
+            "fig": fig,
+            "avertissement": warning,
+            "premiere_page": first_page if prepared else None,
+            "indicateurs": prepared.insights if prepared else None,
+            "page": 0,
+        }
+        while len(answers) > SESSION_MAX_ANSWERS:
+            answers.pop(next(iter(answers)))
+    conversation.record(resolution, answers[key]["sql"])
+    return answers[key]
+
+def current_page(answer):
+    """Page affichée ; la première page d'une réponse préparée est servie sans relire la base"""
+    if answer["page"] == 0 and answer["premiere_page"] is not None:
+        return answer["premiere_page"], None
+    return load_page(answer["sql"], answer["params"], answer["page"], data_version())
+
+def analysis(answer):
+    """Indicateurs de la réponse (préparés avec elle, sinon calculés sur tout le résultat) et l'erreur éventuelle"""
+    if answer["indicateurs"] is not None:
+        return answer["indicateurs"], None
+    return load_insights(answer["sql"], answer["params"], data_version())
+
+def turn_page(key, step):
+    answer = st.session_state["reponses"][key]
+    answer["page"] = max(0, answer["page"] + step)
+
+def reset_conversation():
+    st.session_state.pop("conversation", None)
+
+def show_stats():
+    """Temps par étape (percentiles) et questions les plus lentes, sur les dernières traces"""
+    with st.sidebar.expander("📊 Temps par étape"):
+        summary = tracing.stats()
+        if not summary["traces"]:
+            st.caption("Aucune question tracée pour l'instant.")
+            return
+        etapes = pd.DataFrame.from_dict(summary["etapes"], orient="index").sort_values("p50", ascending=False)
+        st.dataframe(etapes)
+        if summary["hit_rate_cache_llm"] is not None:
+            st.caption(f"Cache LLM : {summary['hit_rate_cache_llm']:.0%} de hits")
+        st.caption(f"Jetons Groq : {summary['jetons_prompt']} prompt, {summary['jetons_reponse']} réponse")
+        dispatch = get_dispatcher().stats()
+        st.caption(f"File Groq : {dispatch['file']} en attente, attente p95 {dispatch['attente_p95_ms'] or 0} ms, "
+                   f"{dispatch['fusionnes']} appels fusionnés, {dispatch['limites_429']} limites 429")
+        prepared = warmup.get_store().stats()
+        st.caption(f"Réponses préparées : {prepared['entries']}, {prepared['hits']} servies, "
+                   f"{prepared['perimees']} périmées")
+        st.dataframe(pd.DataFrame(summary["plus_lentes"], columns=["durée (ms)", "app", "question"]))
 
 
 st.title("🤖 Assistant RH intelligent")
+show_stats()
+st.sidebar.button("🔄 Nouvelle conversation", on_click=reset_conversation)
 
 question = st.text_input("Pose ta question RH :", "")
 
@@ -108,26 +228,48 @@ if st.button("Envoyer"):
     if question.strip() == "":
         st.warning("Merci d'entrer une question avant d'envoyer.")
     else:
-        with st.spinner("Réflexion en cours..."):
-            llm_response = ask_llm(question)
+        st.session_state["question_active"] = question
 
+# La dernière question envoyée reste affichée lors des reruns suivants, sans nouvel appel
+question_active = st.session_state.get("question_active")
+if question_active:
+    answer = get_answer(question_active)
+    if answer["suivi"]:
+        st.caption(f"↪ Question comprise comme : {answer['cle']}")
+    if answer["description"]:
+        st.markdown("### ⚡ Question reconnue localement :")
+        st.markdown(answer["description"])
+    else:
         st.markdown("### 🤖 Réponse de l'assistant :")
-        st.markdown(llm_response)
+        st.markdown(answer["llm_response"])
 
-        sql_query = extract_sql(llm_response)
+    if answer["sql"]:
+        st.markdown("### 🧠 Requête SQL générée :")
+        st.code(answer["sql"], language="sql")
 
-        if sql_query:
-            st.markdown("### 🧠 Requête SQL générée :")
-            st.code(sql_query, language="sql")
-
-            df = execute_sql(sql_query)
-            if not df.empty:
+        if answer["error"]:
+            st.error(f"Erreur SQL : {answer['error']}")
+        else:
+            page, error = current_page(answer)
+            if error:
+                st.error(f"Erreur SQL : {error}")
+            elif page.rows or page.number > 0:
                 st.markdown("### Résultats :")
-                st.dataframe(df)
-
-                for kpi in KPI_LIST:
-                    if kpi.lower() in question.lower():
-                        fig = visualize(df, kpi)
-                        if fig:
-                            st.pyplot(fig)
-                        break
+                st.dataframe(page.to_dataframe())
+                previous, label, following = st.columns([1, 2, 1])
+                previous.button("◀ Précédente", on_click=turn_page, args=(answer["cle"], -1),
+                                disabled=page.number == 0)
+                label.caption(page.describe())
+                following.button("Suivante ▶", on_click=turn_page, args=(answer["cle"], 1),
+                                 disabled=not page.has_more)
+
+                if answer["avertissement"]:
+                    st.warning(f"Graphique indisponible : {answer['avertissement']}")
+                if answer["fig"]:
+                    st.image(answer["fig"])
+                    st.markdown("### Analyse :")
+                    insights, warning = analysis(answer)
+                    if warning:
+                        st.warning(f"Indicateurs indisponibles : {warning}")
+                    for line in format_insights(insights, answer["kpi"]):
+                        st.markdown(line)
@@ -0,0 +1,96 @@
+"""Débit de lecture avec N utilisateurs simultanés : connexion partagée vs pool en lecture seule.
+
+Usage : python benchmarks/bench_db.py --users 1 4 8 16 --queries 200 --scale 2000
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import DB_PATH, ReadPool  # noqa: E402
+
+QUERIES = [
+    ("SELECT rh_nom, mois, SUM(valeur) AS valeur FROM kpi_recrutement "
+     "WHERE kpi_nom = ? GROUP BY rh_nom, mois", ("Nb de candidats contactés",)),
+    ("SELECT rh_nom, SUM(valeur) AS total FROM kpi_recrutement "
+     "WHERE mois = ? GROUP BY rh_nom ORDER BY total DESC", ("Septembre",)),
+    ("SELECT kpi_nom, SUM(valeur) AS total FROM kpi_recrutement GROUP BY kpi_nom", ()),
+]
+
+
+def prepare_database(source, scale):
+    """Copie la base dans un répertoire temporaire et la grossit pour rendre les lectures mesurables"""
+    tmpdir = tempfile.mkdtemp(prefix="bench_db_")
+    path = os.path.join(tmpdir, "recrutement.db")
+    shutil.copyfile(source, path)
+    conn = sqlite3.connect(path)
+    with conn:
+        for i in range(1, scale):
+            conn.execute("""
+                INSERT INTO kpi_recrutement (rh_nom, mois, kpi_nom, valeur, commentaire, periode_recrutement)
+                SELECT rh_nom || ' ' || ?, mois, kpi_nom, valeur, commentaire, periode_recrutement
+                FROM kpi_recrutement WHERE rh_nom NOT LIKE '% %'
+            """, (str(i),))
+    count = conn.execute("SELECT COUNT(*) FROM kpi_recrutement").fetchone()[0]
+    conn.close()
+    return tmpdir, path, count
+
+
+def run_users(users, queries_per_user, run_query):
+    """Lance `users` threads qui exécutent chacun `queries_per_user` requêtes ; retourne les requêtes/s"""
+    barrier = threading.Barrier(users + 1)
+
+    def worker():
+        barrier.wait()
+        for i in range(queries_per_user):
+            sql, params = QUERIES[i % len(QUERIES)]
+            run_query(sql, params)
+
+    threads = [threading.Thread(target=worker) for _ in range(users)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return users * queries_per_user / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--queries", type=int, default=100, help="requêtes par utilisateur")
+    parser.add_argument("--scale", type=int, default=1000, help="facteur de duplication des données")
+    parser.add_argument("--pool-size", type=int, default=8)
+    args = parser.parse_args()
+
+    tmpdir, path, count = prepare_database(args.db, args.scale)
+    print(f"Base de test : {count} lignes")
+    try:
+        # Ancienne approche : une seule connexion partagée par tous les threads
+        shared = sqlite3.connect(path, check_same_thread=False)
+
+        def shared_query(sql, params):
+            return shared.execute(sql, params).fetchall()
+
+        pool = ReadPool(path, size=args.pool_size)
+        print(f"{'utilisateurs':>12} {'partagée (req/s)':>18} {'pool (req/s)':>14} {'gain':>6}")
+        for users in args.users:
+            base = run_users(users, args.queries, shared_query)
+            pooled = run_users(users, args.queries, pool.query)
+            print(f"{users:>12} {base:>18.1f} {pooled:>14.1f} {pooled / base:>5.2f}x")
+        pool.close()
+        shared.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Temps d'import des points d'entrée (main.py, core.py, interface.py, app.py) dans un processus neuf.
+
+Usage : python benchmarks/bench_startup.py --modules main core --repeat 10 [--top 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dépendances lourdes qui ne doivent pas être chargées avant la première question
+HEAVY_MODULES = ["pandas", "matplotlib", "matplotlib.pyplot", "groq", "dotenv", "numpy"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(f"{{elapsed:.6f}}|{{','.join(heavy)}}")
+"""
+
+
+def measure(module, repeat):
+    """Durées d'import (s) sur `repeat` processus neufs et dépendances lourdes chargées"""
+    durations, heavy = [], ""
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ROOT_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        elapsed, heavy = output.split("|")
+        durations.append(float(elapsed))
+    return durations, [m for m in heavy.split(",") if m]
+
+
+def import_profile(module, top):
+    """Modules les plus coûteux (temps cumulé) d'après python -X importtime"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, capture_output=True, text=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=["core", "main"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10, help="modules les plus coûteux à afficher")
+    args = parser.parse_args()
+
+    importable = []
+    print(f"{'module':<12} {'médiane (ms)':>13} {'min (ms)':>10}  dépendances lourdes chargées")
+    for module in args.modules:
+        try:
+            durations, heavy = measure(module, args.repeat)
+        except subprocess.CalledProcessError as e:
+            print(f"{module:<12} import impossible : {e.stderr.strip().splitlines()[-1]}")
+            continue
+        importable.append(module)
+        print(f"{module:<12} {statistics.median(durations) * 1000:>13.1f} {min(durations) * 1000:>10.1f}  "
+              f"{', '.join(heavy) or 'aucune'}")
+    if args.top:
+        for module in importable:
+            print(f"\nImports les plus coûteux pour {module} (cumulé / propre, ms) :")
+            for cumulative, own, name in import_profile(module, args.top):
+                print(f"  {cumulative / 1000:>8.1f} {own / 1000:>8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
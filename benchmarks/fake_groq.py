@@ -0,0 +1,78 @@
+"""Client Groq local pour les benchmarks : latence configurable et SQL préenregistré par question.
+
+S'utilise à la place de groq.Groq (même interface client.chat.completions.create) :
+    import fake_groq; fake_groq.install(latency=0.4, answers={...})
+"""
+import random
+import sys
+import threading
+import time
+import types
+
+# Requête renvoyée quand la question n'a pas de réponse préenregistrée
+DEFAULT_SQL = "SELECT rh_nom, mois, kpi_nom, valeur FROM kpi_recrutement LIMIT 20"
+
+
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Completions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model=None, messages=None, temperature=None, max_tokens=None, **kwargs):
+        return self._client._complete(model, messages or [])
+
+
+class FakeGroq:
+    """Remplaçant de groq.Groq : répond après `latency` secondes (± `jitter`) avec le SQL prévu"""
+
+    def __init__(self, api_key=None, latency=0.0, jitter=0.0, answers=None, default_sql=DEFAULT_SQL,
+                 seed=None, **kwargs):
+        self.latency = latency
+        self.jitter = jitter
+        self.answers = dict(answers or {})
+        self.default_sql = default_sql
+        self.calls = 0
+        self.prompt_tokens = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = _Obj(completions=_Completions(self))
+
+    def _complete(self, model, messages):
+        question = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        sql = self.answers.get(question.strip(), self.default_sql)
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        # Réponse au format attendu par app.py (bloc ```sql) ; main.py et interface.py retirent les balises
+        content = f"Voici la requête correspondante.\n```sql\n{sql}\n```"
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+        completion_tokens = len(content) // 4
+        return _Obj(
+            model=model,
+            choices=[_Obj(index=0, finish_reason="stop", message=_Obj(role="assistant", content=content))],
+            usage=_Obj(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                       total_tokens=prompt_tokens + completion_tokens),
+        )
+
+
+def install(**settings):
+    """Remplace groq.Groq par FakeGroq (à appeler avant d'importer main.py, interface.py ou app.py)"""
+    try:
+        import groq
+    except ImportError:
+        # Le paquet groq n'est pas nécessaire pour mesurer la chaîne en local
+        groq = types.ModuleType("groq")
+        sys.modules["groq"] = groq
+
+    def factory(api_key=None, **kwargs):
+        return FakeGroq(api_key=api_key, **{**settings, **kwargs})
+
+    groq.Groq = factory
+    return groq
@@ -0,0 +1,159 @@
+"""Génère une base kpi_recrutement synthétique (schéma en étoile) de 1k, 100k ou 10M lignes.
+
+Usage : python benchmarks/generate_data.py --size 100k --output /tmp/bench_100k.db [--seed 42]
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from schema import MOIS, create_schema  # noqa: E402
+from rollups import drop_rollups  # noqa: E402
+
+# Tailles prédéfinies : nombre de lignes visé et nombre de mois couverts
+SIZES = {
+    "1k": (1_000, 12),
+    "100k": (100_000, 36),
+    "10M": (10_000_000, 120),
+}
+# Dernier mois généré : la fin du T3 2024, comme les données réelles
+LAST_PERIOD = (2024, 9)
+BATCH_SIZE = 100_000
+
+# KPI réels (noms tels qu'en base) et valeur mensuelle moyenne d'un recruteur
+KPIS = [
+    ("Nb de candidats contactés", 65.0),
+    ("Nb entretiens candidats Salariés", 2.5),
+    ("Nb entretiens candidats Sous-Traitants", 11.0),
+    ("Nb de candidats recrutés Salariés", 0.3),
+    ("Nb de candidats intégrés Sous Traitants", 0.4),
+    ("Nombre de présentations clients", 1.2),
+    ("Nb de refus CDI Salariés", 0.1),
+    ("Nombre de KO candidat à la suite d'une présentation client", 0.2),
+    ("Nombre de KO client à la suite d'une présentation client", 0.3),
+]
+# Les recruteurs réels sont toujours présents pour que les questions d'exemple aient des réponses
+RECRUTEURS = ["Inès", "Mariéme", "Pauline", "Samya"]
+PRENOMS = ["Camille", "Léa", "Hugo", "Chloé", "Lucas", "Manon", "Yanis", "Sarah", "Nathan", "Inès",
+           "Théo", "Jade", "Karim", "Emma", "Louis", "Amina", "Julien", "Clara", "Mehdi", "Zoé"]
+NOMS = ["Martin", "Bernard", "Dubois", "Thomas", "Robert", "Richard", "Petit", "Durand", "Leroy",
+        "Moreau", "Simon", "Laurent", "Lefebvre", "Michel", "Garcia", "David", "Bertrand", "Roux"]
+# Saisonnalité du recrutement (creux l'été et en décembre)
+SAISON = {1: 1.1, 2: 1.05, 3: 1.1, 4: 1.0, 5: 1.0, 6: 0.95, 7: 0.8, 8: 0.6, 9: 1.15, 10: 1.1, 11: 1.05, 12: 0.75}
+
+
+def recruiter_names(count):
+    """Noms de recruteurs distincts : les quatre réels puis des prénoms/noms combinés"""
+    names = RECRUTEURS[:count]
+    for i in range(count - len(names)):
+        prenom = PRENOMS[i % len(PRENOMS)]
+        nom = NOMS[(i // len(PRENOMS)) % len(NOMS)]
+        tour = i // (len(PRENOMS) * len(NOMS))
+        names.append(f"{prenom} {nom}" + (f" {tour + 1}" if tour else ""))
+    return names
+
+
+def periods(months):
+    """(annee, mois_num) des `months` derniers mois jusqu'à LAST_PERIOD inclus, dans l'ordre"""
+    annee, mois = LAST_PERIOD
+    result = []
+    for _ in range(months):
+        result.append((annee, mois))
+        mois -= 1
+        if mois == 0:
+            annee, mois = annee - 1, 12
+    return result[::-1]
+
+
+def _poisson(rng, mean):
+    """Tirage de Poisson (Knuth pour les petites moyennes, approximation normale au-delà)"""
+    if mean > 30:
+        return max(0, int(round(rng.gauss(mean, math.sqrt(mean)))))
+    limit, k, p = math.exp(-mean), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def generate(path, rows, months, seed=42, log=print):
+    """Crée la base `path` avec environ `rows` faits répartis sur `months` mois"""
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    nb_rh = max(1, math.ceil(rows / (len(KPIS) * months)))
+    names = recruiter_names(nb_rh)
+    calendar = periods(months)
+    noms_mois = {num: nom for _, num, nom in MOIS}
+
+    conn = sqlite3.connect(path)
+    # Chargement en masse : pas de journal, index secondaires et agrégats créés après coup
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    start = time.perf_counter()
+    with conn:
+        create_schema(conn)
+        drop_rollups(conn)
+        conn.execute("DROP INDEX IF EXISTS idx_fact_rh_periode")
+        conn.execute("DROP INDEX IF EXISTS idx_fact_periode")
+        conn.executemany("INSERT INTO dim_kpi (kpi_id, kpi_nom) VALUES (?, ?)",
+                         [(i + 1, nom) for i, (nom, _) in enumerate(KPIS)])
+        conn.executemany(
+            "INSERT INTO dim_rh (rh_id, rh_nom, periode_recrutement) VALUES (?, ?, ?)",
+            [(i + 1, nom, f"Q{rng.randint(1, 4)}/{rng.randint(2019, LAST_PERIOD[0])}") for i, nom in enumerate(names)],
+        )
+        conn.executemany("""
+            INSERT INTO dim_periode (periode_id, annee, mois_num, trimestre, mois, date_periode)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(a * 100 + m, a, m, (m + 2) // 3, noms_mois[m], f"{a:04d}-{m:02d}-01") for a, m in calendar])
+
+        # Productivité propre à chaque recruteur, stable sur toute la période
+        productivite = [rng.lognormvariate(0, 0.35) for _ in names]
+
+        def facts():
+            # Ordre de la clé primaire (kpi, rh, période) : insertion en fin d'arbre
+            for kpi_id, (_, moyenne) in enumerate(KPIS, start=1):
+                for rh_id in range(1, nb_rh + 1):
+                    for annee, mois in calendar:
+                        valeur = _poisson(rng, moyenne * productivite[rh_id - 1] * SAISON[mois])
+                        yield kpi_id, rh_id, annee * 100 + mois, valeur, None
+
+        batch, total = [], 0
+        for fact in facts():
+            batch.append(fact)
+            if len(batch) >= BATCH_SIZE:
+                conn.executemany("INSERT INTO fact_kpi VALUES (?, ?, ?, ?, ?)", batch)
+                total += len(batch)
+                batch = []
+                log(f"  {total} lignes...")
+        conn.executemany("INSERT INTO fact_kpi VALUES (?, ?, ?, ?, ?)", batch)
+        total += len(batch)
+        # Recrée les index et les agrégats (remplis car ils viennent d'être créés)
+        create_schema(conn)
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+    log(f"✅ {path} : {total} lignes, {nb_rh} recruteurs, {months} mois en {time.perf_counter() - start:.1f}s")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=sorted(SIZES), default="100k")
+    parser.add_argument("--rows", type=int, help="nombre de lignes visé (remplace --size)")
+    parser.add_argument("--months", type=int, help="nombre de mois couverts (remplace --size)")
+    parser.add_argument("--output", required=True, help="chemin de la base générée (écrasée si elle existe)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rows, months = SIZES[args.size]
+    generate(args.output, args.rows or rows, args.months or months, args.seed)
+
+
+if __name__ == "__main__":
+    main()
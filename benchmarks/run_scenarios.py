@@ -0,0 +1,238 @@
+"""Latence de bout en bout de la chaîne question -> SQL -> DataFrame -> graphique, avec un Groq simulé.
+
+Usage : python benchmarks/run_scenarios.py --db /tmp/bench_100k.db --apps main interface app \\
+            --iterations 20 --latency 0.4 --jitter 0.1 [--cold] [--compare benchmarks/results/ancien.json]
+
+La base se génère avec benchmarks/generate_data.py. Les résultats (p50/p95/p99 par étape et de bout en bout)
+sont écrits en JSON dans benchmarks/results/ pour comparer les commits entre eux. Un scénario compte comme
+une erreur s'il lève une exception, si la garde refuse sa requête ou s'il ne rend aucune ligne ("lignes": false
+dans scenarios.json pour l'autoriser).
+"""
+import argparse
+import contextlib
+import datetime
+import importlib
+import io
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+SCENARIOS_PATH = os.path.join(BENCH_DIR, "scenarios.json")
+STAGES = ["llm", "sql", "chart", "total"]
+PERCENTILES = [50, 95, 99]
+
+
+def percentile(values, p):
+    """Percentile au rang le plus proche (valeurs en secondes)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered), math.ceil(p / 100 * len(ordered))) - 1)
+    return ordered[rank]
+
+
+def summarize(samples):
+    summary = {}
+    for stage in STAGES:
+        values = samples[stage]
+        summary[stage] = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+        summary[stage]["moyenne"] = sum(values) / len(values) if values else None
+        summary[stage]["n"] = len(values)
+    return summary
+
+
+class ScenarioError(Exception):
+    """Scénario exécuté sans erreur Python mais sans résultat exploitable"""
+
+
+def guard_rejections():
+    """Requêtes refusées ou interrompues par la garde depuis le démarrage"""
+    import core
+    stats = core.get_guard().stats()
+    return stats["refusees"] + stats["interrompues"]
+
+
+def read_sql(sql):
+    """Étape SQL des applications Streamlit : DataFrame vide quand la garde refuse ou que SQLite échoue"""
+    import core
+    try:
+        return core.run_sql(sql)
+    except Exception as e:
+        print(f"Erreur SQL : {e}")
+        return core.empty_dataframe()
+
+
+def load_pipeline(name):
+    """Étapes (llm, sql, chart) d'une des trois applications, importée avec le Groq simulé"""
+    module = importlib.import_module(name)
+    from core import generate_sql
+    if name == "main":
+        return generate_sql, module.execute_sql_query, module.visualize_trends
+    from charts import pivot_by_month
+
+    def chart(df, kpi_name):
+        if not all(c in df.columns for c in ("mois", "rh_nom", "valeur")):
+            return None
+        return module.render_trends(pivot_by_month(df), kpi_name)
+    if name == "app":
+        def llm(question):
+            sql = module.extract_sql(module.ask_llm(question))
+            return module.prepare_sql(question, sql) if sql else sql
+        return llm, read_sql, chart
+    return generate_sql, read_sql, chart
+
+
+def run_pipeline(name, scenarios, iterations, warmup, cold):
+    import llm_cache
+    import charts
+    import core
+
+    llm, execute, chart = load_pipeline(name)
+    samples = {stage: [] for stage in STAGES}
+    errors = 0
+    # Appels au Groq simulé et relances après échec de la réparation locale du SQL
+    calls_before = core.get_client().calls
+    tokens_before = core.get_client().prompt_tokens
+    retries_before = core.get_repairer().stats()["relances_llm"]
+    for iteration in range(warmup + iterations):
+        for scenario in scenarios:
+            if cold:
+                llm_cache.get_cache().clear()
+                charts.clear_chart_cache()
+            timings = {}
+            output = io.StringIO()
+            try:
+                # Les affichages des applications ne doivent pas fausser les mesures
+                with contextlib.redirect_stdout(output):
+                    rejected = guard_rejections()
+                    start = time.perf_counter()
+                    sql = llm(scenario["question"])
+                    timings["llm"] = time.perf_counter() - start
+                    step = time.perf_counter()
+                    df = execute(sql)
+                    timings["sql"] = time.perf_counter() - step
+                    step = time.perf_counter()
+                    if scenario.get("kpi") and not df.empty:
+                        chart(df, scenario["kpi"])
+                    timings["chart"] = time.perf_counter() - step
+                    timings["total"] = time.perf_counter() - start
+                # Les applications rendent un DataFrame vide quand la garde refuse la requête ou que
+                # SQLite échoue : ce n'est pas une mesure valable
+                if guard_rejections() > rejected:
+                    raise ScenarioError("requête refusée ou interrompue par la garde")
+                if df.empty and scenario.get("lignes", True):
+                    raise ScenarioError("aucune ligne")
+            except Exception as e:
+                errors += 1
+                detail = output.getvalue().strip().splitlines()
+                print(f"  ! {name} / {scenario['question'][:50]} : {e}" + (f" ({detail[-1]})" if detail else ""))
+                continue
+            if iteration >= warmup:
+                for stage, value in timings.items():
+                    samples[stage].append(value)
+    result = summarize(samples)
+    result["erreurs"] = errors
+    questions = (warmup + iterations) * len(scenarios)
+    calls = core.get_client().calls - calls_before
+    result["appels_llm_par_question"] = calls / questions
+    result["jetons_prompt_par_appel"] = (core.get_client().prompt_tokens - tokens_before) / calls if calls else 0
+    result["relances_llm"] = core.get_repairer().stats()["relances_llm"] - retries_before
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnu"
+
+
+def print_results(results, reference=None):
+    print(f"{'app':<10} {'étape':<6} " + " ".join(f"{'p' + str(p) + ' (ms)':>12}" for p in PERCENTILES))
+    for app, stages in results.items():
+        for stage in STAGES:
+            cells = []
+            for p in PERCENTILES:
+                value = stages[stage][f"p{p}"]
+                cell = "-" if value is None else f"{value * 1000:.1f}"
+                old = (reference or {}).get(app, {}).get(stage, {}).get(f"p{p}")
+                if value is not None and old:
+                    cell += f" ({(value - old) / old * 100:+.0f}%)"
+                cells.append(f"{cell:>12}")
+            print(f"{app:<10} {stage:<6} " + " ".join(cells))
+        print(f"{app:<10} {stages['appels_llm_par_question']:.2f} appel(s) Groq par question, "
+              f"{stages['relances_llm']} relance(s) après échec de la réparation SQL, "
+              f"{stages.get('jetons_prompt_par_appel', 0):.0f} jetons de prompt par appel")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="base générée par benchmarks/generate_data.py")
+    parser.add_argument("--apps", nargs="+", choices=["main", "interface", "app"], default=["main", "interface", "app"])
+    parser.add_argument("--scenarios", default=SCENARIOS_PATH)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1, help="itérations non mesurées")
+    parser.add_argument("--latency", type=float, default=0.4, help="latence simulée de Groq (s)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="variation de la latence simulée (s)")
+    parser.add_argument("--cold", action="store_true", help="vide les caches LLM et graphiques avant chaque question")
+    parser.add_argument("--output", help="fichier JSON de résultats (par défaut dans benchmarks/results/)")
+    parser.add_argument("--compare", help="résultats d'un commit précédent à comparer")
+    args = parser.parse_args()
+
+    with open(args.scenarios, encoding="utf-8") as f:
+        scenarios = json.load(f)
+
+    # La base doit être choisie avant l'import de db.py, et le vrai cache LLM ne doit pas être touché
+    os.environ["RH_CHAT_DB"] = os.path.abspath(args.db)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    import fake_groq
+    fake_groq.install(latency=args.latency, jitter=args.jitter, seed=0,
+                      answers={s["question"]: s["sql"] for s in scenarios})
+    import llm_cache
+    tmpdir = tempfile.mkdtemp(prefix="bench_llm_cache_")
+    llm_cache._default_cache = llm_cache.LLMCache(os.path.join(tmpdir, "llm_cache.db"))
+
+    results = {}
+    for app in args.apps:
+        print(f"▶ {app} ({len(scenarios)} scénarios x {args.iterations} itérations)")
+        try:
+            results[app] = run_pipeline(app, scenarios, args.iterations, args.warmup, args.cold)
+        except ImportError as e:
+            print(f"  ! {app} ignorée : {e}")
+
+    reference = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            reference = json.load(f)["resultats"]
+    print_results(results, reference)
+
+    commit = git_commit()
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d_%H%M%S}_{commit}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "config": {"db": os.path.basename(args.db), "iterations": args.iterations, "warmup": args.warmup,
+                       "latency": args.latency, "jitter": args.jitter, "cold": args.cold},
+            "resultats": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Résultats : {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Rendu des graphiques hors écran (sans pyplot), en PNG/SVG en mémoire, avec cache borné en taille.
+
+matplotlib n'est importé qu'au premier rendu effectif.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from llm_cache import normalize_question
+from fast_path import MOIS_NUMEROS
+from tracing import span, annotate
+
+# Taille maximale du cache de graphiques rendus (octets)
+CHART_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class ChartCache:
+    """Cache LRU de graphiques rendus, borné par la taille totale des images"""
+
+    def __init__(self, max_bytes=CHART_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._items), "bytes": self.size}
+
+
+_cache = ChartCache()
+# matplotlib n'est pas garanti thread-safe : un rendu à la fois
+_render_lock = threading.Lock()
+
+
+def month_sort_key(mois):
+    """Clé de tri chronologique d'un mois français, quelle que soit sa casse ou son accentuation"""
+    return MOIS_NUMEROS.get(normalize_question(str(mois)), 99), str(mois)
+
+
+def pivot_by_month(df, index="mois", columns="rh_nom", values="valeur"):
+    """Tableau croisé mois x recruteur, trié chronologiquement"""
+    with span("pivot"):
+        pivot = df.pivot_table(index=index, columns=columns, values=values, aggfunc="sum").fillna(0)
+        return pivot.reindex(sorted(pivot.index, key=month_sort_key))
+
+
+def chart_key(pivot, **params):
+    """Empreinte des données croisées et des paramètres du graphique"""
+    import pandas as pd
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(pivot, index=True).values.tobytes())
+    digest.update(repr([str(c) for c in pivot.columns]).encode("utf-8"))
+    digest.update(repr(sorted(params.items())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _draw(ax, pivot, kind):
+    positions = list(range(len(pivot.index)))
+    if kind == "bar":
+        width = 0.8 / max(len(pivot.columns), 1)
+        for i, column in enumerate(pivot.columns):
+            offsets = [p - 0.4 + width * (i + 0.5) for p in positions]
+            ax.bar(offsets, pivot[column].values, width=width, label=str(column))
+    else:
+        for column in pivot.columns:
+            ax.plot(positions, pivot[column].values, marker="o", label=str(column))
+    ax.set_xticks(positions)
+
+
+def render_chart(pivot, kind="bar", title="", xlabel="Mois", ylabel="Valeur", legend_title="Recruteur",
+                 fmt="png", figsize=(12, 6), rotation=0, grid_axis="y"):
+    """Rend le graphique en octets PNG/SVG ; un graphique identique est servi depuis le cache"""
+    params = dict(kind=kind, title=title, xlabel=xlabel, ylabel=ylabel, legend_title=legend_title,
+                  fmt=fmt, figsize=tuple(figsize), rotation=rotation, grid_axis=grid_axis)
+    key = chart_key(pivot, **params)
+    data = _cache.get(key)
+    annotate(cache_graphique="miss" if data is None else "hit")
+    if data is not None:
+        return data
+
+    from matplotlib.figure import Figure
+    with span("rendu"), _render_lock:
+        fig = Figure(figsize=figsize)
+        ax = fig.subplots()
+        _draw(ax, pivot, kind)
+        ax.set_xticklabels([str(i) for i in pivot.index], rotation=rotation)
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.legend(title=legend_title)
+        if grid_axis:
+            ax.grid(axis=grid_axis, linestyle="--", alpha=0.7)
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt)
+    data = buffer.getvalue()
+    _cache.put(key, data)
+    return data
+
+
+def chart_cache_stats():
+    return _cache.stats()
+
+
+def clear_chart_cache():
+    _cache.clear()
@@ -0,0 +1,176 @@
+"""Mémoire de conversation bornée, pour les questions de suivi ("et pour août ?").
+
+Le contexte résolu (intention, KPI, recruteurs, périodes) est gardé sous forme structurée : une
+question de suivi est complétée par les éléments qu'elle ne précise pas et devient une question
+autonome, que la voie rapide et le cache LLM traitent comme les autres. Les derniers échanges
+(question, SQL) sont joints tels quels, les plus anciens sont résumés en quelques mots-clés, dans un
+budget de jetons fixe quelle que soit la longueur de la conversation.
+"""
+from collections import Counter, deque
+from entity_index import fold
+from fast_path import INTENTIONS
+from prompt_builder import PromptBuilder, count_tokens
+
+# Budget de jetons du contexte ajouté à une question de suivi (état résolu et historique)
+MAX_CONTEXT_TOKENS = 300
+# Échanges récents joints tels quels ; les plus anciens sont résumés
+RECENT_TURNS = 3
+# Mots-clés (KPI, recruteurs) cités dans le résumé des échanges anciens
+SUMMARY_TOPICS = 3
+# Au-delà, une question est considérée comme autonome
+FOLLOW_UP_MAX_WORDS = 8
+# Premiers mots qui marquent une question de suivi
+FOLLOW_UP_MARKERS = {"et", "pour", "meme", "idem", "aussi", "puis", "maintenant", "encore", "sinon", "plutot",
+                     "ou", "mais"}
+# Question elliptique sans marqueur ("Pauline ?", "en août ?") : au plus ce nombre de mots
+ELLIPTICAL_MAX_WORDS = 4
+# Premiers mots d'une question complète : sans marqueur de suivi, elle est autonome
+QUESTION_WORDS = {"qui", "quel", "quelle", "quels", "quelles", "combien", "comment", "pourquoi", "quand",
+                  "affiche", "montre", "donne", "liste", "compare", "est"}
+# Intentions de classement ou de comparaison : les recruteurs sont ce que la question cherche
+RANKING_INTENTS = {"max", "min", "compare"}
+RANKING_WORDS = (" qui ", " quel recruteur", " quelle recruteuse", " quels recruteurs", " quelles recruteuses")
+# Longueur maximale d'une question précédente citée dans l'historique
+MAX_QUESTION_CHARS = 160
+
+STATE_KEYS = ("intention", "kpis", "recruteurs", "periodes")
+
+
+def _intent(question):
+    """(intention, mot-clé) de la question (voir fast_path.INTENTIONS), (None, None) si aucune"""
+    padded = f" {fold(question)} "
+    for intent, words in INTENTIONS:
+        for word in words:
+            if word in padded:
+                return intent, word.strip()
+    return None, None
+
+
+def _asks_for_recruiters(question):
+    """Vrai pour « qui... », « quel recruteur... », les classements et comparaisons : le contexte ne doit
+    pas fixer les recruteurs qu'elle cherche"""
+    padded = f" {fold(question)} "
+    return _intent(question)[0] in RANKING_INTENTS or any(word in padded for word in RANKING_WORDS)
+
+
+def _quoted(values):
+    return ", ".join(f"'{v}'" for v in values)
+
+
+class Resolution:
+    """Question telle que posée et sa forme autonome (`text`), avec l'historique joint au prompt"""
+
+    def __init__(self, question, text, state, history=None, follow_up=False):
+        self.question = question
+        self.text = text
+        self.state = state
+        self.history = history
+        self.follow_up = follow_up
+        self.sql = None
+
+
+class Conversation:
+    """État d'une conversation (une session) : contexte résolu, échanges récents et résumé des anciens"""
+
+    def __init__(self, max_tokens=MAX_CONTEXT_TOKENS, recent_turns=RECENT_TURNS):
+        self.max_tokens = max_tokens
+        self.state = dict.fromkeys(STATE_KEYS)
+        self.recent = deque(maxlen=recent_turns)
+        self.topics = Counter()
+        self.older_turns = 0
+        self.last = None
+
+    def is_follow_up(self, question, found):
+        """Question courte qui précise un élément du contexte : commence par « et », « pour »... ("et pour
+        août ?", "et Pauline ?") ou est elliptique, sans KPI ni intention ("Pauline ?", "en août ?").
+        Une question complète ("Qui a le meilleur total en juillet ?") reste autonome, comme « merci »"""
+        if self.last is None or not any(found.values()):
+            return False
+        words = fold(question).split()
+        if len(words) > FOLLOW_UP_MAX_WORDS:
+            return False
+        if words[0] in FOLLOW_UP_MARKERS:
+            return True
+        return (len(words) <= ELLIPTICAL_MAX_WORDS and words[0] not in QUESTION_WORDS
+                and not found["kpis"] and not found["intention"])
+
+    def resolve(self, question, builder):
+        """Forme autonome de la question ; la même question resoumise (rerun) garde sa résolution"""
+        if self.last is not None and question == self.last.question:
+            return self.last
+        selection = builder.select(question)
+        found = {
+            "intention": _intent(question)[1],
+            "kpis": selection["kpis_principaux"],
+            "recruteurs": selection["recruteurs"],
+            "periodes": [PromptBuilder.period_label(p) for p in selection["periodes"]],
+        }
+        if not self.is_follow_up(question, found):
+            return Resolution(question, question, found)
+        # Ce que la question ne précise pas est repris du contexte
+        state = {key: found[key] or self.state[key] for key in STATE_KEYS}
+        if _asks_for_recruiters(question):
+            state["recruteurs"] = found["recruteurs"]
+        text = self._standalone(question, state)
+        history = self._history(self.max_tokens - count_tokens(text) + count_tokens(question))
+        return Resolution(question, text, state, history, follow_up=True)
+
+    def record(self, resolution, sql=None):
+        """Enregistre l'échange répondu ; l'échange qui sort des récents rejoint le résumé"""
+        if resolution is self.last:
+            return
+        if len(self.recent) == self.recent.maxlen:
+            old = self.recent[0]
+            self.topics.update(old.state["kpis"] or [])
+            self.topics.update(old.state["recruteurs"] or [])
+            self.older_turns += 1
+        resolution.sql = sql
+        self.recent.append(resolution)
+        # Une question sans KPI, recruteur ni période ("merci") ne remplace pas le contexte
+        if any(resolution.state.values()):
+            self.state = resolution.state
+        self.last = resolution
+
+    def _standalone(self, question, state):
+        parts = []
+        if state["intention"]:
+            parts.append(state["intention"])
+        if state["kpis"]:
+            parts.append(f"KPI {_quoted(state['kpis'])}")
+        if state["recruteurs"]:
+            parts.append(f"recruteurs {_quoted(state['recruteurs'])}")
+        if state["periodes"]:
+            parts.append(f"période {', '.join(state['periodes'])}")
+        return f"{question} (suite : {' ; '.join(parts)})" if parts else question
+
+    def _history(self, budget):
+        """Échanges récents (le dernier avec son SQL) puis résumé des anciens, dans `budget` jetons"""
+        lines = []
+        for position, turn in enumerate(reversed(self.recent)):
+            line = f"- {turn.text[:MAX_QUESTION_CHARS]}"
+            if position == 0 and turn.sql:
+                line += f"\n  SQL : {turn.sql}"
+            lines.append(line)
+        if self.older_turns:
+            topics = _quoted(t for t, _ in self.topics.most_common(SUMMARY_TOPICS))
+            lines.append(f"- Plus tôt : {self.older_turns} question(s)" + (f" sur {topics}" if topics else ""))
+        header = "Échanges précédents (du plus récent au plus ancien) :"
+        kept, used = [], count_tokens(header)
+        for line in lines:
+            cost = count_tokens(line)
+            if used + cost > budget:
+                # Le SQL du dernier échange est le plus coûteux : sans lui, la question peut encore tenir
+                line = line.split("\n")[0]
+                cost = count_tokens(line)
+                if used + cost > budget:
+                    break
+            kept.append(line)
+            used += cost
+        return "\n".join([header] + kept) if kept else None
+
+    def stats(self):
+        return {
+            "echanges": len(self.recent) + self.older_turns,
+            "resumes": self.older_turns,
+            "etat": self.state,
+        }
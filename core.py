@@ -0,0 +1,307 @@
+"""Logique partagée par main.py, interface.py et app.py, importable sans dépendance lourde.
+
+pandas, matplotlib et groq ne sont chargés qu'au premier usage ; le client Groq, le pool SQLite et
+les objets construits à partir de la base (routeur, réécriture, garde) sont créés à la première question.
+"""
+import json
+import os
+import re
+import threading
+import tracing
+from db import get_read_pool
+from llm_cache import context_fingerprint
+
+# Modèle Groq utilisé pour la génération SQL
+MODEL = "llama3-70b-8192"
+
+# Liste exacte des noms de KPI
+KPI_LIST = [
+    "Nb de candidats contactés",
+    "Nb d'entretiens candidats Salariés",
+    "Nb d'entretiens candidats Sous-Traitants",
+    "Nb de candidats recrutés Salariés",
+    "Nb de candidats intégrés Sous Traitants",
+    "Nombre de présentations clients",
+    "Nb de refus CDI Salariés",
+    "Nombre de KO candidat à la suite d'une présentation client",
+    "Nombre de KO client à la suite d'une présentation client"
+]
+
+# Questions d'exemple affichées au démarrage de la CLI (aussi préparées d'avance par warmup.py)
+EXAMPLE_QUESTIONS = [
+    "Quel est le total des 'Nb de candidats contactés' par Inès en septembre ?",
+    "Compare les 'Nb d'entretiens candidats Salariés' de Mariéme et Samya sur le trimestre",
+    "Qui a le plus de 'Nb de candidats recrutés Salariés' en août ?",
+    "Affiche l'évolution des 'Nb de candidats contactés' par mois pour chaque recruteur",
+]
+
+# Prompt de génération SQL commun à la CLI, à interface.py et aux réponses préparées par warmup.py
+SQL_PROMPT = """
+Tu es un expert SQLite spécialisé en ressources humaines.
+{contexte}
+
+Règles importantes :
+1. Les noms des KPI, des recruteurs et des mois doivent être exactement ceux indiqués (casse et accents compris)
+2. Utilise toujours des alias explicites pour les colonnes
+3. Pour les analyses, sélectionne 'rh_nom', 'mois' et 'valeur' et regroupe par 'rh_nom' et 'mois' si nécessaire
+4. Ne renvoie QUE du code SQL SQLite, sans commentaires ni explications
+"""
+
+
+def clean_sql_query(sql_query):
+    """Nettoie la requête SQL en supprimant les backticks et les marqueurs de code"""
+    cleaned = re.sub(r'```sql|```', '', sql_query, flags=re.IGNORECASE)
+    cleaned = cleaned.replace('`', '')
+    return cleaned.strip()
+
+
+def extract_sql(response_text):
+    """Extrait le bloc ```sql d'une réponse en langage naturel (None s'il n'y en a pas)"""
+    if "```sql" in response_text:
+        start = response_text.find("```sql") + 6
+        end = response_text.find("```", start)
+        return response_text[start:end].strip()
+    return None
+
+
+def extract_kpi_name(query, default="Indicateur RH"):
+    """Extrait le nom du KPI de la question (accents, casse et apostrophes ignorés)"""
+    from entity_index import fold
+    folded = f" {fold(query)} "
+    for kpi in KPI_LIST:
+        if f" {fold(kpi)} " in folded:
+            return kpi
+    return default
+
+
+def read_questions(stream):
+    """Questions d'un flux JSONL ({"question": ..., "id": ...}) ou texte (une question par ligne)"""
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            item = line
+        if isinstance(item, dict):
+            question = item.get("question")
+            ident = item.get("id", number)
+        else:
+            question, ident = str(item), number
+        if question:
+            yield ident, question
+
+
+# --- Ressources créées au premier usage ---
+
+_lock = threading.RLock()
+_resources = {}
+
+
+def _lazy(name, factory):
+    with _lock:
+        if name not in _resources:
+            _resources[name] = factory()
+        return _resources[name]
+
+
+def get_client():
+    """Client Groq du processus ; groq et dotenv ne sont importés qu'au premier appel"""
+    def create():
+        from dotenv import load_dotenv
+        from groq import Groq
+        load_dotenv()
+        return Groq(api_key=os.getenv("GROQ_API_KEY"))
+    return _lazy("client", create)
+
+
+def get_pool():
+    """Pool de connexions en lecture seule sur la base SQLite"""
+    return get_read_pool()
+
+
+def get_router():
+    """Routeur local pour les questions KPI simples (évite l'appel à Groq)"""
+    def create():
+        from fast_path import FastPathRouter
+        with get_pool().connection() as conn:
+            return FastPathRouter.from_connection(conn, KPI_LIST)
+    return _lazy("router", create)
+
+
+def get_rewriter():
+    """Réécriture des requêtes agrégées vers les tables d'agrégats trimestriels"""
+    def create():
+        from rollups import RollupRewriter
+        with get_pool().connection() as conn:
+            return RollupRewriter.from_connection(conn)
+    return _lazy("rewriter", create)
+
+
+def get_guard():
+    """Garde d'exécution : plan vérifié, budget de temps et plafonds pour le SQL généré"""
+    def create():
+        from sql_guard import QueryGuard
+        with get_pool().connection() as conn:
+            return QueryGuard.from_connection(conn)
+    return _lazy("guard", create)
+
+
+def get_entity_index():
+    """Valeurs canoniques des recruteurs, KPI et mois, vérifiées au plus toutes les quelques secondes"""
+    def create():
+        from entity_index import EntityIndex
+        return EntityIndex()
+    index = _lazy("entities", create)
+    index.refresh_if_stale(get_pool())
+    return index
+
+
+def get_repairer():
+    """Réparation locale du SQL généré (guillemets, prose, identifiants, littéraux), à partir de la base"""
+    def create():
+        from sql_repair import SQLRepairer
+        entities = get_entity_index()
+        with get_pool().connection() as conn:
+            return SQLRepairer.from_connection(conn, entities)
+    return _lazy("repairer", create)
+
+
+def get_prompt_builder():
+    """Catalogue du prompt (schéma, KPI, recruteurs, périodes), reconstruit quand les valeurs changent"""
+    from prompt_builder import PromptBuilder
+    entities = get_entity_index()
+    with _lock:
+        builder = _resources.get("prompt")
+        if builder is None or builder.version != entities.version:
+            with get_pool().connection() as conn:
+                builder = PromptBuilder.from_connection(conn, entities)
+            _resources["prompt"] = builder
+        return builder
+
+
+def build_prompt(template, question):
+    """Prompt système pour la question : `{contexte}` est remplacé par le schéma et les seules valeurs utiles.
+
+    Retourne (prompt, empreinte) ; l'empreinte ne dépend pas de la question, mais du modèle, des
+    règles et du catalogue complet, pour le cache LLM.
+    """
+    from prompt_builder import count_tokens
+    with tracing.span("prompt"):
+        builder = get_prompt_builder()
+        context = builder.build(question)
+        prompt = template.replace("{contexte}", context.text)
+    tracing.annotate(jetons_contexte=context.tokens, jetons_prompt_estimes=count_tokens(prompt))
+    return prompt, context_fingerprint(MODEL, template, builder.fingerprint)
+
+
+def data_version():
+    """Version courante des données (base courante et trimestres archivés), pour les caches de résultats"""
+    from partitions import data_version as read_version
+    with get_pool().connection() as conn:
+        return read_version(conn)
+
+
+def attach_partitions(conn, sql, params=None):
+    """Attache à la connexion les seuls trimestres archivés que la requête peut lire"""
+    from partitions import get_catalog
+    with tracing.span("partitions"):
+        keys = get_catalog().prepare(conn, sql, params)
+    if keys:
+        tracing.annotate(trimestres_archives=len(keys))
+
+
+def run_sql(sql, params=None):
+    """Exécute une requête (redirigée vers les agrégats si possible) sous la garde ; lève GuardError"""
+    with tracing.span("reecriture"):
+        sql = get_rewriter().rewrite(sql)
+    pool = get_pool()
+    with pool.connection() as conn:
+        attach_partitions(conn, sql, params)
+        return get_guard().read_dataframe(pool, sql, params)
+
+
+def stream_sql(sql, params=None, chunk_size=None, check_cost=True):
+    """Comme run_sql, mais par blocs (colonnes, lignes) : la connexion reste prise tant que la lecture dure"""
+    with tracing.span("reecriture"):
+        sql = get_rewriter().rewrite(sql)
+    guard = get_guard()
+    with get_pool().connection() as conn:
+        attach_partitions(conn, sql, params)
+        yield from guard.stream(conn, sql, params, chunk_size, check_cost)
+
+
+def repair_sql(text, retry=None):
+    """Requête prête à exécuter (RepairResult) : réparée localement, validée par EXPLAIN.
+
+    En dernier recours seulement, `retry(sql, erreur)` redemande au LLM une requête corrigée à partir
+    de l'erreur précise ; sa réponse passe par la même réparation.
+    """
+    repairer = get_repairer()
+    with tracing.span("reparation"):
+        # Nouvelles données chargées depuis la dernière question : l'index des valeurs suit
+        get_entity_index()
+        with get_pool().connection() as conn:
+            result = repairer.repair(conn, text)
+    if result.ok or retry is None:
+        return result
+    tracing.count("relances_llm")
+    text = retry(result.sql, result.error)
+    with tracing.span("reparation"), get_pool().connection() as conn:
+        return repairer.repair(conn, text, retried=True)
+
+
+def empty_dataframe():
+    import pandas as pd
+    return pd.DataFrame()
+
+
+# --- Appels Groq ---
+
+def get_dispatcher():
+    """Répartiteur des appels Groq du processus : doublons en cours fusionnés, débit limité, priorités"""
+    def create():
+        from llm_dispatcher import LLMDispatcher
+        return LLMDispatcher(get_client)
+    return _lazy("dispatcher", create)
+
+
+def create_completion(**kwargs):
+    """Appel Groq via le répartiteur (fusion, limite de débit, reprise sur 429 et erreurs serveur)"""
+    return get_dispatcher().complete(**kwargs)
+
+
+def generate_sql(question, history=None):
+    """Requête SQL générée par Groq pour la question (cache persistant), réparée localement avant exécution.
+
+    `history` : échanges précédents de la conversation (questions de suivi), joints à la question.
+    """
+    from llm_cache import get_cache
+    # Seuls les KPI, recruteurs et périodes utiles à la question sont décrits (prompt_builder.py)
+    system_prompt, fingerprint = build_prompt(SQL_PROMPT, question)
+
+    def call_llm(correction=None):
+        content = f"{history}\n\nQuestion : {question}" if history else question
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": content}
+        ]
+        if correction:
+            # Relance avec la requête fautive et l'erreur SQLite précise
+            failed_sql, error = correction
+            messages += [
+                {"role": "assistant", "content": failed_sql},
+                {"role": "user", "content": f"Cette requête échoue avec l'erreur : {error}. Corrige-la."}
+            ]
+        response = create_completion(model=MODEL, messages=messages, temperature=0.1, max_tokens=500)
+        with tracing.span("nettoyage"):
+            return clean_sql_query(response.choices[0].message.content.strip())
+
+    cache = get_cache()
+    raw_sql = cache.get_or_compute("core.generate_sql", question, fingerprint, call_llm)
+    # Réparation locale avant exécution ; Groq n'est rappelé que si elle ne suffit pas
+    repaired = repair_sql(raw_sql, retry=lambda sql, error: call_llm((sql, error)))
+    if repaired.retried and repaired.ok:
+        cache.set("core.generate_sql", question, fingerprint, repaired.sql)
+    return repaired.sql
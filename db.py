@@ -0,0 +1,164 @@
+import sqlite3
+import threading
+import queue
+import os
+from contextlib import contextmanager
+
+# Base de données de recrutement (surchargeable via RH_CHAT_DB)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.getenv("RH_CHAT_DB", os.path.join(BASE_DIR, "recrutement.db"))
+
+# Réglages des connexions de lecture
+POOL_SIZE = 8
+CACHE_SIZE_KB = 16 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+BUSY_TIMEOUT_MS = 5000
+# Attente maximale d'une connexion quand toutes sont prêtées (secondes)
+ACQUIRE_TIMEOUT_S = 30.0
+
+
+def split_statements(script):
+    """Découpe un script SQL en instructions complètes (les corps de triggers restent entiers)"""
+    statements, current = [], ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    return [s for s in statements if s]
+
+
+def enable_wal(path=DB_PATH):
+    """Passe la base en journal WAL (persistant) pour que les lecteurs ne bloquent pas les écritures"""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    try:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if mode.lower() != "wal":
+            conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+
+def open_read_connection(path=DB_PATH):
+    """Ouvre une connexion en lecture seule (URI mode=ro) avec cache et mmap élargis"""
+    uri = f"file:{os.path.abspath(path)}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def open_write_connection(path=DB_PATH):
+    """Ouvre la connexion d'écriture (scripts de chargement et de correction)"""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+@contextmanager
+def write_transaction(path=DB_PATH):
+    """Connexion d'écriture le temps d'une transaction : commit si tout va bien, rollback sinon"""
+    conn = open_write_connection(path)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class PoolTimeout(Exception):
+    """Aucune connexion de lecture rendue au pool dans le délai imparti"""
+
+
+class ReadPool:
+    """Pool borné de connexions en lecture seule, chacune prêtée à un seul thread à la fois"""
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=ACQUIRE_TIMEOUT_S):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if os.path.exists(path):
+            enable_wal(path)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return open_read_connection(self.path)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        # Pool plein : on attend qu'une connexion soit rendue, sans bloquer indéfiniment
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"aucune connexion de lecture libre après {self.timeout:g} s "
+                              f"({self.size} connexions prêtées)") from None
+
+    @contextmanager
+    def connection(self):
+        """Prête une connexion ; un appel imbriqué dans le même thread réutilise la même"""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def query(self, sql, params=()):
+        """Exécute une lecture et retourne toutes les lignes"""
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def read_dataframe(self, sql, params=None):
+        """Exécute une lecture et retourne un DataFrame pandas"""
+        import pandas as pd
+        with self.connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_read_pool(path=DB_PATH, size=POOL_SIZE):
+    """Pool de lecture partagé par le processus pour une base donnée"""
+    key = os.path.abspath(path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ReadPool(path, size)
+        return _pools[key]
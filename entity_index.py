@@ -0,0 +1,240 @@
+"""Index des valeurs canoniques (recruteurs, KPI, mois) pour corriger les littéraux du SQL généré.
+
+Les clés sont normalisées (accents, casse, ponctuation, élisions) : 'Marienne', 'marieme', 'Juilet' ou
+"Nb entretiens candidats Salariés" retrouvent la valeur stockée en base. Au-delà des alias connus, une
+recherche par trigrammes puis par similarité rattrape les fautes de frappe. L'index est construit à
+partir des dimensions et mis à jour de façon incrémentale quand de nouvelles données sont chargées.
+"""
+import difflib
+import re
+import threading
+import time
+from llm_cache import normalize_question
+from fast_path import MOIS_NUMEROS, ALIAS_RECRUTEURS
+from schema import object_type
+from sql_repair import tokenize
+
+# Colonnes indexées : colonne de la vue -> (table de dimension, clé entière croissante)
+DIMENSIONS = {
+    "rh_nom": ("dim_rh", "rh_id"),
+    "kpi_nom": ("dim_kpi", "kpi_id"),
+    "mois": ("dim_periode", "periode_id"),
+}
+# Similarité minimale (difflib) pour accepter une correction approchée
+MIN_SIMILARITY = 0.8
+# Écart minimal entre les deux meilleurs candidats ; en deçà, le littéral est jugé ambigu
+AMBIGUITY_MARGIN = 0.05
+# Candidats issus des trigrammes comparés en détail
+MAX_CANDIDATES = 5
+# Intervalle minimal entre deux vérifications de fraîcheur de l'index (secondes)
+REFRESH_INTERVAL_S = 5.0
+
+COMPARISON_OPS = {"=", "==", "<>", "!="}
+
+
+def fold(text):
+    """Clé insensible aux accents, à la casse, à la ponctuation et aux élisions (d', l', j')"""
+    return re.sub(r"\b[dlj] ", "", normalize_question(str(text)))
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class EntityIndex:
+    """Valeurs canoniques par colonne, retrouvées par clé normalisée, alias ou trigrammes"""
+
+    def __init__(self):
+        self._exact = {column: {} for column in DIMENSIONS}
+        self._trigrams = {column: {} for column in DIMENSIONS}
+        self._signatures = {}
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+        self.resolved = 0
+        self.unresolved = 0
+        self.rebuilds = 0
+        self.increments = 0
+        # Incrémentée à chaque changement des valeurs : les catalogues dérivés se reconstruisent
+        self.version = 0
+
+    # --- Construction ---
+
+    def add(self, column, value, key=None):
+        """Ajoute une valeur canonique (sous sa clé normalisée, ou sous la clé d'un alias)"""
+        if value is None:
+            return
+        key = key or fold(value)
+        with self._lock:
+            self._exact[column].setdefault(key, value)
+            for gram in trigrams(key):
+                self._trigrams[column].setdefault(gram, set()).add(key)
+            if key == fold(value):
+                self._add_aliases(column, value, key)
+
+    def _add_aliases(self, column, value, key):
+        if column == "mois":
+            numero = MOIS_NUMEROS.get(key)
+            for alias, n in MOIS_NUMEROS.items():
+                if n == numero and alias != key:
+                    self.add(column, value, alias)
+        elif column == "rh_nom":
+            for alias, target in ALIAS_RECRUTEURS.items():
+                if fold(target) == key and alias != key:
+                    self.add(column, value, alias)
+
+    def _clear(self, column):
+        self._exact[column] = {}
+        self._trigrams[column] = {}
+
+    def refresh(self, conn):
+        """Met l'index à jour : nouvelles lignes des dimensions seulement, ou reconstruction si besoin"""
+        with self._lock:
+            star = object_type(conn, "dim_rh") == "table"
+            for column, (table, key) in DIMENSIONS.items():
+                if star:
+                    self._refresh_dimension(conn, column, table, key)
+                else:
+                    self._refresh_flat(conn, column)
+            self._checked_at = time.monotonic()
+
+    def _refresh_dimension(self, conn, column, table, key):
+        count, max_id, length = conn.execute(
+            f"SELECT COUNT(*), COALESCE(MAX({key}), 0), TOTAL(LENGTH({column})) FROM {table}"
+        ).fetchone()
+        previous = self._signatures.get(column)
+        if previous == (count, max_id, length):
+            return
+        if previous and count > previous[0] and max_id > previous[1]:
+            rows = conn.execute(f"SELECT {column} FROM {table} WHERE {key} > ?", (previous[1],)).fetchall()
+            # Dimensions en ajout seul : les nouvelles lignes expliquent tout l'écart de signature
+            if previous[0] + len(rows) == count and previous[2] + sum(len(r[0]) for r in rows) == length:
+                for (value,) in rows:
+                    self.add(column, value)
+                self._signatures[column] = (count, max_id, length)
+                self.increments += 1
+                self.version += 1
+                return
+        self._clear(column)
+        for (value,) in conn.execute(f"SELECT DISTINCT {column} FROM {table}"):
+            self.add(column, value)
+        self._signatures[column] = (count, max_id, length)
+        self.rebuilds += 1
+        self.version += 1
+
+    def _refresh_flat(self, conn, column):
+        # Ancienne table plate (avant migration) : reconstruction quand son contenu change
+        signature = conn.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM kpi_recrutement").fetchone()
+        if self._signatures.get(column) == signature:
+            return
+        self._clear(column)
+        for (value,) in conn.execute(f"SELECT DISTINCT {column} FROM kpi_recrutement"):
+            self.add(column, value)
+        self._signatures[column] = signature
+        self.rebuilds += 1
+        self.version += 1
+
+    def refresh_if_stale(self, pool, interval=REFRESH_INTERVAL_S):
+        """Vérifie la fraîcheur de l'index au plus une fois par `interval` secondes"""
+        if time.monotonic() - self._checked_at < interval:
+            return
+        with pool.connection() as conn:
+            self.refresh(conn)
+
+    # --- Recherche ---
+
+    def values(self, column):
+        """Valeurs canoniques distinctes de la colonne, triées"""
+        with self._lock:
+            return sorted(set(self._exact[column].values()), key=str)
+
+    def lookup(self, column, value):
+        """Valeur canonique pour un littéral de la colonne, None si inconnue ou ambiguë"""
+        key = fold(value)
+        with self._lock:
+            exact = self._exact[column].get(key)
+            if exact is not None:
+                return exact
+            counts = {}
+            for gram in trigrams(key):
+                for candidate in self._trigrams[column].get(gram, ()):
+                    counts[candidate] = counts.get(candidate, 0) + 1
+            best = sorted(counts, key=counts.get, reverse=True)[:MAX_CANDIDATES]
+            scored = sorted(((difflib.SequenceMatcher(None, key, c).ratio(), c) for c in best), reverse=True)
+            if not scored or scored[0][0] < MIN_SIMILARITY:
+                return None
+            values = [self._exact[column][c] for _, c in scored]
+            # Littéral tronqué contenu dans plusieurs valeurs ("Nb entretiens candidats") : ambigu
+            if len({v for (_, c), v in zip(scored, values) if key in c}) > 1:
+                return None
+            # Deux valeurs différentes presque aussi proches : mieux vaut ne rien corriger
+            if len(scored) > 1 and scored[0][0] - scored[1][0] < AMBIGUITY_MARGIN and values[0] != values[1]:
+                return None
+            return values[0]
+
+    def resolve_sql(self, sql):
+        """Remplace les littéraux comparés à rh_nom, kpi_nom ou mois par les valeurs canoniques.
+
+        Reconnaît `col = 'x'`, `'x' = col`, `col <> 'x'` et `col [NOT] IN ('x', 'y')` ; retourne
+        (sql, corrections).
+        """
+        tokens = tokenize(sql)
+        code = [i for i, (kind, _) in enumerate(tokens) if kind not in ("space", "comment")]
+        repairs = []
+        in_list = None
+        for position, i in enumerate(code):
+            kind, value = tokens[i]
+            opens_list = position + 1 < len(code) and tokens[code[position + 1]][1] == "("
+            if kind == "word" and value.upper() == "IN" and opens_list:
+                before = position - 2 if self._is_not(tokens, code, position - 1) else position - 1
+                in_list = self._column_before(tokens, code, before)
+                continue
+            if in_list is not None and kind == "op" and value == ")":
+                in_list = None
+                continue
+            if kind != "string":
+                continue
+            column = in_list
+            if column is None and position >= 2 and tokens[code[position - 1]][1] in COMPARISON_OPS:
+                column = self._column_before(tokens, code, position - 2)
+            if column is None and position + 2 < len(code) and tokens[code[position + 1]][1] in COMPARISON_OPS:
+                column = self._column_at(tokens, code[position + 2])
+            if column is None:
+                continue
+            literal = value[1:-1].replace("''", "'")
+            canonical = self.lookup(column, literal)
+            if canonical is not None and canonical != literal:
+                tokens[i] = (kind, _quote(canonical))
+                repairs.append(f"{column} : {value} -> {_quote(canonical)}")
+            # Compteurs partagés par les sessions Streamlit : mis à jour sous le verrou
+            with self._lock:
+                if canonical is None:
+                    self.unresolved += 1
+                elif canonical != literal:
+                    self.resolved += 1
+        return "".join(value for _, value in tokens), repairs
+
+    @staticmethod
+    def _is_not(tokens, code, position):
+        return position >= 0 and tokens[code[position]][1].upper() == "NOT"
+
+    def _column_before(self, tokens, code, position):
+        return self._column_at(tokens, code[position]) if position >= 0 else None
+
+    def _column_at(self, tokens, i):
+        kind, value = tokens[i]
+        name = value[1:-1] if kind == "quoted" else value if kind == "word" else None
+        return name.lower() if name and name.lower() in DIMENSIONS else None
+
+    def stats(self):
+        return {
+            "valeurs": {column: len(set(values.values())) for column, values in self._exact.items()},
+            "corrigees": self.resolved,
+            "inconnues": self.unresolved,
+            "reconstructions": self.rebuilds,
+            "mises_a_jour": self.increments,
+        }
@@ -0,0 +1,220 @@
+import re
+import threading
+from llm_cache import normalize_question
+from tracing import span, annotate
+
+# Mois français (forme normalisée -> numéro), y compris la coquille 'Juilet' des fichiers sources
+MOIS_NUMEROS = {
+    "janvier": 1, "fevrier": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6,
+    "juillet": 7, "juilet": 7, "aout": 8, "septembre": 9, "octobre": 10,
+    "novembre": 11, "decembre": 12,
+}
+
+# Variantes de noms de recruteurs rencontrées dans les prompts et les scripts de correction
+ALIAS_RECRUTEURS = {
+    "marienne": "mariéme",
+    "marieme": "mariéme",
+    "merienne": "mariéme",
+}
+
+# Années et trimestres cités dans une question ("en 2023", "au T2", "2e trimestre")
+ANNEE_RE = re.compile(r"\b(20\d{2})\b")
+TRIMESTRE_RE = re.compile(r"\b(?:t|q)([1-4])\b|\btrimestre ([1-4])\b|\b([1-4])(?:e|er|eme) trimestre\b")
+
+# Mots-clés (normalisés) qui déterminent le type d'agrégat
+INTENTIONS = [
+    ("evolution", ["evolution", "graphique", "par mois", "mensuel", "tendance"]),
+    ("max", ["qui a le plus", "le plus de", "meilleur", "maximum"]),
+    ("min", ["qui a le moins", "le moins de", "moins bon", "minimum"]),
+    ("compare", ["compare", "comparer", "comparaison", "versus", " vs "]),
+    ("total", ["total", "somme", "combien", "nombre total", "cumul"]),
+]
+
+
+def _cle(texte):
+    """Forme normalisée insensible aux élisions ("Nb d'entretiens" == "Nb entretiens")"""
+    return re.sub(r"\b[dlj] ", "", normalize_question(texte))
+
+
+class FastPathRoute:
+    """Requête SQL paramétrée produite localement, sans appel au LLM"""
+
+    def __init__(self, intent, kpi, recruteurs, mois, sql, params, annees=(), trimestres=()):
+        self.intent = intent
+        self.kpi = kpi
+        self.recruteurs = recruteurs
+        self.mois = mois
+        self.annees = list(annees)
+        self.trimestres = list(trimestres)
+        self.sql = sql
+        self.params = params
+
+    def describe(self):
+        """Résumé lisible de l'intention reconnue"""
+        rh = ", ".join(self.recruteurs) if self.recruteurs else "tous les recruteurs"
+        periode = self.mois + [f"T{t}" for t in self.trimestres] + [str(a) for a in self.annees]
+        periode = " ".join(periode) if periode else "toute la période"
+        return f"{self.intent} de '{self.kpi}' pour {rh} sur {periode}"
+
+
+class FastPathRouter:
+    """Reconnaît les questions KPI simples et construit la requête SQL sans passer par Groq"""
+
+    def __init__(self, kpi_list, recruteurs, mois, with_years=False):
+        self.kpis = {_cle(k): k for k in kpi_list}
+        self.recruteurs = {_cle(r): r for r in recruteurs}
+        for alias, cible in ALIAS_RECRUTEURS.items():
+            canonical = self.recruteurs.get(_cle(cible))
+            if canonical and alias not in self.recruteurs:
+                self.recruteurs[alias] = canonical
+        # Valeurs de mois telles que stockées en base, indexées par numéro
+        self.mois = {}
+        for m in mois:
+            numero = MOIS_NUMEROS.get(normalize_question(m))
+            if numero:
+                self.mois.setdefault(numero, []).append(m)
+        # Vue avec colonnes annee et trimestre (schéma en étoile) : filtres d'année et de trimestre
+        self.with_years = with_years
+        self.local = 0
+        self.fallback = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_connection(cls, conn, kpi_list):
+        """Construit le routeur à partir des valeurs réellement présentes dans kpi_recrutement"""
+        cursor = conn.cursor()
+        with_years = "annee" in {r[1] for r in cursor.execute("PRAGMA table_info(kpi_recrutement)")}
+        # Schéma en étoile : les dimensions couvrent aussi les trimestres archivés (partitions.py)
+        tables = {"kpi_nom": "dim_kpi", "rh_nom": "dim_rh", "mois": "dim_periode"} if with_years else {}
+
+        def distinct(column):
+            table = tables.get(column, "kpi_recrutement")
+            return [r[0] for r in cursor.execute(f"SELECT DISTINCT {column} FROM {table}")]
+
+        kpis = [k.strip() for k in distinct("kpi_nom")]
+        recruteurs = distinct("rh_nom")
+        mois = distinct("mois")
+        # Les noms de KPI_LIST servent de référence, les valeurs en base priment s'ils diffèrent
+        connus = {_cle(k): k for k in kpi_list}
+        connus.update({_cle(k): k for k in kpis})
+        return cls(list(connus.values()), recruteurs, mois, with_years)
+
+    def _find_kpi(self, question):
+        # La correspondance la plus longue l'emporte ("Nb d'entretiens ... Sous-Traitants" vs "Salariés")
+        trouves = [k for k in self.kpis if re.search(rf"\b{re.escape(k)}\b", question)]
+        if not trouves:
+            return None
+        trouves.sort(key=len, reverse=True)
+        meilleur = trouves[0]
+        # Plusieurs KPI distincts non imbriqués : question trop complexe pour la voie rapide
+        if any(k not in meilleur for k in trouves[1:]):
+            return None
+        return self.kpis[meilleur]
+
+    def _find_recruteurs(self, question):
+        trouves = []
+        for nom, canonical in self.recruteurs.items():
+            if re.search(rf"\b{re.escape(nom)}\b", question) and canonical not in trouves:
+                trouves.append(canonical)
+        return trouves
+
+    # Les trois recherches de période retournent None quand un terme cité ne peut pas devenir un filtre :
+    # répondre sur toute la période serait faux, la question repart vers le LLM
+
+    def _find_mois(self, question):
+        numeros = sorted({n for m, n in MOIS_NUMEROS.items() if re.search(rf"\b{m}\b", question)})
+        if any(n not in self.mois for n in numeros):
+            return None
+        return [v for n in numeros for v in self.mois[n]]
+
+    def _find_annees(self, question):
+        annees = sorted({int(a) for a in ANNEE_RE.findall(question)})
+        return None if annees and not self.with_years else annees
+
+    def _find_trimestres(self, question):
+        trimestres = sorted({int(next(g for g in groups if g)) for groups in TRIMESTRE_RE.findall(question)})
+        return None if trimestres and not self.with_years else trimestres
+
+    def _find_intent(self, question):
+        padded = f" {question} "
+        for intent, mots in INTENTIONS:
+            if any(mot in padded for mot in mots):
+                return intent
+        return None
+
+    def _ordre_mois(self):
+        cas = " ".join(f"WHEN '{v}' THEN {n}" for n, valeurs in sorted(self.mois.items()) for v in valeurs)
+        return f"CASE mois {cas} ELSE 99 END" if cas else "mois"
+
+    def parse(self, question):
+        """Retourne une FastPathRoute si la question est reconnue, sinon None"""
+        q = _cle(question)
+        kpi = self._find_kpi(q)
+        intent = self._find_intent(q)
+        if kpi is None or intent is None:
+            return None
+        recruteurs = self._find_recruteurs(q)
+        mois, annees, trimestres = self._find_mois(q), self._find_annees(q), self._find_trimestres(q)
+        if mois is None or annees is None or trimestres is None:
+            return None
+        if intent == "compare" and len(recruteurs) == 1:
+            return None
+
+        where = ["kpi_nom = ?"]
+        params = [kpi]
+        if recruteurs:
+            where.append(f"rh_nom IN ({', '.join('?' for _ in recruteurs)})")
+            params += recruteurs
+        if mois:
+            where.append(f"mois IN ({', '.join('?' for _ in mois)})")
+            params += mois
+        if annees:
+            where.append(f"annee IN ({', '.join('?' for _ in annees)})")
+            params += annees
+        if trimestres:
+            where.append(f"trimestre IN ({', '.join('?' for _ in trimestres)})")
+            params += trimestres
+        filtre = " AND ".join(where)
+
+        if intent == "evolution":
+            sql = (
+                f"SELECT rh_nom, mois, kpi_nom, SUM(valeur) AS valeur FROM kpi_recrutement "
+                f"WHERE {filtre} GROUP BY rh_nom, mois, kpi_nom ORDER BY rh_nom, {self._ordre_mois()}"
+            )
+        elif intent == "total" and not recruteurs:
+            sql = (
+                f"SELECT kpi_nom, SUM(valeur) AS total FROM kpi_recrutement "
+                f"WHERE {filtre} GROUP BY kpi_nom"
+            )
+        else:
+            sql = (
+                f"SELECT rh_nom, kpi_nom, SUM(valeur) AS total FROM kpi_recrutement "
+                f"WHERE {filtre} GROUP BY rh_nom, kpi_nom"
+            )
+            if intent in ("max", "compare"):
+                sql += " ORDER BY total DESC"
+            elif intent == "min":
+                sql += " ORDER BY total ASC"
+            if intent in ("max", "min"):
+                sql += " LIMIT 1"
+        return FastPathRoute(intent, kpi, recruteurs, mois, sql, tuple(params), annees, trimestres)
+
+    def route(self, question):
+        """Comme parse(), en comptabilisant la part des questions servies localement"""
+        with span("voie_rapide"):
+            route = self.parse(question)
+        annotate(voie_rapide=route is not None)
+        with self._lock:
+            if route is None:
+                self.fallback += 1
+            else:
+                self.local += 1
+        return route
+
+    def stats(self):
+        total = self.local + self.fallback
+        return {
+            "local": self.local,
+            "llm": self.fallback,
+            "local_share": self.local / total if total else 0.0,
+        }
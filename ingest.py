@@ -0,0 +1,304 @@
+"""Chargement incrémental des fichiers de suivi KPI (classeur Excel ou dossier de CSV) dans recrutement.db.
+
+Usage : python ingest.py Data.xlsx [autres.xlsx | dossier_csv ...] [--annee 2024] [--force]
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import os
+import re
+import unicodedata
+from db import DB_PATH, open_write_connection
+from schema import MOIS, DEFAULT_YEAR, create_schema, migrate_flat_table, object_type, bump_data_version
+import snapshot
+import warmup
+from partitions import get_catalog
+
+# alias -> (numéro, nom canonique) et numéro -> nom canonique
+MOIS_ALIAS = {alias: (num, nom) for alias, num, nom in MOIS}
+NOMS_MOIS = {num: nom for _, num, nom in MOIS}
+
+PERIODE_RE = re.compile(r"\bQ[1-4]\s*/\s*\d{4}\b", re.IGNORECASE)
+ANNEE_RE = re.compile(r"\b(20\d{2})\b")
+
+INGEST_LOG_SQL = """
+CREATE TABLE IF NOT EXISTS ingest_log (
+    source TEXT NOT NULL,
+    feuille TEXT NOT NULL,
+    empreinte TEXT NOT NULL,
+    lignes INTEGER NOT NULL,
+    charge_le TEXT NOT NULL,
+    PRIMARY KEY (source, feuille)
+)
+"""
+
+
+def _texte(cell):
+    if cell is None:
+        return ""
+    return str(cell).strip()
+
+
+def _sans_accents(texte):
+    texte = unicodedata.normalize("NFKD", texte)
+    return "".join(c for c in texte if not unicodedata.combining(c))
+
+
+def parse_mois(cell, annee):
+    """Reconnaît une cellule d'en-tête de mois ('Juillet', 'Juilet', 'Août 2025', date Excel)"""
+    if isinstance(cell, (datetime.date, datetime.datetime)):
+        return cell.year, cell.month, NOMS_MOIS[cell.month]
+    texte = _texte(cell).lower()
+    if not texte:
+        return None
+    mots = texte.split()
+    for alias in (mots[0], _sans_accents(mots[0])):
+        if alias in MOIS_ALIAS:
+            num, nom = MOIS_ALIAS[alias]
+            annee_cell = ANNEE_RE.search(texte)
+            return (int(annee_cell.group(1)) if annee_cell else annee), num, nom
+    return None
+
+
+def parse_valeur(cell):
+    """Valeur numérique d'une cellule ; None pour les cellules vides ou les marqueurs 'trimestriel'"""
+    if cell is None or isinstance(cell, bool):
+        return None
+    if isinstance(cell, (int, float)):
+        return int(cell)
+    texte = _texte(cell).replace(",", ".")
+    if not texte:
+        return None
+    try:
+        return int(float(texte))
+    except ValueError:
+        return None
+
+
+class SheetParser:
+    """Analyse une feuille de suivi KPI (en-tête sur deux lignes : période puis mois)"""
+
+    def __init__(self, rh_nom, annee):
+        self.rh_nom = rh_nom.strip()
+        self.annee = annee
+        self.periode = None
+        self.colonnes_mois = None
+        self.col_kpi = 1
+        self.col_commentaire = None
+        self.digest = hashlib.sha256()
+        self.records = []
+
+    def feed(self, row):
+        """Traite une ligne brute de la feuille (liste de cellules)"""
+        self.digest.update(repr([_texte(c) for c in row]).encode("utf-8"))
+        if self.colonnes_mois is None:
+            self._parse_entete(row)
+            return
+        kpi = _texte(row[self.col_kpi]) if len(row) > self.col_kpi else ""
+        if not kpi:
+            return
+        commentaire = ""
+        if self.col_commentaire is not None and len(row) > self.col_commentaire:
+            commentaire = _texte(row[self.col_commentaire])
+        for col, (annee, mois_num, mois_nom) in self.colonnes_mois.items():
+            valeur = parse_valeur(row[col]) if len(row) > col else None
+            if valeur is None:
+                # Cellule vide ou marqueur 'trimestriel' : pas de valeur mensuelle
+                continue
+            self.records.append((self.rh_nom, annee, mois_num, mois_nom, kpi, valeur, commentaire))
+
+    @property
+    def recognized(self):
+        """Vrai si la feuille suit la mise en page attendue (ligne de période puis ligne des mois)"""
+        return self.periode is not None and self.colonnes_mois is not None
+
+    def _parse_entete(self, row):
+        for cell in row:
+            match = PERIODE_RE.search(_texte(cell))
+            if match:
+                self.periode = match.group(0).replace(" ", "").upper()
+        colonnes = {}
+        for i, cell in enumerate(row):
+            mois = parse_mois(cell, self.annee)
+            if mois:
+                colonnes[i] = mois
+            texte = _sans_accents(_texte(cell).lower())
+            if texte == "kpi":
+                self.col_kpi = i
+            elif texte.startswith("commentaire"):
+                self.col_commentaire = i
+        # La ligne des mois n'est valable qu'après la ligne de période
+        if colonnes and self.periode is not None:
+            self.colonnes_mois = colonnes
+
+    @property
+    def fingerprint(self):
+        return self.digest.hexdigest()
+
+
+def iter_csv_sheets(path):
+    """Feuilles d'un fichier CSV ou d'un dossier de CSV exportés (une feuille par recruteur)"""
+    if os.path.isdir(path):
+        fichiers = sorted(f for f in os.listdir(path) if f.lower().endswith(".csv"))
+        chemins = [os.path.join(path, f) for f in fichiers]
+    else:
+        chemins = [path]
+    for chemin in chemins:
+        nom = os.path.splitext(os.path.basename(chemin))[0]
+        with open(chemin, newline="", encoding="utf-8-sig") as f:
+            yield os.path.basename(chemin), nom, csv.reader(f)
+
+
+def iter_xlsx_sheets(path):
+    """Feuilles d'un classeur Excel, lues en streaming (openpyxl en lecture seule)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise SystemExit("openpyxl est nécessaire pour lire les fichiers .xlsx (pip install openpyxl)")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield os.path.basename(path), sheet.title, sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_sheets(path):
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        return iter_xlsx_sheets(path)
+    return iter_csv_sheets(path)
+
+
+def ensure_schema(conn, annee=DEFAULT_YEAR):
+    """Prépare la base : migration de l'ancienne table plate si besoin, journal des chargements"""
+    if object_type(conn, "kpi_recrutement") == "table":
+        migrate_flat_table(conn, annee)
+    else:
+        create_schema(conn, annee)
+    conn.execute(INGEST_LOG_SQL)
+
+
+def upsert_records(conn, records, periode_recrutement=None):
+    """Insère ou met à jour les faits d'une feuille en masse ; retourne le nombre de lignes modifiées"""
+    if not records:
+        return 0
+    rh_nom = records[0][0]
+    conn.execute("INSERT OR IGNORE INTO dim_rh (rh_nom) VALUES (?)", (rh_nom,))
+    if periode_recrutement:
+        conn.execute("UPDATE dim_rh SET periode_recrutement = ? WHERE rh_nom = ?", (periode_recrutement, rh_nom))
+    rh_id = conn.execute("SELECT rh_id FROM dim_rh WHERE rh_nom = ?", (rh_nom,)).fetchone()[0]
+
+    kpis = sorted({r[4] for r in records})
+    conn.executemany("INSERT OR IGNORE INTO dim_kpi (kpi_nom) VALUES (?)", [(k,) for k in kpis])
+    kpi_ids = dict(conn.execute(
+        f"SELECT kpi_nom, kpi_id FROM dim_kpi WHERE kpi_nom IN ({', '.join('?' for _ in kpis)})", kpis
+    ).fetchall())
+
+    periodes = sorted({(r[1], r[2], r[3]) for r in records})
+    conn.executemany("""
+        INSERT OR IGNORE INTO dim_periode (periode_id, annee, mois_num, trimestre, mois, date_periode)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(a * 100 + m, a, m, (m + 2) // 3, nom, f"{a:04d}-{m:02d}-01") for a, m, nom in periodes])
+
+    rows = [
+        (kpi_ids[kpi], rh_id, annee * 100 + mois_num, valeur, commentaire or None)
+        for _, annee, mois_num, _, kpi, valeur, commentaire in records
+    ]
+    # Seules les lignes réellement différentes sont réécrites ; rowcount ne compte que les lignes de
+    # fact_kpi (total_changes compterait aussi les agrégats mis à jour par les triggers)
+    changed = conn.executemany("""
+        INSERT INTO fact_kpi (kpi_id, rh_id, periode_id, valeur, commentaire)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (kpi_id, rh_id, periode_id) DO UPDATE SET
+            valeur = excluded.valeur,
+            commentaire = excluded.commentaire
+        WHERE fact_kpi.valeur IS NOT excluded.valeur OR fact_kpi.commentaire IS NOT excluded.commentaire
+    """, rows).rowcount
+
+    # Lignes disparues de la feuille pour les périodes qu'elle couvre
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS ingest_cles (kpi_id INTEGER, periode_id INTEGER)")
+    conn.execute("DELETE FROM ingest_cles")
+    conn.executemany("INSERT INTO ingest_cles VALUES (?, ?)", [(r[0], r[2]) for r in rows])
+    periode_ids = sorted({r[2] for r in rows})
+    changed += conn.execute(f"""
+        DELETE FROM fact_kpi
+        WHERE rh_id = ? AND periode_id IN ({', '.join('?' for _ in periode_ids)})
+          AND (kpi_id, periode_id) NOT IN (SELECT kpi_id, periode_id FROM ingest_cles)
+    """, [rh_id] + periode_ids).rowcount
+    return changed
+
+
+def ingest(sources, db_path=DB_PATH, annee=DEFAULT_YEAR, force=False, log=print):
+    """Charge les feuilles modifiées de chaque source en une seule transaction"""
+    conn = open_write_connection(db_path)
+    summary = {"feuilles": 0, "ignorees": 0, "lignes": 0, "modifiees": 0}
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ensure_schema(conn, annee)
+            known = {(s, f): e for s, f, e in conn.execute("SELECT source, feuille, empreinte FROM ingest_log")}
+            now = datetime.datetime.now().isoformat(timespec="seconds")
+            archived, _ = get_catalog().scan()
+            for source in sources:
+                for source_name, rh_nom, rows in iter_sheets(source):
+                    parser = SheetParser(rh_nom, annee)
+                    for row in rows:
+                        parser.feed(list(row))
+                    if not parser.recognized:
+                        log(f"! {source_name} / {rh_nom} : mise en page non reconnue, ignorée")
+                        continue
+                    summary["feuilles"] += 1
+                    if not force and known.get((source_name, rh_nom)) == parser.fingerprint:
+                        summary["ignorees"] += 1
+                        log(f"= {source_name} / {rh_nom} : inchangée")
+                        continue
+                    # Un trimestre archivé est en lecture seule : le réintégrer avant de le recharger
+                    locked = sorted({(r[1], (r[2] + 2) // 3) for r in parser.records} & set(archived))
+                    if locked:
+                        summary["ignorees"] += 1
+                        log(f"! {source_name} / {rh_nom} : trimestre archivé " + ", ".join(
+                            f"T{t} {a} (python partitions.py reintegrer {a} {t})" for a, t in locked) + ", ignorée")
+                        continue
+                    changed = upsert_records(conn, parser.records, parser.periode)
+                    conn.execute("""
+                        INSERT OR REPLACE INTO ingest_log (source, feuille, empreinte, lignes, charge_le)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, (source_name, rh_nom, parser.fingerprint, len(parser.records), now))
+                    summary["lignes"] += len(parser.records)
+                    summary["modifiees"] += changed
+                    log(f"+ {source_name} / {rh_nom} : {len(parser.records)} valeurs, {changed} modifications")
+            if summary["modifiees"]:
+                # Les indicateurs et réponses mis en cache pour l'ancienne version seront recalculés
+                bump_data_version(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+    if summary["modifiees"] and snapshot.snapshots_enabled():
+        # Instantané colonnes déjà exporté : seuls les mois touchés sont réécrits
+        snapshot.export(db_path, log=log)
+    if summary["modifiees"] and os.path.abspath(db_path) == os.path.abspath(DB_PATH):
+        # Base servie par les applications : réponses de référence préparées pour la nouvelle version
+        warmup.refresh(log=log)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sources", nargs="+", help="classeurs .xlsx, fichiers ou dossiers de CSV")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--annee", type=int, default=DEFAULT_YEAR,
+                        help="année des mois sans année explicite dans l'en-tête")
+    parser.add_argument("--force", action="store_true", help="recharge même les feuilles inchangées")
+    args = parser.parse_args()
+
+    summary = ingest(args.sources, args.db, args.annee, args.force)
+    print(f"✅ {summary['feuilles']} feuilles lues, {summary['ignorees']} inchangées, "
+          f"{summary['modifiees']} lignes modifiées")
+
+
+if __name__ == "__main__":
+    main()
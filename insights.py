@@ -0,0 +1,357 @@
+"""Indicateurs standard calculés en une passe vectorisée sur un résultat KPI, en cache par version des données.
+
+Les lignes sont réduites à un cube (KPI, recruteur, période) par un seul groupby ; classements, parts
+du total, variations d'un mois sur l'autre et taux de conversion de l'entonnoir (contactés ->
+entretiens -> présentations -> recrutés/intégrés) en sont dérivés par opérations vectorisées.
+Les résultats sont gardés dans insights.db sous la version des données (schema.data_version) :
+la CLI, les deux applications et les notebooks réutilisent les mêmes calculs jusqu'au prochain chargement.
+"""
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from charts import month_sort_key
+from entity_index import fold
+from tracing import annotate, span
+
+INSIGHTS_PATH = os.getenv("RH_CHAT_INSIGHTS",
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), "insights.db"))
+
+# Nombre maximal de résultats conservés dans le cache
+MAX_ENTRIES = 500
+# Lignes lues par bloc (chaque bloc est réduit par un groupby vectorisé)
+CHUNK_ROWS = 50000
+# Recruteurs cités dans chaque classement
+TOP_N = 5
+
+# Étapes de l'entonnoir de recrutement et KPI qui les alimentent
+FUNNEL = [
+    ("contactés", ["Nb de candidats contactés"]),
+    ("entretiens", ["Nb d'entretiens candidats Salariés", "Nb d'entretiens candidats Sous-Traitants"]),
+    ("présentations", ["Nombre de présentations clients"]),
+    ("recrutés/intégrés", ["Nb de candidats recrutés Salariés", "Nb de candidats intégrés Sous Traitants"]),
+]
+
+REQUIRED_COLUMNS = ("rh_nom", "mois", "valeur")
+CUBE_LEVELS = ["kpi_nom", "rh_nom", "periode"]
+
+
+def _number(value):
+    """Nombre JSON (int si entier), None pour NaN et infini"""
+    value = float(value)
+    if math.isnan(value) or math.isinf(value):
+        return None
+    return int(value) if value.is_integer() else round(value, 4)
+
+
+def _period_key(label):
+    """Ordre chronologique d'une période 'Août' ou 'Août 2024'"""
+    mois, _, annee = str(label).rpartition(" ")
+    if annee.isdigit() and mois:
+        return int(annee), month_sort_key(mois)
+    return 0, month_sort_key(label)
+
+
+def build_cube(df):
+    """Somme de `valeur` par (KPI, recruteur, période) : le seul groupby sur les lignes du résultat"""
+    periode = df["mois"].astype(str)
+    if "annee" in df.columns:
+        periode = periode + " " + df["annee"].astype("Int64").astype(str).str.replace("<NA>", "", regex=False)
+        periode = periode.str.strip()
+    frame = df.assign(
+        kpi_nom=df["kpi_nom"].astype(str).str.strip() if "kpi_nom" in df.columns else "valeur",
+        periode=periode,
+    )
+    return frame.groupby(CUBE_LEVELS, sort=False)["valeur"].sum()
+
+
+def insights_from_cube(cube):
+    """Classements, parts, variations mensuelles et entonnoir, dérivés du cube sans repasser sur les lignes"""
+    table = cube.unstack("periode", fill_value=0)
+    return insights_from_totals(table.sum(axis=1), table.groupby(level="kpi_nom").sum())
+
+
+def insights_from_totals(by_kpi_rh, by_kpi_period):
+    """Indicateurs à partir des totaux par (KPI, recruteur) et de la table KPI x période"""
+    periods = sorted(by_kpi_period.columns, key=_period_key)
+    by_kpi_period = by_kpi_period[periods]
+    kpi_totals = by_kpi_period.sum(axis=1)
+    shares = by_kpi_rh / kpi_totals.reindex(by_kpi_rh.index.get_level_values("kpi_nom")).to_numpy()
+    ranks = by_kpi_rh.groupby(level="kpi_nom").rank(ascending=False, method="min")
+    deltas = by_kpi_period.diff(axis=1)
+    ratios = by_kpi_period.pct_change(axis=1, fill_method=None)
+
+    kpis = {}
+    for kpi in kpi_totals.sort_values(ascending=False).index:
+        ranking = by_kpi_rh.loc[kpi].sort_values(ascending=False).head(TOP_N)
+        kpis[kpi] = {
+            "total": _number(kpi_totals[kpi]),
+            "classement": [
+                {"rang": _number(ranks[(kpi, rh)]), "rh_nom": rh, "total": _number(total),
+                 "part": _number(shares[(kpi, rh)])}
+                for rh, total in ranking.items()
+            ],
+            "periodes": [
+                {"periode": p, "total": _number(by_kpi_period.at[kpi, p]),
+                 "variation": _number(deltas.at[kpi, p]), "variation_pct": _number(ratios.at[kpi, p])}
+                for p in periods
+            ],
+        }
+
+    # Mois et recruteurs extrêmes sur l'ensemble du résultat (comme l'analyse simple des applications)
+    month_totals = by_kpi_period.sum(axis=0)
+    rh_totals = by_kpi_rh.groupby(level="rh_nom").sum()
+    return {
+        "total": _number(kpi_totals.sum()),
+        "kpis": kpis,
+        "resume": {
+            "mois_max": month_totals.idxmax(),
+            "mois_min": month_totals.idxmin(),
+            "rh_max": rh_totals.idxmax(),
+            "rh_min": rh_totals.idxmin(),
+        } if len(month_totals) and len(rh_totals) else None,
+        "entonnoir": funnel(by_kpi_rh),
+    }
+
+
+def funnel(by_kpi_rh):
+    """Totaux par étape et taux de conversion d'une étape à la suivante, global et par recruteur"""
+    stage_of = {fold(kpi): stage for stage, kpis in FUNNEL for kpi in kpis}
+    stages = by_kpi_rh.index.get_level_values("kpi_nom").map(lambda k: stage_of.get(fold(k)))
+    known = stages.notna()
+    if not known.any():
+        return None
+    per_rh = by_kpi_rh[known].groupby([stages[known], by_kpi_rh.index.get_level_values("rh_nom")[known]]).sum()
+    per_rh = per_rh.unstack(0, fill_value=0)
+    order = [stage for stage, _ in FUNNEL if stage in per_rh.columns]
+    if len(order) < 2:
+        return None
+    per_rh = per_rh[order]
+    totals = per_rh.sum(axis=0)
+    steps = list(zip(order, order[1:]))
+    conversions = {f"{a} -> {b}": per_rh[b] / per_rh[a].where(per_rh[a] != 0) for a, b in steps}
+    return {
+        "etapes": [{"etape": stage, "total": _number(totals[stage])} for stage in order],
+        "taux": [
+            {"de": a, "vers": b, "taux": _number(totals[b] / totals[a]) if totals[a] else None}
+            for a, b in steps
+        ],
+        "par_recruteur": {
+            rh: {step: _number(values[rh]) for step, values in conversions.items()}
+            for rh in per_rh.index
+        },
+    }
+
+
+def compute_insights(df):
+    """Indicateurs d'un DataFrame de lignes KPI (colonnes rh_nom, mois, valeur ; kpi_nom et annee facultatives)"""
+    if df.empty or not all(c in df.columns for c in REQUIRED_COLUMNS):
+        return None
+    return insights_from_cube(build_cube(df))
+
+
+# --- Cache par version des données ---
+
+class InsightCache:
+    """Indicateurs sérialisés en JSON dans SQLite, valables pour une version des données"""
+
+    def __init__(self, path=INSIGHTS_PATH, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS insights (
+                cle TEXT PRIMARY KEY,
+                version TEXT,
+                contenu TEXT,
+                utilise_le REAL
+            )
+        """)
+
+    @staticmethod
+    def key(sql, params=None):
+        raw = f"{sql}\x00{json.dumps(list(params) if params else None, default=str)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key, version):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT contenu FROM insights WHERE cle = ? AND version = ?", (key, version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE insights SET utilise_le = ? WHERE cle = ?", (time.time(), key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, version, insights):
+        """Enregistre les indicateurs ; ceux des versions précédentes des données sont supprimés"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM insights WHERE version <> ?", (version,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO insights (cle, version, contenu, utilise_le) VALUES (?, ?, ?, ?)",
+                (key, version, json.dumps(insights, ensure_ascii=False), time.time()),
+            )
+            self._conn.execute("""
+                DELETE FROM insights WHERE cle IN (
+                    SELECT cle FROM insights ORDER BY utilise_le DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM insights").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_insight_cache():
+    """Instance partagée du cache d'indicateurs pour le processus"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = InsightCache()
+    return _default_cache
+
+
+def _cube_from_chunks(chunks):
+    """Cube consolidé de blocs (colonnes, lignes) ; None si les colonnes rh_nom, mois ou valeur manquent"""
+    import pandas as pd
+    parts = []
+    for columns, rows in chunks:
+        if not all(c in columns for c in REQUIRED_COLUMNS):
+            return None
+        parts.append(build_cube(pd.DataFrame.from_records(rows, columns=columns)))
+    if not parts:
+        return None
+    return pd.concat(parts).groupby(level=CUBE_LEVELS, sort=False).sum()
+
+
+def _cached_insights(sql, params, compute):
+    """Indicateurs en cache pour (sql, params) à la version courante, sinon calculés par `compute()`"""
+    from core import data_version
+    cache = get_insight_cache()
+    version = data_version()
+    key = cache.key(sql, params)
+    insights = cache.get(key, version)
+    annotate(cache_indicateurs="miss" if insights is None else "hit")
+    if insights is not None:
+        return insights
+    with span("indicateurs"):
+        insights = compute()
+    if insights is None:
+        return None
+    cache.set(key, version, insights)
+    return insights
+
+
+def query_insights(sql, params=None):
+    """Indicateurs du résultat d'une requête (sous la garde), None sans colonnes rh_nom, mois et valeur"""
+    from core import stream_sql
+
+    def compute():
+        chunks = stream_sql(sql, params, CHUNK_ROWS)
+        try:
+            cube = _cube_from_chunks(chunks)
+        finally:
+            chunks.close()
+        return insights_from_cube(cube) if cube is not None else None
+
+    return _cached_insights(sql, params, compute)
+
+
+def _read_all(conn, sql):
+    """Blocs (colonnes, lignes) d'une requête interne, lue hors garde"""
+    cursor = conn.execute(sql)
+    columns = [d[0] for d in cursor.description]
+    while True:
+        rows = cursor.fetchmany(CHUNK_ROWS)
+        if not rows:
+            break
+        yield columns, rows
+
+
+def _star_insights(conn):
+    """Indicateurs du schéma en étoile : deux agrégats SQLite sur les identifiants de fact_kpi (index
+    couvrants), libellés après regroupement ; les dix millions de lignes ne passent pas par Python"""
+    import pandas as pd
+    by_kpi_rh = pd.read_sql_query("""
+        SELECT k.kpi_nom, r.rh_nom, t.valeur
+        FROM (SELECT kpi_id, rh_id, SUM(valeur) AS valeur FROM fact_kpi GROUP BY rh_id, kpi_id) AS t
+        JOIN dim_kpi AS k USING (kpi_id) JOIN dim_rh AS r USING (rh_id)
+    """, conn).set_index(["kpi_nom", "rh_nom"])["valeur"]
+    if by_kpi_rh.empty:
+        return None
+    by_kpi_period = pd.read_sql_query("""
+        SELECT k.kpi_nom, p.mois || ' ' || p.annee AS periode, t.valeur
+        FROM (SELECT kpi_id, periode_id, SUM(valeur) AS valeur FROM fact_kpi GROUP BY periode_id, kpi_id) AS t
+        JOIN dim_kpi AS k USING (kpi_id) JOIN dim_periode AS p USING (periode_id)
+    """, conn).pivot(index="kpi_nom", columns="periode", values="valeur").fillna(0)
+    return insights_from_totals(by_kpi_rh.fillna(0), by_kpi_period)
+
+
+def table_insights():
+    """Indicateurs de toute la base (consolidation du notebook d'analyse).
+
+    Requêtes internes lues hors garde : la consolidation dépasse le budget de temps prévu pour les
+    questions, mais n'est calculée qu'une fois par version des données.
+    """
+    from core import get_pool
+    from partitions import get_catalog
+    from schema import object_type
+    sql = "SELECT kpi_nom, rh_nom, mois, annee, valeur FROM kpi_recrutement"
+
+    def compute():
+        with get_pool().connection() as conn:
+            if object_type(conn, "fact_kpi") == "table":
+                # Trimestres archivés compris (vue temporaire fact_kpi sur leur union)
+                get_catalog().attach_all(conn)
+                return _star_insights(conn)
+            # Ancienne table plate : ni année ni identifiants
+            cube = _cube_from_chunks(_read_all(conn, "SELECT kpi_nom, rh_nom, mois, valeur FROM kpi_recrutement"))
+            return insights_from_cube(cube) if cube is not None else None
+
+    return _cached_insights(sql, None, compute)
+
+
+def format_insights(insights, kpi=None):
+    """Lignes de texte (markdown) résumant les indicateurs, pour la CLI, les applications et les notebooks"""
+    if not insights:
+        return []
+    lines = []
+    summary = insights["resume"]
+    if summary:
+        label = f" pour **{kpi}**" if kpi else ""
+        lines.append(f"Le mois le plus actif{label} est **{summary['mois_max']}** ; "
+                     f"le moins actif est **{summary['mois_min']}**.")
+        lines.append(f"Le recruteur le plus performant est **{summary['rh_max']}** ; "
+                     f"le moins performant est **{summary['rh_min']}**.")
+    for name, detail in insights["kpis"].items():
+        if detail["classement"]:
+            first = detail["classement"][0]
+            part = f" ({first['part']:.0%} du total)" if first["part"] is not None else ""
+            lines.append(f"- {name} : total {detail['total']}, en tête {first['rh_nom']}{part}")
+        changes = [p for p in detail["periodes"] if p["variation_pct"] is not None]
+        if changes:
+            last = changes[-1]
+            lines.append(f"  - {last['periode']} : {last['variation_pct']:+.0%} par rapport à la période précédente")
+    funnel_detail = insights["entonnoir"]
+    if funnel_detail:
+        steps = " → ".join(f"{s['etape']} {s['total']}" for s in funnel_detail["etapes"])
+        lines.append(f"Entonnoir : {steps}")
+        rates = ", ".join(f"{t['de']} → {t['vers']} {t['taux']:.0%}" for t in funnel_detail["taux"]
+                          if t["taux"] is not None)
+        if rates:
+            lines.append(f"Taux de conversion : {rates}")
+    return lines
@@ -1,142 +1,209 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-import matplotlib.pyplot as plt
-import re
-import os
-from dotenv import load_dotenv
-from groq import Groq  # Assure-toi que ce package est installé
+from charts import render_chart
+from sql_guard import GuardError
+from results import fetch_page, aggregate_trends
+import tracing
+from tracing import trace
+from conversation import Conversation
+import warmup
+from insights import query_insights, format_insights
+from core import extract_kpi_name, generate_sql, data_version, get_router, get_prompt_builder, get_dispatcher
 
 # --- Initialisation ---
-load_dotenv()
-API_KEY = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=API_KEY)
-conn = sqlite3.connect('recrutement.db', check_same_thread=False)
-
-# Liste des KPI disponibles dans la base
-KPI_LIST = [
-    "Nb de candidats contactés",
-    "Nb d'entretiens candidats Salariés",
-    "Nb d'entretiens candidats Sous-Traitants",
-    "Nb de candidats recrutés Salariés",
-    "Nb de candidats intégrés Sous Traitants",
-    "Nombre de présentations clients",
-    "Nb de refus CDI Salariés",
-    "Nombre de KO candidat à la suite d'une présentation client",
-    "Nombre de KO client à la suite d'une présentation client"
-]
-
-def clean_sql_query(sql_query):
-    """Nettoie le SQL généré pour éviter les backticks ou balises markdown"""
-    cleaned = re.sub(r'```sql|```', '', sql_query, flags=re.IGNORECASE)
-    cleaned = cleaned.replace('`', '')
-    return cleaned.strip()
-
-def get_table_schema():
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA table_info(kpi_recrutement)")
-    schema = cursor.fetchall()
-    return "\n".join([f"- {col[1]} ({col[2]})" for col in schema])
-
-def groq_to_sql(natural_language_query):
-    """Appelle Groq pour générer une requête SQL à partir d’une question en langage naturel"""
-    prompt = f"""
-    Tu es un expert SQL SQLite spécialisé en ressources humaines. Voici le schéma de la table kpi_recrutement :
-    {get_table_schema()}
-
-    Liste des KPI disponibles (à utiliser strictement comme noms de colonnes) :
-    {', '.join(KPI_LIST)}
-
-    Règles importantes :
-    - Toujours renvoyer du SQL valide SQLite sans commentaires ni texte,
-    - Toujours sélectionner 'rh_nom', 'mois' et 'valeur' pour les analyses,
-    - Regrouper les résultats par 'rh_nom' et 'mois' si nécessaire,
-    - Ne pas utiliser de commandes dangereuses (DROP, DELETE, UPDATE, INSERT).
-
-    Question utilisateur : {natural_language_query}
-    """
-
-    response = client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": natural_language_query}
-        ],
-        temperature=0.1,
-        max_tokens=512
+# Client Groq, pool SQLite, routeur, réécriture et garde sont créés par core à la première question,
+# une seule fois pour tout le processus (et non à chaque rerun Streamlit)
+
+# Durée de vie des résultats mis en cache (réponses, pages)
+CACHE_TTL = 600
+# Nombre de réponses conservées dans chaque session
+SESSION_MAX_ANSWERS = 20
+
+def render_trends(pivot, kpi_name):
+    return render_chart(
+        pivot,
+        kind="line",
+        title=f"Évolution de {kpi_name} par recruteur",
+        legend_title="rh_nom",
+        figsize=(10, 5),
+        grid_axis="both",
     )
 
-    raw_sql = response.choices[0].message.content.strip()
-    return clean_sql_query(raw_sql)
+# --- Cache des réponses ---
+# `version` (core.data_version) fait partie de la clé : après un chargement, rien n'est servi des anciennes données
 
-def execute_sql_query(query):
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def run_question(question, history, version):
+    """Question autonome -> SQL (voie rapide ou Groq), partagé entre toutes les sessions"""
+    route = get_router().route(question)
+    if route:
+        return route.describe(), route.sql, route.params
+    return None, generate_sql(question, history), None
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_page(sql_query, params, number, version):
+    """Une page du résultat (seule cette page est lue en mémoire) et l'erreur éventuelle"""
     try:
-        return pd.read_sql_query(query, conn)
+        return fetch_page(sql_query, params, number), None
+    except GuardError as e:
+        return None, f"requête stoppée, {e.reason}"
     except Exception as e:
-        st.error(f"Erreur SQL : {e}")
-        return pd.DataFrame()
+        return None, str(e)
 
-def visualize_trends(df, kpi_name):
-    if df.empty or 'mois' not in df.columns or 'rh_nom' not in df.columns or 'valeur' not in df.columns or 'kpi_nom' not in df.columns:
-        st.warning("Les colonnes nécessaires pour le graphique ne sont pas présentes.")
-        return None
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_trends(sql_query, params, version):
+    """Totaux par mois et recruteur calculés par blocs sur tout le résultat (None si non applicable), et l'erreur"""
     try:
-        st.write("Valeurs de mois dans le DataFrame:", df['mois'].unique())
-        pivot = df.pivot_table(index='mois', columns='rh_nom', values='valeur', aggfunc='sum').fillna(0)
-        
-        # Adapter l'ordre si possible selon les mois présents
-        order = list(df['mois'].unique())
-        pivot = pivot.reindex(order)
-
-        fig, ax = plt.subplots(figsize=(10, 5))
-        pivot.plot(kind='line', marker='o', ax=ax)
-        ax.set_title(f"Évolution de {kpi_name} par recruteur")
-        ax.set_xlabel("Mois")
-        ax.set_ylabel("Valeur")
-        ax.grid(True)
-        plt.xticks(rotation=0)
-        return fig
+        return aggregate_trends(sql_query, params), None
     except Exception as e:
-        st.error(f"Erreur visualisation : {e}")
-        return None
+        return None, str(e)
 
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_insights(sql_query, params, version):
+    """Classements, variations et entonnoir du résultat (cache insights.db par version des données), et l'erreur"""
+    try:
+        return query_insights(sql_query, params), None
+    except Exception as e:
+        return None, str(e)
+
+def get_answer(question):
+    """Réponse complète mémorisée dans la session : un rerun sans nouvelle question ne coûte rien.
+
+    Une question de suivi ("et pour août ?") est d'abord complétée par le contexte de la conversation.
+    """
+    answers = st.session_state.setdefault("reponses", {})
+    conversation = st.session_state.setdefault("conversation", Conversation())
+    resolution = conversation.resolve(question, get_prompt_builder())
+    key = resolution.text
+    if key not in answers:
+        # Question de référence préparée par warmup.py pour la version courante des données
+        prepared = None if resolution.follow_up else warmup.lookup(key)
+        # Trace de la question : les étapes absentes ont été servies par le cache Streamlit
+        with trace(question, "interface"):
+            tracing.annotate(question_de_suivi=resolution.follow_up, reponse_preparee=prepared is not None)
+            if prepared:
+                description, sql_query, params = prepared.describe(), prepared.sql, prepared.params
+                first_page, error = prepared.page(), None
+                kpi_guess, fig = prepared.kpi or extract_kpi_name(key), prepared.chart
+                warning = None
+            else:
+                version = data_version()
+                with st.spinner("Génération de la requête SQL..."):
+                    description, sql_query, params = run_question(key, resolution.history, version)
+                    first_page, error = load_page(sql_query, params, 0, version)
+                # Essayer de deviner le KPI à partir de la question (complétée par le contexte)
+                kpi_guess = extract_kpi_name(key)
+                trends, warning = (load_trends(sql_query, params, version) if first_page and first_page.rows
+                                   else (None, None))
+                # Le rendu est mis en cache par charts.py : un graphique identique est partagé entre sessions
+                fig = None
+                if trends and trends.totals and "kpi_nom" in first_page.columns:
+                    fig = render_trends(trends.pivot(), kpi_guess)
+        answers[key] = {
+            "cle": key,
+            "suivi": resolution.follow_up,
+            "description": description,
+            "sql": sql_query,
+            "params": params,
+            "error": error,
+            "kpi": kpi_guess,
+            "fig": fig,
+            "avertissement": warning,
+            "premiere_page": first_page if prepared else None,
+            "indicateurs": prepared.insights if prepared else None,
+            "page": 0,
+        }
+        while len(answers) > SESSION_MAX_ANSWERS:
+            answers.pop(next(iter(answers)))
+    conversation.record(resolution, answers[key]["sql"])
+    return answers[key]
+
+def turn_page(key, step):
+    answer = st.session_state["reponses"][key]
+    answer["page"] = max(0, answer["page"] + step)
+
+def reset_conversation():
+    st.session_state.pop("conversation", None)
+
+def show_page(answer):
+    """Page courante du résultat, avec navigation ; retourne False si le résultat est vide"""
+    if answer["page"] == 0 and answer["premiere_page"] is not None:
+        # Réponse préparée : la première page est servie sans relire la base
+        page, error = answer["premiere_page"], None
+    else:
+        page, error = load_page(answer["sql"], answer["params"], answer["page"], data_version())
+    if error:
+        st.error(f"Erreur SQL : {error}")
+        return False
+    if page.number == 0 and not page.rows:
+        return False
+    st.dataframe(page.to_dataframe())
+    previous, label, following = st.columns([1, 2, 1])
+    previous.button("◀ Précédente", on_click=turn_page, args=(answer["cle"], -1), disabled=page.number == 0)
+    label.caption(page.describe())
+    following.button("Suivante ▶", on_click=turn_page, args=(answer["cle"], 1), disabled=not page.has_more)
+    return True
+
+def show_stats():
+    """Temps par étape (percentiles) et questions les plus lentes, sur les dernières traces"""
+    with st.sidebar.expander("📊 Temps par étape"):
+        summary = tracing.stats()
+        if not summary["traces"]:
+            st.caption("Aucune question tracée pour l'instant.")
+            return
+        etapes = pd.DataFrame.from_dict(summary["etapes"], orient="index").sort_values("p50", ascending=False)
+        st.dataframe(etapes)
+        if summary["hit_rate_cache_llm"] is not None:
+            st.caption(f"Cache LLM : {summary['hit_rate_cache_llm']:.0%} de hits")
+        st.caption(f"Jetons Groq : {summary['jetons_prompt']} prompt, {summary['jetons_reponse']} réponse")
+        dispatch = get_dispatcher().stats()
+        st.caption(f"File Groq : {dispatch['file']} en attente, attente p95 {dispatch['attente_p95_ms'] or 0} ms, "
+                   f"{dispatch['fusionnes']} appels fusionnés, {dispatch['limites_429']} limites 429")
+        prepared = warmup.get_store().stats()
+        st.caption(f"Réponses préparées : {prepared['entries']}, {prepared['hits']} servies, "
+                   f"{prepared['perimees']} périmées")
+        st.dataframe(pd.DataFrame(summary["plus_lentes"], columns=["durée (ms)", "app", "question"]))
 
 def main():
     st.title("🤖 Agent conversationnel RH - Reporting KPI")
+    show_stats()
+    st.sidebar.button("🔄 Nouvelle conversation", on_click=reset_conversation)
 
     user_question = st.text_input("Pose ta question sur les KPIs RH", "")
 
     if user_question:
-        with st.spinner("Génération de la requête SQL..."):
-            sql_query = groq_to_sql(user_question)
-        st.code(sql_query, language="sql")
-
-        df = execute_sql_query(sql_query)
+        answer = get_answer(user_question)
+        if answer["suivi"]:
+            st.caption(f"↪ Question comprise comme : {answer['cle']}")
+        if answer["description"]:
+            st.caption(f"⚡ Question reconnue localement : {answer['description']}")
+        st.code(answer["sql"], language="sql")
+
+        if answer["error"]:
+            st.error(f"Erreur SQL : {answer['error']}")
+            return
 
-        if df.empty:
+        if not show_page(answer):
             st.warning("Aucun résultat trouvé. Essaie une autre question.")
             return
 
-        st.dataframe(df)
-
-        # Essayer de deviner le KPI à partir de la question
-        kpi_guess = next((kpi for kpi in KPI_LIST if kpi.lower() in user_question.lower()), "Indicateur RH")
-
-        fig = visualize_trends(df, kpi_guess)
+        kpi_guess = answer["kpi"]
+        fig = answer["fig"]
         if fig:
-            st.pyplot(fig)
-
-        # Analyse simple
-        if 'mois' in df.columns and 'rh_nom' in df.columns and 'valeur' in df.columns:
-            grouped = df.groupby(['mois', 'rh_nom'])['valeur'].sum().reset_index()
-            mois_max = grouped.groupby('mois')['valeur'].sum().idxmax()
-            mois_min = grouped.groupby('mois')['valeur'].sum().idxmin()
-            st.markdown(f"Le mois le plus actif pour **{kpi_guess}** est **{mois_max}** ; le moins actif est **{mois_min}**.")
-
-            total_par_rh = grouped.groupby('rh_nom')['valeur'].sum()
-            max_rh = total_par_rh.idxmax()
-            min_rh = total_par_rh.idxmin()
-            st.markdown(f"Le recruteur le plus performant est **{max_rh}** ; le moins performant est **{min_rh}**.")
+            st.image(fig)
+        elif answer["avertissement"]:
+            st.warning(f"Graphique indisponible : {answer['avertissement']}")
+        else:
+            st.warning("Les colonnes nécessaires pour le graphique ne sont pas présentes.")
+
+        # Analyse sur tout le résultat (pas seulement la page) : extrêmes, classements, variations, entonnoir
+        insights = answer["indicateurs"]
+        if insights is None:
+            insights, warning = load_insights(answer["sql"], answer["params"], data_version())
+            if warning:
+                st.warning(f"Indicateurs indisponibles : {warning}")
+        for line in format_insights(insights, kpi_guess):
+            st.markdown(line)
 
 if __name__ == "__main__":
     main()
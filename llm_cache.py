@@ -0,0 +1,172 @@
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import time
+import os
+import re
+from tracing import annotate
+
+# Cache persistant des réponses du LLM, stocké à côté de recrutement.db
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.db")
+
+# Paramètres d'éviction par défaut
+MAX_ENTRIES = 2000
+TTL_SECONDS = 7 * 24 * 3600
+
+# Symboles gardés dans la clé normalisée (comparaisons, pourcentages, décimales) ; le reste devient un espace
+KEPT_SYMBOLS_RE = re.compile(r"<>|!=|[<>]=?|=|%|(?<=\d)[.,](?=\d)|(?P<other>[^\w\s])")
+
+
+def _symbol(match):
+    symbol = match.group(0)
+    if match.group("other"):
+        return " "
+    if symbol in ".,":
+        # Séparateur décimal : 10,5 et 10.5 sont le même nombre, différent de 105
+        return "."
+    return f" {symbol} "
+
+
+def normalize_question(question):
+    """Normalise une question (casse, accents, ponctuation, espaces) pour servir de clé de cache.
+
+    Les opérateurs de comparaison, % et les décimales restent dans la clé : "valeur > 10" et
+    "valeur < 10" ne doivent pas partager une réponse.
+    """
+    text = unicodedata.normalize("NFKD", question)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.casefold()
+    text = KEPT_SYMBOLS_RE.sub(_symbol, text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def context_fingerprint(*parts):
+    """Calcule l'empreinte du contexte (schéma, KPI_LIST, modèle, prompt) qui invalide le cache"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (list, tuple)):
+            part = "\n".join(str(p) for p in part)
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """Cache SQLite LRU/TTL des traductions question -> réponse du LLM"""
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cle TEXT PRIMARY KEY,
+                espace TEXT,
+                question TEXT,
+                reponse TEXT,
+                cree_le REAL,
+                utilise_le REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_utilise ON llm_cache (utilise_le);
+            CREATE TABLE IF NOT EXISTS llm_cache_contexte (
+                espace TEXT PRIMARY KEY,
+                empreinte TEXT
+            );
+        """)
+
+    def _key(self, namespace, question, fingerprint):
+        raw = f"{namespace}\x00{fingerprint}\x00{normalize_question(question)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _check_context(self, namespace, fingerprint):
+        """Vide l'espace de cache si le schéma, le prompt ou le modèle ont changé"""
+        row = self._conn.execute(
+            "SELECT empreinte FROM llm_cache_contexte WHERE espace = ?", (namespace,)
+        ).fetchone()
+        if row and row[0] == fingerprint:
+            return
+        with self._conn:
+            self._conn.execute("DELETE FROM llm_cache WHERE espace = ?", (namespace,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache_contexte (espace, empreinte) VALUES (?, ?)",
+                (namespace, fingerprint),
+            )
+
+    def get(self, namespace, question, fingerprint):
+        """Retourne la réponse en cache ou None"""
+        key = self._key(namespace, question, fingerprint)
+        now = time.time()
+        with self._lock:
+            self._check_context(namespace, fingerprint)
+            row = self._conn.execute(
+                "SELECT reponse, cree_le FROM llm_cache WHERE cle = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE llm_cache SET utilise_le = ? WHERE cle = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, namespace, question, fingerprint, answer):
+        """Enregistre une réponse et applique l'éviction TTL puis LRU"""
+        key = self._key(namespace, question, fingerprint)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (cle, espace, question, reponse, cree_le, utilise_le) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, question, answer, now, now),
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE cree_le < ?", (now - self.ttl,))
+            self._conn.execute("""
+                DELETE FROM llm_cache WHERE cle IN (
+                    SELECT cle FROM llm_cache ORDER BY utilise_le DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def get_or_compute(self, namespace, question, fingerprint, compute):
+        """Retourne la réponse en cache, sinon appelle compute() et mémorise le résultat"""
+        answer = self.get(namespace, question, fingerprint)
+        annotate(cache_llm="miss" if answer is None else "hit")
+        if answer is None:
+            answer = compute()
+            if answer:
+                self.set(namespace, question, fingerprint, answer)
+        return answer
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.execute("DELETE FROM llm_cache_contexte")
+
+    def stats(self):
+        """Compteurs de hits/misses et taille du cache"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+        }
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """Instance partagée du cache pour le processus"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache()
+    return _default_cache
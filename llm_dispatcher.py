@@ -0,0 +1,218 @@
+"""Répartiteur des appels Groq pour tout le processus : fusion des doublons, débit et priorités.
+
+Une requête identique à une requête en cours (mêmes paramètres, mêmes messages au caractère près) ne part
+pas une seconde fois : le demandeur attend la réponse du premier. Les appels passent par deux seaux à
+jetons (requêtes et jetons par minute, limites de Groq) dans l'ordre de priorité puis d'arrivée :
+les questions posées dans les applications passent avant le mode batch. Un 429 suspend tous les
+appels le temps indiqué par Groq, avec une gigue pour que les reprises ne partent pas ensemble.
+"""
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+import tracing
+from llm_cache import context_fingerprint
+from prompt_builder import count_tokens
+
+# Limites de débit de Groq pour le modèle utilisé (requêtes et jetons par minute)
+REQUESTS_PER_MINUTE = int(os.getenv("RH_CHAT_GROQ_RPM", "30"))
+TOKENS_PER_MINUTE = int(os.getenv("RH_CHAT_GROQ_TPM", "6000"))
+
+# Reprise des appels Groq sur limitation de débit (429) et erreurs serveur
+MAX_RETRIES = 5
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 30.0
+
+# Priorités : la plus petite passe en premier
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+
+# Attentes récentes conservées pour les statistiques
+WAIT_WINDOW = 500
+
+_priority = contextvars.ContextVar("rh_chat_llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    """Priorité des appels Groq faits dans ce bloc (par exemple PRIORITY_BATCH dans un thread de batch)"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def retry_delay(error, attempt):
+    """Délai avant nouvelle tentative pour une erreur Groq temporaire (429, 5xx), sinon None"""
+    status = getattr(error, "status_code", None)
+    if status != 429 and not (isinstance(status, int) and status >= 500):
+        return None
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = BACKOFF_BASE_S * 2 ** attempt
+    # Gigue pour que les threads limités en même temps ne repartent pas ensemble
+    return min(delay, BACKOFF_MAX_S) + random.uniform(0, BACKOFF_BASE_S)
+
+
+class TokenBucket:
+    """Seau à jetons : au plus `capacity` unités, remplies à raison de `rate` unités par seconde"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost, now):
+        """Secondes avant de pouvoir prélever `cost` unités (0 si c'est possible tout de suite)"""
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        return 0.0 if self.level >= cost else (cost - self.level) / self.rate
+
+    def take(self, cost):
+        # Le niveau peut devenir négatif (consommation réelle supérieure à l'estimation)
+        self.level -= cost
+
+
+class LLMDispatcher:
+    """Appels Groq fusionnés, admis par priorité dans les limites de débit, repris sur 429"""
+
+    def __init__(self, client_factory, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_retries=MAX_RETRIES):
+        self._client_factory = client_factory
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._queue = []
+        self._order = itertools.count()
+        self._inflight = {}
+        self._paused_until = 0.0
+        self._waits = deque(maxlen=WAIT_WINDOW)
+        self.calls = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.max_depth = 0
+
+    def _key(self, kwargs):
+        # Messages exacts : deux requêtes qui ne diffèrent que par un opérateur (> ou <) ne sont pas identiques
+        messages = [(m.get("role"), m.get("content") or "") for m in kwargs.get("messages", [])]
+        return context_fingerprint(kwargs.get("model"), kwargs.get("temperature"), kwargs.get("max_tokens"), messages)
+
+    def _cost(self, kwargs):
+        """Jetons estimés de l'appel : prompt et réponse maximale"""
+        prompt = sum(count_tokens(m.get("content") or "") for m in kwargs.get("messages", []))
+        return prompt + (kwargs.get("max_tokens") or 0)
+
+    def complete(self, **kwargs):
+        """Même interface que client.chat.completions.create ; une requête en cours identique est partagée"""
+        key = self._key(kwargs)
+        with self._cond:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            tracing.count("appels_fusionnes")
+            with tracing.span("llm"):
+                return future.result()
+        try:
+            response = self._call(kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    def _call(self, kwargs):
+        cost = self._cost(kwargs)
+        for attempt in range(self.max_retries + 1):
+            with tracing.span("file_llm"):
+                self._admit(cost, _priority.get())
+            try:
+                with tracing.span("llm"):
+                    response = self._client_factory().chat.completions.create(**kwargs)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None or attempt == self.max_retries:
+                    raise
+                tracing.count("reprises_groq")
+                with self._cond:
+                    self.retries += 1
+                    if getattr(e, "status_code", None) == 429:
+                        # Limite atteinte : tous les appels attendent, pas seulement celui-ci
+                        self.rate_limited += 1
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                        continue
+                time.sleep(delay)
+                continue
+            tracing.record_usage(response)
+            usage = getattr(response, "usage", None)
+            with self._cond:
+                self.calls += 1
+                if usage is not None and getattr(usage, "total_tokens", None):
+                    self.tokens.take(usage.total_tokens - cost)
+            return response
+
+    def _admit(self, cost, level):
+        """Attend son tour (priorité, puis ordre d'arrivée) et la capacité des deux seaux"""
+        ticket = (level, next(self._order))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            while True:
+                wait = None
+                if self._queue[0] == ticket:
+                    now = time.monotonic()
+                    wait = max(self._paused_until - now, self.requests.delay(1, now), self.tokens.delay(cost, now))
+                    if wait <= 0:
+                        break
+                self._cond.wait(wait)
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(cost)
+            self._waits.append(time.monotonic() - start)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            depth = len(self._queue)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p / 100))] * 1000, 1) if waits else None
+
+        return {
+            "appels": self.calls,
+            "fusionnes": self.coalesced,
+            "limites_429": self.rate_limited,
+            "reprises": self.retries,
+            "file": depth,
+            "file_max": self.max_depth,
+            "attente_p50_ms": percentile(50),
+            "attente_p95_ms": percentile(95),
+            "attente_max_ms": round(waits[-1] * 1000, 1) if waits else None,
+        }
@@ -1,170 +1,260 @@
-import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
-from groq import Groq
-from dotenv import load_dotenv
+# Imports légers uniquement : pandas, matplotlib et groq sont chargés à la première question
 import os
-import re
-
-# Chargement de la clé API Groq
-load_dotenv()
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
-# Connexion à la base SQLite
-conn = sqlite3.connect('recrutement.db')
-
-# Liste exacte des noms de KPI
-KPI_LIST = [
-    "Nb de candidats contactés",
-    "Nb d'entretiens candidats Salariés",
-    "Nb d'entretiens candidats Sous-Traitants",
-    "Nb de candidats recrutés Salariés",
-    "Nb de candidats intégrés Sous Traitants",
-    "Nombre de présentations clients",
-    "Nb de refus CDI Salariés",
-    "Nombre de KO candidat à la suite d'une présentation client",
-    "Nombre de KO client à la suite d'une présentation client"
-]
-
-def clean_sql_query(sql_query):
-    """Nettoie la requête SQL en supprimant les backticks et les marqueurs de code"""
-    cleaned = re.sub(r'```sql|```', '', sql_query, flags=re.IGNORECASE)
-    cleaned = cleaned.replace('`', '')
-    return cleaned.strip()
-
-def get_table_schema():
-    """Récupère le schéma de la table kpi_recrutement"""
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA table_info(kpi_recrutement)")
-    schema = cursor.fetchall()
-    return "\n".join([f"- {col[1]} ({col[2]})" for col in schema])
-
-def execute_sql_query(query):
-    """Exécute une requête SQL et retourne un DataFrame"""
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_cache import get_cache
+from charts import pivot_by_month, render_chart
+from sql_guard import GuardError
+from results import PAGE_SIZE, iter_pages, aggregate_trends
+import tracing
+from tracing import trace
+from llm_dispatcher import PRIORITY_BATCH, priority as llm_priority
+from insights import query_insights, format_insights, get_insight_cache
+from warmup import get_store
+from core import (EXAMPLE_QUESTIONS, extract_kpi_name, generate_sql, read_questions, run_sql, empty_dataframe,
+                  get_router, get_guard, get_repairer, get_pool, get_dispatcher)
+
+# Dossier des graphiques exportés par la CLI
+CHARTS_DIR = "charts"
+
+# Mode batch : nombre d'appels Groq simultanés
+BATCH_WORKERS = 8
+
+def execute_sql_query(query, params=None):
+    """Exécute une requête SQL (redirigée vers les agrégats si possible) sous la garde d'exécution"""
     try:
-        print(f"Requête nettoyée:\n{query}")
-        return pd.read_sql_query(query, conn)
+        df = run_sql(query, params)
+        if df.attrs.get("garde"):
+            print(f"⚠️ {df.attrs['garde']}")
+        return df
+    except GuardError as e:
+        print(f"⛔ Requête stoppée : {e.reason}")
+        return empty_dataframe()
     except Exception as e:
         print(f"Erreur SQL: {e}")
-        return pd.DataFrame()
-
-def groq_to_sql(natural_language_query):
-    """Convertit une question en langage naturel en requête SQL avec Groq"""
-    kpi_examples = "\n".join([f"- '{kpi}'" for kpi in KPI_LIST])
-    
-    system_prompt = f"""
-    Tu es un expert SQLite spécialisé en RH. Voici le schéma de la table 'kpi_recrutement':
-    {get_table_schema()}
-    
-    Règles importantes :
-    1. Les noms des KPI doivent être exactement comme dans cette liste (respecter la casse et les accents) :
-    {kpi_examples}
-    2. Les mois en français : 'juillet', 'août', 'septembre'
-    3. Les recruteurs : 'Inès', 'Marienne', 'Pauline', 'Samya'
-    4. Utilise toujours des alias explicites pour les colonnes
-    5. Pour les calculs mensuels, regrouper par 'rh_nom' et 'mois'
-    6. Ne renvoie QUE du code SQL, sans commentaires ni explications
-    """
-    
-    response = client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": natural_language_query}
-        ],
-        temperature=0.1,
-        max_tokens=500
-    )
-    raw_sql = response.choices[0].message.content.strip()
-    return clean_sql_query(raw_sql)
+        return empty_dataframe()
 
-def extract_kpi_name(query):
-    """Extrait le nom du KPI de la question de l'utilisateur"""
-    for kpi in KPI_LIST:
-        if kpi.lower() in query.lower():
-            return kpi
-    return "Indicateur RH"
+def render_trends(pivot, kpi_name):
+    """Diagramme en barres mois x recruteur (PNG en mémoire, mis en cache)"""
+    return render_chart(
+        pivot,
+        kind="bar",
+        title=f"Évolution du {kpi_name} par Mois (T3 2024)",
+        figsize=(12, 6),
+    )
 
 def visualize_trends(df, kpi_name):
-    """Génère un graphique d'évolution mensuelle par recruteur"""
+    """Génère un graphique d'évolution mensuelle par recruteur (PNG en mémoire, mis en cache)"""
     if df.empty or 'rh_nom' not in df.columns or 'mois' not in df.columns or 'valeur' not in df.columns:
         return None
         
     try:
-        # Préparer les données pour le graphique
-        pivot_df = df.pivot_table(index='mois', columns='rh_nom', values='valeur', aggfunc='sum').fillna(0)
-        
-        # Ordonner les mois chronologiquement
-        mois_order = ['juillet', 'août', 'septembre']
-        pivot_df = pivot_df.reindex(mois_order)
-        
-        # Créer le graphique
-        plt.figure(figsize=(12, 6))
-        pivot_df.plot(kind='bar', width=0.8)
-        
-        # Personnalisation
-        plt.title(f"Évolution du {kpi_name} par Mois (T3 2024)")
-        plt.xlabel("Mois")
-        plt.ylabel("Valeur")
-        plt.xticks(rotation=0)
-        plt.legend(title="Recruteur")
-        plt.grid(axis='y', linestyle='--', alpha=0.7)
-        plt.tight_layout()
-        
-        # Sauvegarder et afficher
-        filename = f"evolution_{kpi_name.replace(' ', '_').replace('/', '_')}.png"
-        plt.savefig(filename)
-        plt.close()
-        return filename
+        # Préparer les données, ordonnées chronologiquement
+        return render_trends(pivot_by_month(df), kpi_name)
     except Exception as e:
         print(f"Erreur de visualisation: {e}")
         return None
 
-# Interface principale
-print("🤖 Assistant RH - Analyse du 3ème Trimestre 2024")
-print("Exemples de questions :")
-print("- Quel est le total des 'Nb de candidats contactés' par Inès en septembre ?")
-print("- Compare les 'Nb d'entretiens candidats Salariés' de Marienne et Samya sur le trimestre")
-print("- Qui a le plus de 'Nb de candidats recrutés Salariés' en août ?")
-print("- Affiche l'évolution des 'Nb de candidats contactés' par mois pour chaque recruteur")
-print("- Quitter avec 'exit'")
+def visualize_streamed(query, params, kpi_name):
+    """Graphique calculé bloc par bloc sur tout le résultat, sans le charger en mémoire"""
+    try:
+        aggregator = aggregate_trends(query, params)
+        if not aggregator or not aggregator.totals:
+            return None
+        return render_trends(aggregator.pivot(), kpi_name)
+    except GuardError as e:
+        print(f"⛔ Graphique impossible : {e.reason}")
+    except Exception as e:
+        print(f"Erreur de visualisation: {e}")
+    return None
 
-while True:
+def print_insights(query, params, kpi_name):
+    """Analyse du résultat complet (extrêmes, classements, variations, entonnoir), en cache par version"""
     try:
-        user_input = input("\nQuestion : ")
-        if user_input.lower() in ['exit', 'quit']:
-            break
+        lines = format_insights(query_insights(query, params), kpi_name)
+    except GuardError as e:
+        print(f"⛔ Analyse impossible : {e.reason}")
+        return
+    if lines:
+        print("\n📊 Analyse :")
+        print("\n".join(line.replace("**", "") for line in lines))
 
-        # Génération de la requête SQL
-        sql_query = groq_to_sql(user_input)
-        print(f"\nRequête générée :\n{sql_query}")
-        
-        # Exécution de la requête
-        result_df = execute_sql_query(sql_query)
-        
-        # Vérification et affichage des résultats
-        if not result_df.empty:
-            print("\n🔍 Résultats :")
-            print(result_df.to_markdown(index=False))
-            
-            # Détection automatique des besoins de visualisation
-            if "évolution" in user_input.lower() or "graphique" in user_input.lower():
-                kpi_name = extract_kpi_name(user_input)
-                chart_file = visualize_trends(result_df, kpi_name)
-                if chart_file:
-                    print(f"\n📈 Graphique généré : {chart_file}")
-                    try:
-                        # Afficher le graphique dans une nouvelle fenêtre
-                        img = plt.imread(chart_file)
-                        plt.imshow(img)
-                        plt.axis('off')
-                        plt.show()
-                    except:
-                        print("(Le graphique a été sauvegardé sur le disque)")
+def print_pages(query, params=None, page_size=PAGE_SIZE):
+    """Affiche le résultat page par page ; retourne False si aucune ligne n'a été lue"""
+    try:
+        for page in iter_pages(query, params, page_size):
+            if page.number == 0:
+                print("\n🔍 Résultats :")
+            print(page.to_dataframe().to_markdown(index=False))
+            print(page.describe())
+            if not page.has_more:
+                break
+            if input("Entrée : page suivante, q : arrêter ").strip().lower() == "q":
+                break
         else:
-            print("\nAucun résultat trouvé.")
-            
+            return False
+        return True
+    except GuardError as e:
+        print(f"⛔ Requête stoppée : {e.reason}")
     except Exception as e:
-        print(f"\n❌ Erreur : {str(e)}")
+        print(f"Erreur SQL: {e}")
+    return False
+
+def save_chart(png, kpi_name):
+    """Écrit le graphique dans charts/ (une seule fois par contenu) et retourne son chemin"""
+    os.makedirs(CHARTS_DIR, exist_ok=True)
+    digest = hashlib.sha256(png).hexdigest()[:12]
+    filename = os.path.join(CHARTS_DIR, f"evolution_{kpi_name.replace(' ', '_').replace('/', '_')}_{digest}.png")
+    if not os.path.exists(filename):
+        with open(filename, "wb") as f:
+            f.write(png)
+    return filename
+
+def answer_question(question, with_chart=False):
+    """Traite une question sans interaction : SQL, lignes, durées par étape et erreur éventuelle"""
+    result = {"question": question, "sql": None, "params": None, "colonnes": [], "lignes": [],
+              "nb_lignes": 0, "tronque": None, "erreur": None, "graphique": None}
+    with trace(question, "main.batch") as current:
+        try:
+            route = get_router().route(question)
+            if route:
+                sql_query, params = route.sql, route.params
+                result["voie_rapide"] = route.describe()
+            else:
+                sql_query, params = generate_sql(question), None
+            result["sql"], result["params"] = sql_query, list(params) if params else None
+            df = run_sql(sql_query, params)
+            result["colonnes"] = list(df.columns)
+            result["lignes"] = df.values.tolist()
+            result["nb_lignes"] = len(df)
+            result["tronque"] = df.attrs.get("garde")
+            if with_chart and not df.empty:
+                kpi_name = extract_kpi_name(question)
+                chart_png = visualize_trends(df, kpi_name)
+                if chart_png:
+                    result["graphique"] = save_chart(chart_png, kpi_name)
+        except GuardError as e:
+            result["erreur"] = f"requête stoppée : {e.reason}"
+        except Exception as e:
+            result["erreur"] = f"{type(e).__name__}: {e}"
+    durees = {}
+    for name, _, duration in current.spans:
+        durees[name] = round(durees.get(name, 0) + duration, 1)
+    durees["total"] = round(current.duration_ms, 1)
+    result["durees_ms"] = durees
+    return result
+
+def run_batch(questions, output, workers=BATCH_WORKERS, with_charts=False):
+    """Traite les questions en parallèle (appels Groq simultanés) et écrit un résultat JSONL par question"""
+    questions = list(questions)
+    start = time.perf_counter()
+    errors = 0
+    cumulated_ms = 0.0
+
+    def answer_in_batch(question):
+        # Les questions posées dans les applications passent avant celles du batch
+        with llm_priority(PRIORITY_BATCH):
+            return answer_question(question, with_charts)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(answer_in_batch, q): (i, ident, q)
+                   for i, (ident, q) in enumerate(questions)}
+        for future in as_completed(futures):
+            index, ident, question = futures[future]
+            result = {"index": index, "id": ident, **future.result()}
+            errors += result["erreur"] is not None
+            cumulated_ms += result["durees_ms"]["total"]
+            output.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            output.flush()
+    elapsed = time.perf_counter() - start
+    print(f"✅ {len(questions)} questions en {elapsed:.1f}s ({errors} en erreur, "
+          f"{cumulated_ms / 1000:.1f}s cumulées)", file=sys.stderr)
+    return {"questions": len(questions), "erreurs": errors, "duree_s": elapsed}
+
+def interactive():
+    """Boucle interactive en ligne de commande"""
+    print("🤖 Assistant RH - Analyse du 3ème Trimestre 2024")
+    print("Exemples de questions :")
+    for example in EXAMPLE_QUESTIONS:
+        print(f"- {example}")
+    print("- Statistiques (cache, voie rapide, réparation SQL, temps par étape) avec 'stats'")
+    print("- Quitter avec 'exit'")
+
+    while True:
+        try:
+            user_input = input("\nQuestion : ")
+            if user_input.lower() in ['exit', 'quit']:
+                break
+            if user_input.lower() == 'stats':
+                print(f"Cache LLM : {get_cache().stats()}")
+                print(f"Voie rapide : {get_router().stats()}")
+                print(f"Garde SQL : {get_guard().stats()}")
+                print(f"Réparation SQL : {get_repairer().stats()}")
+                print(f"Appels Groq : {get_dispatcher().stats()}")
+                print(f"Indicateurs : {get_insight_cache().stats()}")
+                print(f"Réponses préparées : {get_store().stats()}")
+                print(tracing.format_stats(tracing.stats()))
+                continue
+
+            # Chaque question est tracée (étapes chronométrées, jetons, lignes, caches)
+            with trace(user_input, "main"):
+                # Génération de la requête SQL (voie rapide locale, sinon Groq)
+                route = get_router().route(user_input)
+                if route:
+                    sql_query, params = route.sql, route.params
+                    print(f"\n⚡ Question reconnue localement : {route.describe()}")
+                else:
+                    sql_query, params = generate_sql(user_input), None
+                print(f"\nRequête générée :\n{sql_query}")
+
+                # Exécution de la requête et affichage par pages (la première s'affiche dès qu'elle est lue)
+                if print_pages(sql_query, params):
+                    # Détection automatique des besoins de visualisation
+                    if "évolution" in user_input.lower() or "graphique" in user_input.lower():
+                        kpi_name = extract_kpi_name(user_input)
+                        chart_png = visualize_streamed(sql_query, params, kpi_name)
+                        if chart_png:
+                            chart_file = save_chart(chart_png, kpi_name)
+                            print(f"\n📈 Graphique généré : {chart_file}")
+                            # Ouvrir le graphique avec la visionneuse par défaut
+                            import webbrowser
+                            if not webbrowser.open(f"file://{os.path.abspath(chart_file)}"):
+                                print("(Le graphique a été sauvegardé sur le disque)")
+                        print_insights(sql_query, params, kpi_name)
+                else:
+                    print("\nAucun résultat trouvé.")
+
+        except Exception as e:
+            print(f"\n❌ Erreur : {str(e)}")
+
+    get_pool().close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Assistant RH : questions en langage naturel sur les KPI de recrutement")
+    parser.add_argument("--batch", metavar="FICHIER",
+                        help="questions à traiter sans interaction (JSONL ou texte, '-' pour l'entrée standard)")
+    parser.add_argument("--output", default="-", help="résultats JSONL du mode batch ('-' pour la sortie standard)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="appels Groq simultanés")
+    parser.add_argument("--charts", action="store_true", help="enregistre aussi les graphiques dans charts/")
+    args = parser.parse_args()
+
+    if not args.batch:
+        interactive()
+        return
+    source = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        run_batch(read_questions(source), output, args.workers, args.charts)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+        get_pool().close()
 
-conn.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
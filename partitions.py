@@ -0,0 +1,498 @@
+"""Historique multi-périodes : un fichier SQLite par trimestre archivé, attaché à la demande.
+
+Usage :
+    python partitions.py liste
+    python partitions.py archiver 2024 2            (déplace le T2 2024 vers partitions/2024_T2.db)
+    python partitions.py archiver --avant 2024 3    (tous les trimestres antérieurs au T3 2024)
+    python partitions.py reintegrer 2024 2          (recopie le trimestre dans recrutement.db)
+
+recrutement.db reste la partition courante : dimensions, trimestres non archivés et leurs agrégats.
+Chaque trimestre archivé est une base autonome (faits et agrégats trimestriels, avec les identifiants
+des dimensions de recrutement.db). Une requête n'attache que les trimestres archivés que ses filtres
+(annee, trimestre, mois) peuvent concerner ; des vues temporaires du même nom que kpi_recrutement et
+que les vues d'agrégats en font l'union. Une question sur la période courante ne lit que
+recrutement.db ; retirer un fichier de partitions/ ou l'y remettre retire ou rend le trimestre à
+l'historique, sans réécrire de table. Au-delà de MAX_ATTACHED trimestres concernés (limite d'attachement
+de SQLite), la requête lit un historique consolidé (historique-<empreinte>.db), copie de toutes les
+archives recréée quand le dossier change.
+"""
+import argparse
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from db import BASE_DIR, DB_PATH, open_write_connection
+from fast_path import MOIS_NUMEROS
+from llm_cache import normalize_question
+from rollups import STRING_RE
+from schema import bump_data_version, data_version as base_version, object_type
+
+PARTITION_DIR = os.getenv("RH_CHAT_PARTITIONS", os.path.join(BASE_DIR, "partitions"))
+
+# Bases attachables à une connexion (SQLITE_MAX_ATTACHED par défaut)
+MAX_ATTACHED = 10
+
+FILE_RE = re.compile(r"^(\d{4})_T([1-4])\.db$")
+# Historique consolidé, pour les requêtes qui concernent plus de MAX_ATTACHED trimestres
+HISTORY_PREFIX = "historique-"
+
+# Tables découpées par trimestre (recopiées dans chaque archive) et vues à recréer sur leur union
+UNION_TABLES = ["fact_kpi", "rollup_rh_kpi_trimestre", "rollup_kpi_trimestre"]
+SHADOWED_VIEWS = ["kpi_recrutement", "kpi_rh_trimestre", "kpi_trimestre"]
+
+CREATE_VIEW_RE = re.compile(r"^\s*CREATE\s+VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?", re.IGNORECASE)
+# Élagage : seuls les filtres de la clause WHERE principale d'un SELECT simple bornent les trimestres lus
+COMPOUND_RE = re.compile(r"\b(UNION|INTERSECT|EXCEPT|WITH)\b", re.IGNORECASE)
+CLAUSE_END_RE = re.compile(r"\b(GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|WINDOW)\b", re.IGNORECASE)
+PERIOD_COLUMN = r"(?:\w+\.)?(annee|trimestre|mois)"
+LITERAL = r"('(?:[^']|'')*'|-?\d+)"
+
+
+def file_name(annee, trimestre):
+    return f"{annee}_T{trimestre}.db"
+
+
+def _alias(key):
+    annee, trimestre = key
+    return f"archive_{annee}_t{trimestre}"
+
+
+def _periode_range(annee, trimestre):
+    """Bornes de periode_id (annee * 100 + mois) du trimestre"""
+    return annee * 100 + 3 * trimestre - 2, annee * 100 + 3 * trimestre
+
+
+# --- Élagage : trimestres archivés qu'une requête peut concerner ---
+
+def _split_code(sql):
+    """Segments (code, littéral) de la requête, comme dans rollups"""
+    parts, pos = [], 0
+    for match in STRING_RE.finditer(sql):
+        parts.append((sql[pos:match.start()], False))
+        parts.append((match.group(0), True))
+        pos = match.end()
+    parts.append((sql[pos:], False))
+    return parts
+
+
+def _bind(sql, params):
+    """Requête où chaque ? est remplacé par sa valeur (pour l'analyse seulement)"""
+    if not params or isinstance(params, dict):
+        return sql
+    values = iter(params)
+
+    def literal(value):
+        if isinstance(value, (int, float)):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    parts = []
+    for part, is_literal in _split_code(sql):
+        if not is_literal:
+            part = re.sub(r"\?", lambda m: literal(next(values, None)), part)
+        parts.append(part)
+    return "".join(parts)
+
+
+def _literals(text):
+    return [v[1:-1].replace("''", "'") if v.startswith("'") else int(v) for v in re.findall(LITERAL, text)]
+
+
+def _mask_literals(sql):
+    """Requête aux chaînes masquées (mêmes positions) : seuls les mots-clés et parenthèses du code restent"""
+    return "".join(part if not is_literal else part[0] + "_" * (len(part) - 2) + part[-1]
+                   for part, is_literal in _split_code(sql))
+
+
+def _depths(code):
+    """Profondeur de parenthèses de chaque caractère"""
+    depths, depth = [], 0
+    for char in code:
+        if char == ")":
+            depth -= 1
+        depths.append(depth)
+        if char == "(":
+            depth += 1
+    return depths
+
+
+def _unwrap(text):
+    """Retire les parenthèses qui entourent toute l'expression"""
+    text = text.strip()
+    while text.startswith("(") and text.endswith(")"):
+        inner = _mask_literals(text)[1:-1]
+        if any(d < 0 for d in _depths(inner)):
+            break
+        text = text[1:-1].strip()
+    return text
+
+
+def where_conjuncts(sql):
+    """Conjonctions (AND) de premier niveau de la clause WHERE, None si la requête n'est pas un SELECT
+    simple (sous-requête, union, CTE) : ses filtres ne bornent alors pas toutes les lectures"""
+    code = _mask_literals(sql)
+    if len(re.findall(r"\bSELECT\b", code, re.IGNORECASE)) != 1 or COMPOUND_RE.search(code):
+        return None
+    depths = _depths(code)
+    where = next((m for m in re.finditer(r"\bWHERE\b", code, re.IGNORECASE) if depths[m.start()] == 0), None)
+    if where is None:
+        return []
+    end = next((m.start() for m in CLAUSE_END_RE.finditer(code, where.end()) if depths[m.start()] == 0), len(code))
+    conjuncts, start, between = [], where.end(), False
+    for match in re.finditer(r"\b(BETWEEN|AND)\b", code[:end], re.IGNORECASE):
+        if match.start() < where.end() or depths[match.start()] != 0:
+            continue
+        if match.group(1).upper() == "BETWEEN":
+            between = True
+        elif between:
+            # AND d'un BETWEEN ... AND ..., pas une conjonction
+            between = False
+        else:
+            conjuncts.append(sql[start:match.start()])
+            start = match.end()
+    conjuncts.append(sql[start:end])
+    return [_unwrap(c) for c in conjuncts]
+
+
+def _period_filter(conjunct):
+    """(colonne, prédicat) d'une conjonction simple sur annee, trimestre ou mois (le prédicat porte sur le
+    trimestre pour mois), None pour toute autre forme (OR, NOT, CASE, fonction...) qui n'élague rien"""
+    match = re.fullmatch(rf"{PERIOD_COLUMN}\s*(==|=|>=|<=|>|<)\s*{LITERAL}", conjunct, re.IGNORECASE | re.DOTALL)
+    if match:
+        column, op, values = match.group(1).lower(), match.group(2), [_literals(match.group(3))[0]]
+        if op not in ("=", "=="):
+            if column == "mois" or not isinstance(values[0], int):
+                return None
+            value = values[0]
+            return column, {">": lambda v: v > value, ">=": lambda v: v >= value,
+                            "<": lambda v: v < value, "<=": lambda v: v <= value}[op]
+    else:
+        match = re.fullmatch(rf"{PERIOD_COLUMN}\s+IN\s*\(\s*({LITERAL}(?:\s*,\s*{LITERAL})*)\s*\)", conjunct,
+                             re.IGNORECASE | re.DOTALL)
+        if match:
+            column, values = match.group(1).lower(), _literals(match.group(2))
+        else:
+            match = re.fullmatch(rf"{PERIOD_COLUMN}\s+BETWEEN\s+(-?\d+)\s+AND\s+(-?\d+)", conjunct,
+                                 re.IGNORECASE | re.DOTALL)
+            if not match or match.group(1).lower() == "mois":
+                return None
+            low, high = int(match.group(2)), int(match.group(3))
+            return match.group(1).lower(), lambda v: low <= v <= high
+    if column == "mois":
+        quarters = set()
+        for value in values:
+            numero = MOIS_NUMEROS.get(normalize_question(str(value)))
+            if numero is None:
+                return None
+            quarters.add((numero + 2) // 3)
+        return column, lambda v: v in quarters
+    if not all(isinstance(v, int) for v in values):
+        return None
+    return column, lambda v: v in values
+
+
+def needed_quarters(sql, params, archives):
+    """Trimestres archivés (annee, trimestre) que la requête peut lire, d'après les filtres de période de sa
+    clause WHERE principale ; tout l'historique dès que la forme de la requête ne permet pas de conclure"""
+    conjuncts = where_conjuncts(_bind(sql, params))
+    if conjuncts is None:
+        return sorted(archives)
+    checks = {"annee": [], "trimestre": [], "mois": []}
+    for conjunct in conjuncts:
+        parsed = _period_filter(conjunct)
+        if parsed:
+            checks[parsed[0]].append(parsed[1])
+    return sorted(
+        (annee, trimestre) for annee, trimestre in archives
+        if all(check(annee) for check in checks["annee"])
+        and all(check(trimestre) for check in checks["trimestre"] + checks["mois"])
+    )
+
+
+# --- Catalogue des archives et connexions de lecture ---
+
+class PartitionCatalog:
+    """Trimestres archivés présents dans le dossier, et leur empreinte (noms, tailles, dates)"""
+
+    def __init__(self, directory=PARTITION_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # Trimestres attachés par connexion : id(conn) -> (empreinte, trimestres)
+        self._attached = {}
+
+    def scan(self):
+        """{(annee, trimestre): chemin} et empreinte du dossier (chaîne vide sans archive)"""
+        archives, digest = {}, hashlib.sha1()
+        try:
+            entries = sorted(os.scandir(self.directory), key=lambda e: e.name)
+        except FileNotFoundError:
+            return archives, ""
+        for entry in entries:
+            match = FILE_RE.match(entry.name)
+            if match:
+                stat = entry.stat()
+                archives[(int(match.group(1)), int(match.group(2)))] = entry.path
+                digest.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+        return archives, digest.hexdigest()[:12] if archives else ""
+
+    def prepare(self, conn, sql, params=None):
+        """Attache les seuls trimestres archivés utiles à la requête ; retourne leur liste"""
+        archives, signature = self.scan()
+        keys = needed_quarters(sql, params, archives) if archives else []
+        self._attach(conn, keys, archives, signature)
+        return keys
+
+    def attach_all(self, conn):
+        """Attache tout l'historique (consolidations internes : indicateurs, instantanés)"""
+        archives, signature = self.scan()
+        self._attach(conn, sorted(archives), archives, signature)
+        return sorted(archives)
+
+    def _attach(self, conn, keys, archives, signature):
+        if len(keys) > MAX_ATTACHED:
+            # Trop de fichiers pour une connexion : l'historique consolidé les remplace tous
+            sources = {"archive_historique": self.history(archives, signature)}
+        else:
+            sources = {_alias(k): archives[k] for k in keys}
+        attached = {row[1] for row in conn.execute("PRAGMA database_list") if row[1].startswith("archive_")}
+        with self._lock:
+            state = self._attached.get(id(conn))
+        if state == (signature, tuple(keys)) and attached == set(sources):
+            return
+        # Les vues temporaires et les attachements sont des écritures pour query_only
+        conn.execute("PRAGMA query_only=0")
+        try:
+            for name in SHADOWED_VIEWS + UNION_TABLES:
+                conn.execute(f"DROP VIEW IF EXISTS temp.{name}")
+            for alias in attached:
+                conn.execute(f"DETACH DATABASE {alias}")
+            for alias, path in sources.items():
+                conn.execute(f"ATTACH DATABASE 'file:{os.path.abspath(path)}?mode=ro' AS {alias}")
+            if sources:
+                self._create_views(conn, list(sources))
+        finally:
+            conn.execute("PRAGMA query_only=1")
+        with self._lock:
+            self._attached[id(conn)] = (signature, tuple(keys))
+
+    def _create_views(self, conn, aliases):
+        """Vues temporaires : union des tables par trimestre, vues d'origine recréées par-dessus"""
+        for table in UNION_TABLES:
+            if object_type(conn, table) != "table":
+                continue
+            selects = [f"SELECT * FROM main.{table}"] + [f"SELECT * FROM {alias}.{table}" for alias in aliases]
+            conn.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(selects)}")
+        # Les noms non qualifiés d'une vue temporaire désignent d'abord les objets temporaires
+        for (sql,) in conn.execute(
+            f"SELECT sql FROM main.sqlite_master WHERE type = 'view' AND name IN "
+            f"({', '.join('?' for _ in SHADOWED_VIEWS)})", SHADOWED_VIEWS
+        ).fetchall():
+            conn.execute(CREATE_VIEW_RE.sub("CREATE TEMP VIEW ", sql, count=1))
+
+    def history(self, archives, signature):
+        """Historique consolidé (tous les trimestres archivés dans un seul fichier), recréé quand le
+        dossier change : cache dérivé des fichiers trimestriels, qui restent la référence"""
+        path = os.path.join(self.directory, f"{HISTORY_PREFIX}{signature}.db")
+        with self._build_lock:
+            if not os.path.exists(path):
+                build_history(archives, path)
+                for stale in glob.glob(os.path.join(self.directory, f"{HISTORY_PREFIX}*.db")):
+                    if stale != path:
+                        os.remove(stale)
+        return path
+
+    def refresh_history(self):
+        """Prépare l'historique consolidé après un archivage (les applications n'en paient pas la copie)"""
+        archives, signature = self.scan()
+        if len(archives) > MAX_ATTACHED:
+            return self.history(archives, signature)
+        with self._build_lock:
+            for stale in glob.glob(os.path.join(self.directory, f"{HISTORY_PREFIX}*.db")):
+                os.remove(stale)
+        return None
+
+    def stats(self):
+        archives, signature = self.scan()
+        return {"archives": [f"T{t} {a}" for a, t in sorted(archives)], "empreinte": signature}
+
+
+def build_history(archives, path):
+    """Copie les faits et agrégats de tous les trimestres archivés dans un seul fichier"""
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        indexes = []
+        for position, key in enumerate(sorted(archives)):
+            conn.execute("ATTACH DATABASE ? AS source", (archives[key],))
+            try:
+                with conn:
+                    if position == 0:
+                        for kind, sql in conn.execute(
+                            "SELECT type, sql FROM source.sqlite_master WHERE sql IS NOT NULL"
+                        ).fetchall():
+                            if kind == "table":
+                                conn.execute(sql)
+                            elif kind == "index":
+                                indexes.append(sql)
+                    for table in UNION_TABLES:
+                        conn.execute(f"INSERT INTO main.{table} SELECT * FROM source.{table}")
+            finally:
+                conn.execute("DETACH DATABASE source")
+        # Index créés après la copie : une seule construction triée par index
+        with conn:
+            for sql in indexes:
+                conn.execute(sql)
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+
+
+_default_catalog = None
+_default_lock = threading.Lock()
+
+
+def get_catalog():
+    """Catalogue partagé du processus"""
+    global _default_catalog
+    with _default_lock:
+        if _default_catalog is None:
+            _default_catalog = PartitionCatalog()
+        return _default_catalog
+
+
+def data_version(conn):
+    """Version des données de la base courante et des archives présentes"""
+    _, signature = get_catalog().scan()
+    version = base_version(conn)
+    return f"{version}:{signature}" if signature else version
+
+
+# --- Archivage et réintégration (écritures) ---
+
+def archive(annee, trimestre, db_path=DB_PATH, directory=PARTITION_DIR, log=print):
+    """Déplace un trimestre de recrutement.db vers son propre fichier"""
+    low, high = _periode_range(annee, trimestre)
+    target = os.path.join(directory, file_name(annee, trimestre))
+    if os.path.exists(target):
+        raise SystemExit(f"T{trimestre} {annee} est déjà archivé ({target})")
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{target}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = open_write_connection(db_path)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM fact_kpi WHERE periode_id BETWEEN ? AND ?",
+                             (low, high)).fetchone()[0]
+        if not count:
+            log(f"= T{trimestre} {annee} : aucune ligne à archiver")
+            return 0
+        # 1. L'archive est écrite et complète avant que la base courante ne soit touchée
+        tables = conn.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN "
+            f"({', '.join('?' for _ in UNION_TABLES)})", UNION_TABLES
+        ).fetchall()
+        indexes = conn.execute(
+            f"SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN "
+            f"({', '.join('?' for _ in UNION_TABLES)})", UNION_TABLES
+        ).fetchall()
+        conn.execute("ATTACH DATABASE ? AS archive", (tmp,))
+        try:
+            with conn:
+                for name, sql in tables:
+                    conn.execute(re.sub(rf"^CREATE TABLE (IF NOT EXISTS )?{name}\b", f"CREATE TABLE archive.{name}",
+                                        sql, count=1))
+                conn.execute("INSERT INTO archive.fact_kpi SELECT * FROM main.fact_kpi "
+                             "WHERE periode_id BETWEEN ? AND ?", (low, high))
+                for name, _ in tables:
+                    if name != "fact_kpi":
+                        conn.execute(f"INSERT INTO archive.{name} SELECT * FROM main.{name} "
+                                     f"WHERE annee = ? AND trimestre = ?", (annee, trimestre))
+                for (sql,) in indexes:
+                    conn.execute(re.sub(r"^CREATE INDEX (IF NOT EXISTS )?(\w+)", r"CREATE INDEX archive.\2", sql,
+                                        count=1))
+        finally:
+            conn.execute("DETACH DATABASE archive")
+        os.replace(tmp, target)
+        # 2. Les lignes quittent la base courante (les triggers retirent leurs agrégats)
+        with conn:
+            conn.execute("DELETE FROM fact_kpi WHERE periode_id BETWEEN ? AND ?", (low, high))
+            bump_data_version(conn)
+    finally:
+        conn.close()
+    log(f"+ T{trimestre} {annee} : {count} lignes archivées dans {target}")
+    return count
+
+
+def reintegrate(annee, trimestre, db_path=DB_PATH, directory=PARTITION_DIR, log=print):
+    """Recopie un trimestre archivé dans recrutement.db (pour le recharger ou le corriger) et retire le fichier"""
+    source = os.path.join(directory, file_name(annee, trimestre))
+    if not os.path.exists(source):
+        raise SystemExit(f"T{trimestre} {annee} n'est pas archivé")
+    conn = open_write_connection(db_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (source,))
+        try:
+            with conn:
+                # Les triggers de fact_kpi recalculent les agrégats du trimestre
+                count = conn.execute("INSERT INTO main.fact_kpi SELECT * FROM archive.fact_kpi").rowcount
+                bump_data_version(conn)
+        finally:
+            conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+    os.remove(source)
+    log(f"+ T{trimestre} {annee} : {count} lignes réintégrées")
+    return count
+
+
+def quarters_before(annee, trimestre, db_path=DB_PATH):
+    """Trimestres présents dans recrutement.db et antérieurs à (annee, trimestre)"""
+    conn = open_write_connection(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT DISTINCT periode_id / 100, (periode_id % 100 + 2) / 3 FROM fact_kpi
+            WHERE periode_id < ? ORDER BY 1, 2
+        """, (_periode_range(annee, trimestre)[0],)).fetchall()
+    finally:
+        conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--dossier", default=PARTITION_DIR, help="dossier des trimestres archivés")
+    commands = parser.add_subparsers(dest="commande", required=True)
+    commands.add_parser("liste", help="trimestres archivés")
+    archiver = commands.add_parser("archiver", help="déplace un trimestre dans son propre fichier")
+    archiver.add_argument("annee", type=int)
+    archiver.add_argument("trimestre", type=int, choices=[1, 2, 3, 4])
+    archiver.add_argument("--avant", action="store_true", help="archive tous les trimestres antérieurs")
+    reintegrer = commands.add_parser("reintegrer", help="recopie un trimestre archivé dans la base")
+    reintegrer.add_argument("annee", type=int)
+    reintegrer.add_argument("trimestre", type=int, choices=[1, 2, 3, 4])
+    args = parser.parse_args()
+
+    if args.commande == "liste":
+        archives, _ = PartitionCatalog(args.dossier).scan()
+        for (annee, trimestre), path in sorted(archives.items()):
+            print(f"T{trimestre} {annee} : {path} ({os.path.getsize(path) // 1024} Ko)")
+        if not archives:
+            print("Aucun trimestre archivé.")
+    elif args.commande == "archiver":
+        keys = quarters_before(args.annee, args.trimestre, args.db) if args.avant else [(args.annee, args.trimestre)]
+        for annee, trimestre in keys:
+            archive(annee, trimestre, args.db, args.dossier)
+    else:
+        reintegrate(args.annee, args.trimestre, args.db, args.dossier)
+    if args.commande != "liste" and PartitionCatalog(args.dossier).refresh_history():
+        print(f"+ historique consolidé préparé (plus de {MAX_ATTACHED} trimestres archivés)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Contexte de prompt réduit à ce qui concerne la question, pour un nombre de jetons à peu près constant.
+
+Le schéma et le vocabulaire (KPI, recruteurs, périodes) sont décrits une fois pour toutes sous forme
+compacte. Pour chaque question, un index lexical local (mots normalisés pondérés par IDF, tolérant
+aux fautes via les trigrammes) ne retient que les KPI, recruteurs et périodes pertinents, en nombre
+borné : la taille du prompt ne suit plus celle du catalogue.
+"""
+import math
+import re
+from llm_cache import context_fingerprint
+from fast_path import MOIS_NUMEROS
+from entity_index import fold, trigrams
+from schema import object_type
+
+# Nombre maximal de valeurs citées par catégorie
+MAX_KPIS = 3
+MAX_RECRUITERS = 6
+MAX_PERIODS = 12
+# Couverture minimale (part pondérée des mots d'une valeur retrouvés dans la question)
+MIN_KPI_SCORE = 0.3
+MIN_RECRUITER_SCORE = 0.99
+# Similarité (trigrammes) pour rapprocher un mot de la question d'un mot du catalogue
+WORD_SIMILARITY = 0.55
+
+# Mots outils ignorés par l'index lexical
+STOPWORDS = {"de", "des", "du", "la", "le", "les", "et", "en", "par", "pour", "a", "au", "aux", "un", "une",
+             "sur", "dans", "avec", "qui", "que", "quel", "quelle", "est", "suite"}
+
+TOKEN_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+YEAR_RE = re.compile(r"\b(?:19|20)\d\d\b")
+QUARTER_RE = re.compile(r"\b(?:t|q|trimestre\s*)([1-4])\b")
+
+
+def count_tokens(text):
+    """Estimation du nombre de jetons (découpage proche des tokenizers BPE : ~4 caractères par jeton)"""
+    return sum(1 + (len(piece) - 1) // 4 for piece in TOKEN_PIECE_RE.findall(text))
+
+
+def _words(text):
+    return [w for w in fold(text).split() if w not in STOPWORDS and not w.isdigit()]
+
+
+class LexicalIndex:
+    """Recherche des valeurs d'un catalogue par mots partagés avec la question, pondérés par IDF"""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._postings = {}
+        for i, entry in enumerate(self.entries):
+            for word in set(_words(entry)):
+                self._postings.setdefault(word, set()).add(i)
+        size = len(self.entries)
+        self._idf = {w: math.log(1 + size / len(ids)) for w, ids in self._postings.items()}
+        self._weights = [sum(self._idf[w] for w in set(_words(e))) for e in self.entries]
+        self._grams = {}
+        for word in self._postings:
+            for gram in trigrams(word):
+                self._grams.setdefault(gram, set()).add(word)
+
+    def _similar_words(self, word):
+        """Mots du catalogue égaux ou proches (Jaccard des trigrammes) d'un mot de la question"""
+        if word in self._postings:
+            return {word: 1.0}
+        grams = trigrams(word)
+        shared = {}
+        for gram in grams:
+            for candidate in self._grams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        similar = {}
+        for candidate, common in shared.items():
+            score = common / (len(grams) + len(trigrams(candidate)) - common)
+            if score >= WORD_SIMILARITY:
+                similar[candidate] = score
+        return similar
+
+    def search(self, question, min_score):
+        """Valeurs triées par pertinence : [(score de couverture, valeur)]"""
+        matched = {}
+        for word in set(_words(question)):
+            for candidate, similarity in self._similar_words(word).items():
+                matched[candidate] = max(matched.get(candidate, 0.0), similarity)
+        scores = {}
+        for word, similarity in matched.items():
+            for i in self._postings[word]:
+                scores[i] = scores.get(i, 0.0) + self._idf[word] * similarity
+        ranked = [(score / self._weights[i], self.entries[i]) for i, score in scores.items() if self._weights[i]]
+        return sorted((r for r in ranked if r[0] >= min_score), key=lambda r: (-r[0], str(r[1])))
+
+
+class PromptContext:
+    """Bloc de contexte d'un prompt : texte, jetons estimés et valeurs retenues"""
+
+    def __init__(self, text, tokens, selection):
+        self.text = text
+        self.tokens = tokens
+        self.selection = selection
+
+
+class PromptBuilder:
+    """Schéma et vocabulaire décrits une fois, puis filtrés question par question"""
+
+    def __init__(self, columns, kpis, recruiters, periods, version=0, entities=None):
+        self.schema_line = f"kpi_recrutement({', '.join(f'{name} {kind}' for name, kind in columns)})"
+        self.kpis = [k.strip() for k in kpis]
+        self.recruiters = list(recruiters)
+        # Périodes (annee, mois_num, mois) dans l'ordre chronologique
+        self.periods = sorted(periods, key=lambda p: (p[0] or 0, p[1] or 0))
+        self.version = version
+        self.entities = entities
+        self.kpi_index = LexicalIndex(self.kpis)
+        self.recruiter_index = LexicalIndex(self.recruiters)
+        self.fingerprint = context_fingerprint(self.schema_line, self.kpis, self.recruiters, self.periods)
+
+    @classmethod
+    def from_connection(cls, conn, entities):
+        """Catalogue construit à partir de l'index des valeurs (entity_index) et des périodes en base"""
+        columns = [(r[1], r[2]) for r in conn.execute("PRAGMA table_info(kpi_recrutement)")]
+        if object_type(conn, "dim_periode") == "table":
+            periods = conn.execute("SELECT DISTINCT annee, mois_num, mois FROM dim_periode").fetchall()
+        else:
+            periods = [(None, MOIS_NUMEROS.get(fold(m)), m) for m in entities.values("mois")]
+        return cls(columns, entities.values("kpi_nom"), entities.values("rh_nom"), periods,
+                   version=entities.version, entities=entities)
+
+    def _select_periods(self, question):
+        folded = fold(question)
+        months = {n for name, n in MOIS_NUMEROS.items() if re.search(rf"\b{name}\b", folded)}
+        quarter = QUARTER_RE.search(folded)
+        if quarter:
+            q = int(quarter.group(1))
+            months |= {3 * q - 2, 3 * q - 1, 3 * q}
+        years = {int(y) for y in YEAR_RE.findall(folded)}
+        return [p for p in self.periods
+                if (not months or p[1] in months) and (not years or p[0] in years)] if months or years else []
+
+    def select(self, question):
+        """KPI, recruteurs et périodes pertinents pour la question (listes bornées) et totaux du catalogue"""
+        scored = self.kpi_index.search(question, MIN_KPI_SCORE)
+        kpis = [k for _, k in scored]
+        recruiters = [r for _, r in self.recruiter_index.search(question, MIN_RECRUITER_SCORE)]
+        if self.entities is not None:
+            # Alias et fautes de frappe ('Marienne') : mot par mot, via l'index des valeurs
+            for word in _words(question):
+                found = self.entities.lookup("rh_nom", word)
+                if found is not None and found not in recruiters:
+                    recruiters.append(found)
+        return {
+            "kpis": kpis[:MAX_KPIS],
+            # KPI à égalité en tête : ceux que la question désigne vraiment
+            "kpis_principaux": [k for score, k in scored if score == scored[0][0]][:MAX_KPIS],
+            "recruteurs": recruiters[:MAX_RECRUITERS],
+            "periodes": self._select_periods(question)[:MAX_PERIODS],
+            "recruteurs_trouves": len(recruiters),
+        }
+
+    @staticmethod
+    def period_label(period):
+        annee, _, mois = period
+        return f"{mois} {annee}" if annee else str(mois)
+
+    def build(self, question):
+        """Contexte compact pour la question (schéma, valeurs exactes pertinentes) et jetons estimés"""
+        selection = self.select(question)
+        lines = [f"Table : {self.schema_line}"]
+        if selection["kpis"]:
+            lines.append("KPI concernés (kpi_nom exact) : " + ", ".join(f"'{k}'" for k in selection["kpis"]))
+        else:
+            examples = ", ".join(f"'{k}'" for k in self.kpis[:MAX_KPIS])
+            lines.append(f"{len(self.kpis)} KPI (kpi_nom exact), par exemple : {examples}")
+        if selection["recruteurs"]:
+            extra = selection["recruteurs_trouves"] - len(selection["recruteurs"])
+            lines.append("Recruteurs concernés (rh_nom exact) : "
+                         + ", ".join(f"'{r}'" for r in selection["recruteurs"])
+                         + (f" (+{extra} autres)" if extra > 0 else ""))
+        else:
+            examples = ", ".join(f"'{r}'" for r in self.recruiters[:MAX_RECRUITERS // 2])
+            lines.append(f"{len(self.recruiters)} recruteurs (rh_nom exact), par exemple : {examples}")
+        if selection["periodes"]:
+            lines.append("Périodes concernées : " + ", ".join(self.period_label(p) for p in selection["periodes"]))
+        elif self.periods:
+            month_names = sorted({p[2] for p in self.periods}, key=lambda m: MOIS_NUMEROS.get(fold(m), 99))
+            lines.append(f"Périodes : {self.period_label(self.periods[0])} à {self.period_label(self.periods[-1])}"
+                         f" (mois : {', '.join(repr(m) for m in month_names)})")
+        text = "\n".join(lines)
+        return PromptContext(text, count_tokens(text), selection)
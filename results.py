@@ -0,0 +1,164 @@
+"""Résultats lus par pages et agrégats calculés bloc par bloc, sans matérialiser tout le résultat.
+
+La première page est affichée dès qu'elle est lue ; la mémoire dépend de la taille d'une page
+(ou d'un bloc pour les agrégats), pas de celle du résultat. pandas n'est importé qu'à l'affichage.
+"""
+from charts import month_sort_key
+from core import stream_sql
+from sql_guard import has_top_level_limit
+
+# Lignes affichées par page (CLI et applications Streamlit)
+PAGE_SIZE = 50
+# Lignes lues par bloc pour les agrégats et le graphique
+AGGREGATE_CHUNK_ROWS = 5000
+
+
+class Page:
+    """Une page du résultat : numéro (à partir de 0), colonnes, lignes et présence d'une suite"""
+
+    def __init__(self, number, page_size, columns, rows, has_more):
+        self.number = number
+        self.page_size = page_size
+        self.columns = columns
+        self.rows = rows
+        self.has_more = has_more
+
+    @property
+    def first_row(self):
+        return self.number * self.page_size + 1
+
+    @property
+    def last_row(self):
+        return self.number * self.page_size + len(self.rows)
+
+    def describe(self):
+        suite = "" if self.has_more else " (fin du résultat)"
+        if not self.rows:
+            return f"Page {self.number + 1} : aucune ligne{suite}"
+        return f"Page {self.number + 1} : lignes {self.first_row} à {self.last_row}{suite}"
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame.from_records(self.rows, columns=self.columns)
+
+
+def iter_pages(sql, params=None, page_size=PAGE_SIZE):
+    """Pages successives d'une seule exécution de la requête (la page suivante est lue d'avance).
+
+    Le coût du plan n'est pas plafonné : seules les pages demandées sont lues, chacune dans le budget
+    de temps de la garde.
+    """
+    chunks = stream_sql(sql, params, page_size, check_cost=False)
+    try:
+        current = next(chunks, None)
+        number = 0
+        while current is not None:
+            following = next(chunks, None)
+            columns, rows = current
+            yield Page(number, page_size, columns, rows, following is not None)
+            current, number = following, number + 1
+    finally:
+        chunks.close()
+
+
+def page_sql(sql, number, page_size=PAGE_SIZE):
+    """Requête réduite à la page `number`, plus une ligne pour savoir s'il reste une suite.
+
+    Les lignes des pages précédentes sont sautées par SQLite (OFFSET) au lieu d'être lues puis jetées.
+    Une requête qui porte déjà son LIMIT est enveloppée pour que la page s'applique à son résultat.
+    """
+    sql = (sql or "").strip()
+    while sql.endswith(";"):
+        sql = sql[:-1].rstrip()
+    if has_top_level_limit(sql):
+        sql = f"SELECT * FROM (\n{sql}\n)"
+    return f"{sql}\nLIMIT {int(page_size) + 1} OFFSET {int(number) * int(page_size)}"
+
+
+def fetch_page(sql, params=None, number=0, page_size=PAGE_SIZE):
+    """Page `number` du résultat en une seule lecture bornée (pour les reruns Streamlit).
+
+    Comme pour iter_pages, le coût du plan n'est pas plafonné : LIMIT borne les lignes lues, le budget
+    de temps de la garde borne le reste.
+    """
+    chunks = stream_sql(page_sql(sql, number, page_size), params, page_size + 1, check_cost=False)
+    try:
+        columns, rows = next(chunks, ([], []))
+    finally:
+        chunks.close()
+    return Page(number, page_size, columns, rows[:page_size], len(rows) > page_size)
+
+
+class TrendAggregator:
+    """Somme de `valeur` par (mois, recruteur), mise à jour bloc par bloc"""
+
+    def __init__(self, index="mois", columns="rh_nom", values="valeur"):
+        self.index = index
+        self.columns = columns
+        self.values = values
+        self.totals = {}
+        self.rows = 0
+
+    def accepts(self, columns):
+        return all(c in columns for c in (self.index, self.columns, self.values))
+
+    def update(self, columns, rows):
+        i, j, k = columns.index(self.index), columns.index(self.columns), columns.index(self.values)
+        totals = self.totals
+        for row in rows:
+            value = row[k]
+            if value is None:
+                continue
+            key = (row[i], row[j])
+            totals[key] = totals.get(key, 0) + value
+        self.rows += len(rows)
+
+    def _sums(self, position):
+        sums = {}
+        for key, value in self.totals.items():
+            sums[key[position]] = sums.get(key[position], 0) + value
+        return sums
+
+    def by_month(self):
+        """Totaux par mois, dans l'ordre chronologique"""
+        sums = self._sums(0)
+        return {m: sums[m] for m in sorted(sums, key=month_sort_key)}
+
+    def by_recruiter(self):
+        return self._sums(1)
+
+    def pivot(self):
+        """Tableau croisé mois x recruteur (comme charts.pivot_by_month), construit à partir des totaux"""
+        import pandas as pd
+        months = list(self.by_month())
+        recruiters = sorted(self.by_recruiter(), key=str)
+        data = {r: [self.totals.get((m, r), 0) for m in months] for r in recruiters}
+        pivot = pd.DataFrame(data, index=pd.Index(months, name=self.index), columns=recruiters)
+        pivot.columns.name = self.columns
+        return pivot
+
+    def extremes(self):
+        """Mois le plus et le moins actif, recruteur le plus et le moins performant (None sans données)"""
+        if not self.totals:
+            return None
+        months, recruiters = self.by_month(), self.by_recruiter()
+        return {
+            "mois_max": max(months, key=months.get),
+            "mois_min": min(months, key=months.get),
+            "rh_max": max(recruiters, key=recruiters.get),
+            "rh_min": min(recruiters, key=recruiters.get),
+        }
+
+
+def aggregate_trends(sql, params=None, chunk_size=AGGREGATE_CHUNK_ROWS):
+    """Agrège tout le résultat par blocs ; None si les colonnes mois, rh_nom et valeur sont absentes"""
+    aggregator = TrendAggregator()
+    chunks = stream_sql(sql, params, chunk_size)
+    try:
+        for columns, rows in chunks:
+            if not aggregator.accepts(columns):
+                return None
+            aggregator.update(columns, rows)
+    finally:
+        chunks.close()
+    return aggregator
@@ -0,0 +1,223 @@
+"""Agrégats pré-calculés de fact_kpi, maintenus par triggers, et réécriture des requêtes pour les utiliser.
+
+Usage : python rollups.py [--db recrutement.db]   (recrée et recalcule les agrégats)
+
+Le grain de fact_kpi est déjà (recruteur, KPI, mois) : les requêtes mensuelles passent par ses index
+couvrants. Les agrégats matérialisés portent sur le trimestre, par recruteur/KPI et par KPI.
+"""
+import argparse
+import re
+from db import DB_PATH, open_write_connection, split_statements
+
+ROLLUP_SQL = """
+CREATE TABLE IF NOT EXISTS rollup_rh_kpi_trimestre (
+    kpi_id INTEGER NOT NULL,
+    rh_id INTEGER NOT NULL,
+    annee INTEGER NOT NULL,
+    trimestre INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    nb INTEGER NOT NULL,
+    PRIMARY KEY (kpi_id, rh_id, annee, trimestre)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_kpi_trimestre (
+    kpi_id INTEGER NOT NULL,
+    annee INTEGER NOT NULL,
+    trimestre INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    nb INTEGER NOT NULL,
+    PRIMARY KEY (kpi_id, annee, trimestre)
+) WITHOUT ROWID;
+
+CREATE VIEW IF NOT EXISTS kpi_rh_trimestre AS
+SELECT r.rh_nom, k.kpi_nom, t.annee, t.trimestre, t.total AS valeur
+FROM rollup_rh_kpi_trimestre t
+JOIN dim_rh r ON r.rh_id = t.rh_id
+JOIN dim_kpi k ON k.kpi_id = t.kpi_id;
+
+CREATE VIEW IF NOT EXISTS kpi_trimestre AS
+SELECT k.kpi_nom, t.annee, t.trimestre, t.total AS valeur
+FROM rollup_kpi_trimestre t
+JOIN dim_kpi k ON k.kpi_id = t.kpi_id;
+
+CREATE TRIGGER IF NOT EXISTS fact_kpi_rollup_insert AFTER INSERT ON fact_kpi
+BEGIN
+    INSERT INTO rollup_rh_kpi_trimestre (kpi_id, rh_id, annee, trimestre, total, nb)
+    VALUES (NEW.kpi_id, NEW.rh_id, NEW.periode_id / 100, (NEW.periode_id % 100 + 2) / 3, COALESCE(NEW.valeur, 0), 1)
+    ON CONFLICT (kpi_id, rh_id, annee, trimestre) DO UPDATE SET total = total + excluded.total, nb = nb + 1;
+    INSERT INTO rollup_kpi_trimestre (kpi_id, annee, trimestre, total, nb)
+    VALUES (NEW.kpi_id, NEW.periode_id / 100, (NEW.periode_id % 100 + 2) / 3, COALESCE(NEW.valeur, 0), 1)
+    ON CONFLICT (kpi_id, annee, trimestre) DO UPDATE SET total = total + excluded.total, nb = nb + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS fact_kpi_rollup_delete AFTER DELETE ON fact_kpi
+BEGIN
+    UPDATE rollup_rh_kpi_trimestre SET total = total - COALESCE(OLD.valeur, 0), nb = nb - 1
+    WHERE kpi_id = OLD.kpi_id AND rh_id = OLD.rh_id
+      AND annee = OLD.periode_id / 100 AND trimestre = (OLD.periode_id % 100 + 2) / 3;
+    UPDATE rollup_kpi_trimestre SET total = total - COALESCE(OLD.valeur, 0), nb = nb - 1
+    WHERE kpi_id = OLD.kpi_id AND annee = OLD.periode_id / 100 AND trimestre = (OLD.periode_id % 100 + 2) / 3;
+    DELETE FROM rollup_rh_kpi_trimestre WHERE nb <= 0 AND kpi_id = OLD.kpi_id AND rh_id = OLD.rh_id;
+    DELETE FROM rollup_kpi_trimestre WHERE nb <= 0 AND kpi_id = OLD.kpi_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS fact_kpi_rollup_update AFTER UPDATE OF kpi_id, rh_id, periode_id, valeur ON fact_kpi
+BEGIN
+    UPDATE rollup_rh_kpi_trimestre SET total = total - COALESCE(OLD.valeur, 0), nb = nb - 1
+    WHERE kpi_id = OLD.kpi_id AND rh_id = OLD.rh_id
+      AND annee = OLD.periode_id / 100 AND trimestre = (OLD.periode_id % 100 + 2) / 3;
+    UPDATE rollup_kpi_trimestre SET total = total - COALESCE(OLD.valeur, 0), nb = nb - 1
+    WHERE kpi_id = OLD.kpi_id AND annee = OLD.periode_id / 100 AND trimestre = (OLD.periode_id % 100 + 2) / 3;
+    INSERT INTO rollup_rh_kpi_trimestre (kpi_id, rh_id, annee, trimestre, total, nb)
+    VALUES (NEW.kpi_id, NEW.rh_id, NEW.periode_id / 100, (NEW.periode_id % 100 + 2) / 3, COALESCE(NEW.valeur, 0), 1)
+    ON CONFLICT (kpi_id, rh_id, annee, trimestre) DO UPDATE SET total = total + excluded.total, nb = nb + 1;
+    INSERT INTO rollup_kpi_trimestre (kpi_id, annee, trimestre, total, nb)
+    VALUES (NEW.kpi_id, NEW.periode_id / 100, (NEW.periode_id % 100 + 2) / 3, COALESCE(NEW.valeur, 0), 1)
+    ON CONFLICT (kpi_id, annee, trimestre) DO UPDATE SET total = total + excluded.total, nb = nb + 1;
+    DELETE FROM rollup_rh_kpi_trimestre WHERE nb <= 0 AND kpi_id = OLD.kpi_id AND rh_id = OLD.rh_id;
+    DELETE FROM rollup_kpi_trimestre WHERE nb <= 0 AND kpi_id = OLD.kpi_id;
+END;
+"""
+
+ROLLUP_TABLES = ["rollup_rh_kpi_trimestre", "rollup_kpi_trimestre"]
+ROLLUP_VIEWS = ["kpi_rh_trimestre", "kpi_trimestre"]
+ROLLUP_TRIGGERS = ["fact_kpi_rollup_insert", "fact_kpi_rollup_delete", "fact_kpi_rollup_update"]
+
+
+def create_rollups(conn):
+    """Crée les agrégats et leurs triggers ; les remplit s'ils viennent d'être créés"""
+    exists = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)", ROLLUP_TABLES
+    ).fetchone()[0] == len(ROLLUP_TABLES)
+    for statement in split_statements(ROLLUP_SQL):
+        conn.execute(statement)
+    if not exists:
+        refresh_rollups(conn)
+
+
+def refresh_rollups(conn):
+    """Recalcule entièrement les agrégats depuis fact_kpi"""
+    conn.execute("DELETE FROM rollup_rh_kpi_trimestre")
+    conn.execute("DELETE FROM rollup_kpi_trimestre")
+    conn.execute("""
+        INSERT INTO rollup_rh_kpi_trimestre (kpi_id, rh_id, annee, trimestre, total, nb)
+        SELECT kpi_id, rh_id, periode_id / 100, (periode_id % 100 + 2) / 3, SUM(COALESCE(valeur, 0)), COUNT(*)
+        FROM fact_kpi GROUP BY 1, 2, 3, 4
+    """)
+    conn.execute("""
+        INSERT INTO rollup_kpi_trimestre (kpi_id, annee, trimestre, total, nb)
+        SELECT kpi_id, annee, trimestre, SUM(total), SUM(nb)
+        FROM rollup_rh_kpi_trimestre GROUP BY 1, 2, 3
+    """)
+
+
+def drop_rollups(conn):
+    for trigger in ROLLUP_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for view in ROLLUP_VIEWS:
+        conn.execute(f"DROP VIEW IF EXISTS {view}")
+    for table in ROLLUP_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+# --- Réécriture des requêtes ---
+
+# Colonnes de la vue kpi_recrutement
+SOURCE_COLUMNS = {"rh_nom", "mois", "kpi_nom", "valeur", "commentaire", "periode_recrutement", "annee", "trimestre"}
+
+# Agrégats disponibles, du plus fin au plus grossier : (vue, colonnes exposées)
+ROLLUP_TARGETS = [
+    ("kpi_trimestre", {"kpi_nom", "annee", "trimestre", "valeur"}),
+    ("kpi_rh_trimestre", {"rh_nom", "kpi_nom", "annee", "trimestre", "valeur"}),
+]
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+WORD_RE = re.compile(r"\b[A-Za-z_][A-Za-z0-9_]*\b")
+SUM_VALEUR_RE = re.compile(r"\bSUM\s*\(\s*(?:\w+\.)?valeur\s*\)", re.IGNORECASE)
+VALEUR_ALIAS_RE = re.compile(r"\bAS\s+valeur\b", re.IGNORECASE)
+FORBIDDEN_RE = re.compile(
+    r"\b(JOIN|UNION|INTERSECT|EXCEPT|OVER)\b|\b(COUNT|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(", re.IGNORECASE
+)
+
+
+def _split_code(sql):
+    """Découpe la requête en segments (code, littéral) pour ne jamais modifier l'intérieur des chaînes"""
+    parts, pos = [], 0
+    for match in STRING_RE.finditer(sql):
+        parts.append((sql[pos:match.start()], False))
+        parts.append((match.group(0), True))
+        pos = match.end()
+    parts.append((sql[pos:], False))
+    return parts
+
+
+def choose_rollup(sql):
+    """Vue d'agrégat capable de répondre à la requête à l'identique, ou None"""
+    parts = _split_code(sql)
+    # Identifiants entre guillemets doubles : analyse trop incertaine, on ne réécrit pas
+    if any(is_literal and part.startswith('"') for part, is_literal in parts):
+        return None
+    code = " ".join(part for part, is_literal in parts if not is_literal)
+    if len(re.findall(r"\bSELECT\b", code, re.IGNORECASE)) != 1:
+        return None
+    if not re.search(r"\bFROM\s+kpi_recrutement\b", code, re.IGNORECASE) or FORBIDDEN_RE.search(code):
+        return None
+    # valeur ne doit apparaître que dans SUM(valeur) : la somme des sommes est exacte, pas le reste
+    sums = len(SUM_VALEUR_RE.findall(code))
+    references = len(re.findall(r"\bvaleur\b", code, re.IGNORECASE)) - len(VALEUR_ALIAS_RE.findall(code))
+    if sums == 0 or sums != references:
+        return None
+    used = {w.lower() for w in WORD_RE.findall(code)} & SOURCE_COLUMNS
+    for view, columns in ROLLUP_TARGETS:
+        if used <= columns:
+            return view
+    return None
+
+
+class RollupRewriter:
+    """Redirige les requêtes agrégées sur kpi_recrutement vers les agrégats trimestriels"""
+
+    def __init__(self, available_views):
+        self.available = set(available_views)
+        self.rewritten = 0
+
+    @classmethod
+    def from_connection(cls, conn):
+        views = [r[0] for r in conn.execute(
+            f"SELECT name FROM sqlite_master WHERE type = 'view' AND name IN ({', '.join('?' for _ in ROLLUP_VIEWS)})",
+            ROLLUP_VIEWS,
+        )]
+        return cls(views)
+
+    def rewrite(self, sql):
+        """Retourne la requête réécrite sur un agrégat si c'est possible, sinon la requête d'origine"""
+        if not self.available:
+            return sql
+        view = choose_rollup(sql)
+        if view is None or view not in self.available:
+            return sql
+        self.rewritten += 1
+        return "".join(
+            part if is_literal else re.sub(r"\bkpi_recrutement\b", view, part)
+            for part, is_literal in _split_code(sql)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = open_write_connection(args.db)
+    try:
+        with conn:
+            drop_rollups(conn)
+            create_rollups(conn)
+        count = conn.execute("SELECT COUNT(*) FROM rollup_rh_kpi_trimestre").fetchone()[0]
+        print(f"✅ Agrégats recalculés ({count} lignes recruteur/KPI/trimestre)")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Schéma en étoile de kpi_recrutement et migration depuis l'ancienne table plate.
+
+Usage : python schema.py [--db recrutement.db] [--annee 2024]
+"""
+import argparse
+import hashlib
+import threading
+from db import DB_PATH, open_write_connection, split_statements
+from rollups import create_rollups, drop_rollups
+
+# Année des données historiques saisies sans année (T3 2024)
+DEFAULT_YEAR = 2024
+
+# Versions de l'ancienne table plate déjà calculées, par connexion (empreinte complète recalculée au changement)
+FLAT_VERSIONS_MAX = 64
+
+# Mois français : alias (en minuscules) -> (numéro, nom canonique). Inclut la coquille 'Juilet'.
+MOIS = [
+    ("janvier", 1, "Janvier"), ("février", 2, "Février"), ("fevrier", 2, "Février"),
+    ("mars", 3, "Mars"), ("avril", 4, "Avril"), ("mai", 5, "Mai"), ("juin", 6, "Juin"),
+    ("juillet", 7, "Juillet"), ("juilet", 7, "Juillet"), ("août", 8, "Août"), ("aout", 8, "Août"),
+    ("septembre", 9, "Septembre"), ("octobre", 10, "Octobre"), ("novembre", 11, "Novembre"),
+    ("décembre", 12, "Décembre"), ("decembre", 12, "Décembre"),
+]
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS schema_meta (
+    cle TEXT PRIMARY KEY,
+    valeur TEXT
+);
+
+CREATE TABLE IF NOT EXISTS mois_alias (
+    alias TEXT PRIMARY KEY,
+    mois_num INTEGER NOT NULL,
+    nom TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS dim_rh (
+    rh_id INTEGER PRIMARY KEY,
+    rh_nom TEXT NOT NULL UNIQUE,
+    periode_recrutement TEXT
+);
+
+CREATE TABLE IF NOT EXISTS dim_kpi (
+    kpi_id INTEGER PRIMARY KEY,
+    kpi_nom TEXT NOT NULL UNIQUE
+);
+
+-- periode_id = annee * 100 + mois_num : clé entière compacte et triable
+CREATE TABLE IF NOT EXISTS dim_periode (
+    periode_id INTEGER PRIMARY KEY,
+    annee INTEGER NOT NULL,
+    mois_num INTEGER NOT NULL,
+    trimestre INTEGER NOT NULL,
+    mois TEXT NOT NULL,
+    date_periode TEXT NOT NULL UNIQUE
+);
+
+-- Table de faits étroite ; la clé primaire (kpi, rh, période) sert d'index couvrant
+CREATE TABLE IF NOT EXISTS fact_kpi (
+    kpi_id INTEGER NOT NULL REFERENCES dim_kpi (kpi_id),
+    rh_id INTEGER NOT NULL REFERENCES dim_rh (rh_id),
+    periode_id INTEGER NOT NULL REFERENCES dim_periode (periode_id),
+    valeur INTEGER,
+    commentaire TEXT,
+    PRIMARY KEY (kpi_id, rh_id, periode_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_fact_rh_periode ON fact_kpi (rh_id, periode_id, kpi_id, valeur);
+CREATE INDEX IF NOT EXISTS idx_fact_periode ON fact_kpi (periode_id, kpi_id, rh_id, valeur);
+
+-- Vue de compatibilité : mêmes colonnes que l'ancienne table, plus l'année et le trimestre
+CREATE VIEW IF NOT EXISTS kpi_recrutement AS
+SELECT r.rh_nom, p.mois, k.kpi_nom, f.valeur, f.commentaire, r.periode_recrutement,
+       p.annee, p.trimestre
+FROM fact_kpi f
+JOIN dim_rh r ON r.rh_id = f.rh_id
+JOIN dim_kpi k ON k.kpi_id = f.kpi_id
+JOIN dim_periode p ON p.periode_id = f.periode_id;
+
+-- Les écritures sur la vue (chargement, corrections type updates.py) alimentent les dimensions et les faits
+CREATE TRIGGER IF NOT EXISTS kpi_recrutement_insert INSTEAD OF INSERT ON kpi_recrutement
+BEGIN
+    SELECT RAISE(ABORT, 'mois inconnu')
+    WHERE NOT EXISTS (SELECT 1 FROM mois_alias WHERE alias = lower(trim(NEW.mois)));
+    INSERT OR IGNORE INTO dim_rh (rh_nom) VALUES (trim(NEW.rh_nom));
+    UPDATE dim_rh SET periode_recrutement = NEW.periode_recrutement
+    WHERE rh_nom = trim(NEW.rh_nom) AND NEW.periode_recrutement IS NOT NULL;
+    INSERT OR IGNORE INTO dim_kpi (kpi_nom) VALUES (trim(NEW.kpi_nom));
+    INSERT OR IGNORE INTO dim_periode (periode_id, annee, mois_num, trimestre, mois, date_periode)
+    SELECT y.annee * 100 + m.mois_num, y.annee, m.mois_num, (m.mois_num + 2) / 3, m.nom,
+           printf('%04d-%02d-01', y.annee, m.mois_num)
+    FROM mois_alias m,
+         (SELECT COALESCE(NEW.annee, (SELECT CAST(valeur AS INTEGER) FROM schema_meta
+                                      WHERE cle = 'annee_defaut')) AS annee) y
+    WHERE m.alias = lower(trim(NEW.mois));
+    INSERT INTO fact_kpi (kpi_id, rh_id, periode_id, valeur, commentaire)
+    VALUES (
+        (SELECT kpi_id FROM dim_kpi WHERE kpi_nom = trim(NEW.kpi_nom)),
+        (SELECT rh_id FROM dim_rh WHERE rh_nom = trim(NEW.rh_nom)),
+        COALESCE(NEW.annee, (SELECT CAST(valeur AS INTEGER) FROM schema_meta WHERE cle = 'annee_defaut')) * 100
+            + (SELECT mois_num FROM mois_alias WHERE alias = lower(trim(NEW.mois))),
+        NEW.valeur,
+        NULLIF(trim(NEW.commentaire), '')
+    )
+    ON CONFLICT (kpi_id, rh_id, periode_id) DO UPDATE SET
+        valeur = excluded.valeur,
+        commentaire = excluded.commentaire;
+END;
+
+CREATE TRIGGER IF NOT EXISTS kpi_recrutement_update INSTEAD OF UPDATE ON kpi_recrutement
+BEGIN
+    SELECT RAISE(ABORT, 'mois inconnu')
+    WHERE NOT EXISTS (SELECT 1 FROM mois_alias WHERE alias = lower(trim(NEW.mois)));
+    INSERT OR IGNORE INTO dim_rh (rh_nom, periode_recrutement) VALUES (trim(NEW.rh_nom), NEW.periode_recrutement);
+    INSERT OR IGNORE INTO dim_kpi (kpi_nom) VALUES (trim(NEW.kpi_nom));
+    INSERT OR IGNORE INTO dim_periode (periode_id, annee, mois_num, trimestre, mois, date_periode)
+    SELECT NEW.annee * 100 + m.mois_num, NEW.annee, m.mois_num, (m.mois_num + 2) / 3, m.nom,
+           printf('%04d-%02d-01', NEW.annee, m.mois_num)
+    FROM mois_alias m WHERE m.alias = lower(trim(NEW.mois));
+    UPDATE fact_kpi SET
+        kpi_id = (SELECT kpi_id FROM dim_kpi WHERE kpi_nom = trim(NEW.kpi_nom)),
+        rh_id = (SELECT rh_id FROM dim_rh WHERE rh_nom = trim(NEW.rh_nom)),
+        periode_id = NEW.annee * 100 + (SELECT mois_num FROM mois_alias WHERE alias = lower(trim(NEW.mois))),
+        valeur = NEW.valeur,
+        commentaire = NULLIF(trim(NEW.commentaire), '')
+    WHERE kpi_id = (SELECT kpi_id FROM dim_kpi WHERE kpi_nom = OLD.kpi_nom)
+      AND rh_id = (SELECT rh_id FROM dim_rh WHERE rh_nom = OLD.rh_nom)
+      AND periode_id = (SELECT periode_id FROM dim_periode WHERE annee = OLD.annee AND mois = OLD.mois);
+    UPDATE dim_rh SET periode_recrutement = NEW.periode_recrutement
+    WHERE rh_nom = trim(NEW.rh_nom) AND NEW.periode_recrutement IS NOT OLD.periode_recrutement;
+END;
+
+CREATE TRIGGER IF NOT EXISTS kpi_recrutement_delete INSTEAD OF DELETE ON kpi_recrutement
+BEGIN
+    DELETE FROM fact_kpi
+    WHERE kpi_id = (SELECT kpi_id FROM dim_kpi WHERE kpi_nom = OLD.kpi_nom)
+      AND rh_id = (SELECT rh_id FROM dim_rh WHERE rh_nom = OLD.rh_nom)
+      AND periode_id = (SELECT periode_id FROM dim_periode WHERE annee = OLD.annee AND mois = OLD.mois);
+END;
+"""
+
+# Tables du schéma en étoile, dans l'ordre de suppression
+STAR_TABLES = ["fact_kpi", "dim_periode", "dim_kpi", "dim_rh", "mois_alias", "schema_meta"]
+
+
+def object_type(conn, name):
+    """Type de l'objet SQLite ('table', 'view' ou None)"""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+_flat_versions = {}
+_flat_lock = threading.Lock()
+
+
+def _flat_version(conn):
+    """Version de l'ancienne table plate (un trimestre, sans schema_meta) : empreinte de tout son contenu.
+
+    Une modification de valeur ou un renommage la change aussi. L'empreinte n'est recalculée que si la signature bon marché change : PRAGMA data_version (écritures
+    des autres connexions), total_changes (écritures de celle-ci), nombre de lignes et plus grand rowid.
+    """
+    signature = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes,
+                 *conn.execute("SELECT COUNT(*), MAX(rowid) FROM kpi_recrutement").fetchone())
+    with _flat_lock:
+        cached = _flat_versions.get(id(conn))
+    # La connexion est gardée avec sa version : son id ne peut pas être réutilisé par une autre
+    if cached is not None and cached[0] is conn and cached[1] == signature:
+        return cached[2]
+    digest = hashlib.sha1()
+    for row in conn.execute("SELECT rowid, * FROM kpi_recrutement ORDER BY rowid"):
+        digest.update(repr(row).encode("utf-8"))
+    version = f"plat:{signature[2]}:{digest.hexdigest()[:16]}"
+    with _flat_lock:
+        _flat_versions.pop(id(conn), None)
+        _flat_versions[id(conn)] = (conn, signature, version)
+        while len(_flat_versions) > FLAT_VERSIONS_MAX:
+            _flat_versions.pop(next(iter(_flat_versions)))
+    return version
+
+
+def data_version(conn):
+    """Version des données : compteur des chargements et totaux des agrégats (changent à chaque écriture)"""
+    if object_type(conn, "kpi_recrutement") == "table":
+        return _flat_version(conn)
+    row = conn.execute("SELECT valeur FROM schema_meta WHERE cle = 'version_donnees'").fetchone()
+    version = row[0] if row else "0"
+    if object_type(conn, "rollup_kpi_trimestre") == "table":
+        # Écritures faites sans bump_data_version : les agrégats maintenus par triggers les trahissent
+        total, nb = conn.execute(
+            "SELECT COALESCE(SUM(total), 0), COALESCE(SUM(nb), 0) FROM rollup_kpi_trimestre"
+        ).fetchone()
+        version = f"{version}:{total}:{nb}"
+    return version
+
+
+def bump_data_version(conn):
+    """Marque un changement des données (à appeler dans la transaction d'écriture)"""
+    if object_type(conn, "schema_meta") != "table":
+        # Ancienne table plate : sa version se déduit de son contenu
+        return
+    conn.execute("""
+        INSERT INTO schema_meta (cle, valeur) VALUES ('version_donnees', '1')
+        ON CONFLICT (cle) DO UPDATE SET valeur = CAST(valeur AS INTEGER) + 1
+    """)
+
+
+def create_schema(conn, annee=DEFAULT_YEAR):
+    """Crée (si besoin) le schéma en étoile, la vue de compatibilité et ses triggers"""
+    # Pas d'executescript : il validerait la transaction en cours et casserait l'atomicité des migrations
+    for statement in split_statements(SCHEMA_SQL):
+        conn.execute(statement)
+    conn.executemany("INSERT OR IGNORE INTO mois_alias (alias, mois_num, nom) VALUES (?, ?, ?)", MOIS)
+    conn.execute(
+        "INSERT OR IGNORE INTO schema_meta (cle, valeur) VALUES ('annee_defaut', ?)", (str(annee),)
+    )
+    # Agrégats trimestriels maintenus par triggers sur fact_kpi
+    create_rollups(conn)
+
+
+def reset_schema(conn, annee=DEFAULT_YEAR):
+    """Supprime toutes les données et recrée un schéma en étoile vide"""
+    if object_type(conn, "kpi_recrutement") == "table":
+        conn.execute("DROP TABLE kpi_recrutement")
+    conn.execute("DROP VIEW IF EXISTS kpi_recrutement")
+    drop_rollups(conn)
+    for table in STAR_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    create_schema(conn, annee)
+
+
+def migrate_flat_table(conn, annee=DEFAULT_YEAR):
+    """Migre l'ancienne table plate kpi_recrutement vers le schéma en étoile (idempotent)"""
+    if object_type(conn, "kpi_recrutement") != "table":
+        create_schema(conn, annee)
+        return 0
+    unmapped = conn.execute("""
+        SELECT COUNT(*) FROM kpi_recrutement t
+        WHERE lower(trim(t.mois)) NOT IN (%s)
+    """ % ", ".join("?" for _ in MOIS), [alias for alias, _, _ in MOIS]).fetchone()[0]
+    if unmapped:
+        raise ValueError(f"{unmapped} lignes avec un mois non reconnu, migration annulée")
+    conn.execute("ALTER TABLE kpi_recrutement RENAME TO kpi_recrutement_plat")
+    create_schema(conn, annee)
+    # Migration ensembliste : dimensions puis faits, sans passer ligne à ligne par les triggers
+    conn.execute("""
+        INSERT OR IGNORE INTO dim_rh (rh_nom, periode_recrutement)
+        SELECT trim(rh_nom), MAX(periode_recrutement) FROM kpi_recrutement_plat GROUP BY trim(rh_nom)
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO dim_kpi (kpi_nom)
+        SELECT DISTINCT trim(kpi_nom) FROM kpi_recrutement_plat
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO dim_periode (periode_id, annee, mois_num, trimestre, mois, date_periode)
+        SELECT DISTINCT ? * 100 + m.mois_num, ?, m.mois_num, (m.mois_num + 2) / 3, m.nom,
+               printf('%04d-%02d-01', ?, m.mois_num)
+        FROM kpi_recrutement_plat t JOIN mois_alias m ON m.alias = lower(trim(t.mois))
+    """, (annee, annee, annee))
+    migrated = conn.execute("""
+        INSERT INTO fact_kpi (kpi_id, rh_id, periode_id, valeur, commentaire)
+        SELECT k.kpi_id, r.rh_id, ? * 100 + m.mois_num, t.valeur, NULLIF(trim(t.commentaire), '')
+        FROM kpi_recrutement_plat t
+        JOIN dim_rh r ON r.rh_nom = trim(t.rh_nom)
+        JOIN dim_kpi k ON k.kpi_nom = trim(t.kpi_nom)
+        JOIN mois_alias m ON m.alias = lower(trim(t.mois))
+        WHERE 1
+        ON CONFLICT (kpi_id, rh_id, periode_id) DO UPDATE SET
+            valeur = excluded.valeur,
+            commentaire = excluded.commentaire
+    """, (annee,)).rowcount
+    conn.execute("DROP TABLE kpi_recrutement_plat")
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--annee", type=int, default=DEFAULT_YEAR,
+                        help="année des lignes historiques sans année")
+    args = parser.parse_args()
+
+    conn = open_write_connection(args.db)
+    try:
+        # Migration dans une seule transaction : en cas d'erreur l'ancienne table reste intacte
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migrated = migrate_flat_table(conn, args.annee)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        conn.execute("VACUUM")
+        conn.execute("ANALYZE")
+        print(f"✅ Schéma en étoile en place ({migrated} lignes migrées)")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
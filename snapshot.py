@@ -0,0 +1,275 @@
+"""Instantanés colonnes (Arrow IPC) de kpi_recrutement pour les notebooks et tableaux de bord.
+
+Usage : python snapshot.py [--db recrutement.db] [--dossier snapshots]   (exporte ou met à jour)
+
+Un fichier par mois (partition), colonnes recruteur, KPI et mois encodées en dictionnaire. Un
+manifeste versionné (version des données, partitions et leurs signatures) désigne les fichiers
+valables : après un chargement, seuls les mois dont la signature a changé sont réécrits. Le
+chargement projette la mémoire des fichiers (mmap, sans copie), ne lit que les partitions et les
+colonnes utiles et filtre les lignes sur les colonnes encodées.
+"""
+import argparse
+import datetime
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+from db import BASE_DIR, DB_PATH, open_read_connection
+from partitions import data_version, get_catalog
+from schema import object_type
+
+SNAPSHOT_DIR = os.getenv("RH_CHAT_SNAPSHOTS", os.path.join(BASE_DIR, "snapshots"))
+
+# Manifestes conservés (les fichiers qu'ils citent restent lisibles)
+KEEP_VERSIONS = 3
+
+# Colonnes de l'instantané (celles de la vue kpi_recrutement) et colonnes encodées en dictionnaire
+COLUMNS = ["rh_nom", "mois", "kpi_nom", "valeur", "commentaire", "periode_recrutement", "annee", "trimestre"]
+DICTIONARY_COLUMNS = ["rh_nom", "mois", "kpi_nom", "periode_recrutement"]
+# Colonnes connues au niveau de la partition : un filtre sur elles élimine des fichiers entiers
+PARTITION_COLUMNS = ["annee", "mois", "trimestre"]
+
+# Signature de chaque mois : nombre de lignes, somme et sommes pondérées par les clés (index couvrant
+# idx_fact_periode), longueur des commentaires ; une écriture sur un mois change au moins l'une d'elles
+PARTITIONS_SQL = """
+SELECT p.periode_id, p.annee, p.mois, p.trimestre, s.lignes, s.total, s.par_rh, s.par_kpi, s.commentaires
+FROM (
+    SELECT periode_id, COUNT(*) AS lignes, TOTAL(valeur) AS total, TOTAL(rh_id * valeur) AS par_rh,
+           TOTAL(kpi_id * valeur) AS par_kpi, TOTAL(length(commentaire)) AS commentaires
+    FROM fact_kpi GROUP BY periode_id
+) AS s
+JOIN dim_periode AS p USING (periode_id)
+ORDER BY p.periode_id
+"""
+
+PARTITION_ROWS_SQL = """
+SELECT r.rh_nom, p.mois, k.kpi_nom, f.valeur, f.commentaire, r.periode_recrutement, p.annee, p.trimestre
+FROM fact_kpi f
+JOIN dim_rh r ON r.rh_id = f.rh_id
+JOIN dim_kpi k ON k.kpi_id = f.kpi_id
+JOIN dim_periode p ON p.periode_id = f.periode_id
+WHERE f.periode_id = ?
+"""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError:
+        raise SystemExit("pyarrow est nécessaire pour les instantanés colonnes (pip install pyarrow)")
+    return pyarrow
+
+
+def _dimensions_signature(conn):
+    """Empreinte des dimensions : renommer un recruteur touche toutes les partitions"""
+    digest = hashlib.sha1()
+    for sql in ("SELECT rh_id, rh_nom, periode_recrutement FROM dim_rh ORDER BY rh_id",
+                "SELECT kpi_id, kpi_nom FROM dim_kpi ORDER BY kpi_id"):
+        for row in conn.execute(sql):
+            digest.update(repr(row).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def _partitions(conn):
+    """Partitions de la base : clé (periode_id), attributs de partition et signature du contenu"""
+    dimensions = _dimensions_signature(conn)
+    partitions = {}
+    for periode_id, annee, mois, trimestre, *stats in conn.execute(PARTITIONS_SQL):
+        signature = hashlib.sha1(repr((dimensions, stats)).encode("utf-8")).hexdigest()[:16]
+        partitions[str(periode_id)] = {"annee": annee, "mois": mois, "trimestre": trimestre,
+                                       "lignes": stats[0], "signature": signature}
+    return partitions
+
+
+# --- Manifestes ---
+
+def _manifests(directory):
+    """Manifestes du dossier, du plus récent au plus ancien"""
+    return sorted(glob.glob(os.path.join(directory, "manifest-*.json")), reverse=True)
+
+
+def read_manifest(directory=SNAPSHOT_DIR, version=None):
+    """Dernier manifeste (ou celui de la version des données `version`), None s'il n'y en a pas"""
+    for path in _manifests(directory):
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if version is None or manifest["version"] == version:
+            return manifest
+    return None
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, f"manifest-{manifest['sequence']:06d}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    # Le nouveau manifeste n'apparaît qu'une fois complet : un lecteur voit l'ancien ou le nouveau
+    os.replace(tmp, path)
+
+
+def _purge(directory):
+    """Supprime les manifestes au-delà de KEEP_VERSIONS et les fichiers qu'aucun manifeste ne cite"""
+    manifests = _manifests(directory)
+    for path in manifests[KEEP_VERSIONS:]:
+        os.remove(path)
+    used = set()
+    for path in manifests[:KEEP_VERSIONS]:
+        with open(path, encoding="utf-8") as f:
+            used.update(p["fichier"] for p in json.load(f)["partitions"].values())
+    for path in glob.glob(os.path.join(directory, "*.arrow")):
+        if os.path.basename(path) not in used:
+            os.remove(path)
+
+
+# --- Export ---
+
+def _write_partition(conn, directory, key, partition):
+    """Écrit le fichier Arrow IPC d'un mois (colonnes texte encodées en dictionnaire)"""
+    pa = _pyarrow()
+    rows = conn.execute(PARTITION_ROWS_SQL, (int(key),)).fetchall()
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    arrays = []
+    for name, values in zip(COLUMNS, columns):
+        array = pa.array(values, type=pa.string() if name in DICTIONARY_COLUMNS + ["commentaire"] else pa.int64())
+        arrays.append(array.dictionary_encode() if name in DICTIONARY_COLUMNS else array)
+    table = pa.Table.from_arrays(arrays, names=COLUMNS)
+    name = f"{key}-{partition['signature']}.arrow"
+    tmp = os.path.join(directory, f"{name}.tmp")
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, os.path.join(directory, name))
+    return name
+
+
+def export(db_path=DB_PATH, directory=SNAPSHOT_DIR, log=print):
+    """Met l'instantané à jour : seuls les mois nouveaux ou modifiés depuis le dernier sont réécrits"""
+    _pyarrow()
+    os.makedirs(directory, exist_ok=True)
+    conn = open_read_connection(db_path)
+    try:
+        if object_type(conn, "fact_kpi") != "table":
+            raise SystemExit("Instantanés disponibles sur le schéma en étoile (python schema.py pour migrer)")
+        # Trimestres archivés compris ; lecture cohérente : version et mois vus dans la même transaction
+        get_catalog().attach_all(conn)
+        conn.execute("BEGIN")
+        version = data_version(conn)
+        previous = read_manifest(directory)
+        if previous is not None and previous["version"] == version:
+            log(f"= instantané déjà à jour (version {version})")
+            return previous
+        known = previous["partitions"] if previous else {}
+        partitions = _partitions(conn)
+        written = 0
+        for key, partition in partitions.items():
+            old = known.get(key)
+            if old is not None and old["signature"] == partition["signature"]:
+                partition["fichier"] = old["fichier"]
+                continue
+            partition["fichier"] = _write_partition(conn, directory, key, partition)
+            written += 1
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    manifest = {
+        "version": version,
+        "sequence": previous["sequence"] + 1 if previous else 1,
+        "cree_le": datetime.datetime.now().isoformat(timespec="seconds"),
+        "colonnes": COLUMNS,
+        "partitions": partitions,
+    }
+    _write_manifest(directory, manifest)
+    _purge(directory)
+    log(f"+ instantané version {version} : {written} mois réécrits sur {len(partitions)}")
+    return manifest
+
+
+def snapshots_enabled(directory=SNAPSHOT_DIR):
+    """Vrai si un instantané a déjà été exporté : le chargement le met alors à jour"""
+    return bool(_manifests(directory))
+
+
+# --- Chargement ---
+
+def _values(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def load_table(columns=None, filters=None, directory=SNAPSHOT_DIR, version=None):
+    """Table Arrow de l'instantané, projetée en mémoire (mmap) sans copie des fichiers.
+
+    `columns` limite les colonnes lues ; `filters` ({colonne: valeur ou liste}) élimine d'abord les
+    partitions (annee, mois, trimestre), puis filtre les lignes des partitions restantes.
+    """
+    pa = _pyarrow()
+    manifest = read_manifest(directory, version)
+    if manifest is None:
+        raise FileNotFoundError(f"Aucun instantané dans {directory} (python snapshot.py pour l'exporter)")
+    filters = {name: _values(value) for name, value in (filters or {}).items()}
+    wanted = list(columns or manifest["colonnes"])
+    read = wanted + [name for name in filters if name not in wanted]
+    tables = []
+    for partition in manifest["partitions"].values():
+        if any(name in PARTITION_COLUMNS and partition[name] not in values for name, values in filters.items()):
+            continue
+        source = pa.memory_map(os.path.join(directory, partition["fichier"]), "r")
+        table = pa.ipc.open_file(source).read_all().select(read)
+        for name, values in filters.items():
+            if name not in PARTITION_COLUMNS:
+                table = table.filter(pa.compute.is_in(table[name], value_set=pa.array(values)))
+        tables.append(table.select(wanted))
+    if not tables:
+        return None
+    # Les dictionnaires diffèrent d'un mois à l'autre : ils sont unifiés à la concaténation
+    return pa.concat_tables(tables).unify_dictionaries()
+
+
+def read_database(columns=None, filters=None, db_path=DB_PATH):
+    """Même DataFrame que load_dataframe, lu dans la base (pd.read_sql) : archives comprises, sans instantané"""
+    import pandas as pd
+    conn = open_read_connection(db_path)
+    try:
+        star = object_type(conn, "fact_kpi") == "table"
+        if star:
+            get_catalog().attach_all(conn)
+        # L'ancienne table plate n'a ni annee ni trimestre
+        present = {row[1] for row in conn.execute("PRAGMA table_info(kpi_recrutement)")}
+        available = [c for c in COLUMNS if star or c in present]
+        filters = {name: _values(value) for name, value in (filters or {}).items()}
+        where = [f"{name} IN ({', '.join('?' for _ in values)})" for name, values in filters.items()]
+        params = [v for values in filters.values() for v in values]
+        sql = f"SELECT {', '.join(columns or available)} FROM kpi_recrutement"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def load_dataframe(columns=None, filters=None, directory=SNAPSHOT_DIR, version=None, db_path=DB_PATH):
+    """DataFrame de l'instantané (colonnes encodées -> catégories pandas, sans chaînes répétées).
+
+    Sans instantané exporté ni pyarrow (clone neuf, base encore au format plat), la base est lue
+    directement avec read_database.
+    """
+    import pandas as pd
+    if version is None and (importlib.util.find_spec("pyarrow") is None or read_manifest(directory) is None):
+        return read_database(columns, filters, db_path)
+    table = load_table(columns, filters, directory, version)
+    if table is None:
+        return pd.DataFrame(columns=list(columns or COLUMNS))
+    return table.to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--dossier", default=SNAPSHOT_DIR, help="dossier des instantanés")
+    args = parser.parse_args()
+    export(args.db, args.dossier)
+
+
+if __name__ == "__main__":
+    main()
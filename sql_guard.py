@@ -0,0 +1,327 @@
+"""Garde d'exécution pour les requêtes SQL générées par le LLM.
+
+Avant exécution : une seule instruction SELECT/WITH, autorisée en lecture seule (authorizer SQLite),
+et un coût estimé à partir d'EXPLAIN QUERY PLAN et de sqlite_stat1. Pendant l'exécution : budget de
+temps via le progress handler, LIMIT automatique et plafonds de lignes et d'octets, ou lecture par
+blocs (stream) pour la pagination.
+"""
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from tracing import span, annotate, count
+
+# Plafonds appliqués à chaque requête
+MAX_ROWS = 5000
+MAX_BYTES = 8 * 1024 * 1024
+TIME_BUDGET_S = 2.0
+# Taille des blocs lus par stream() (lecture par pages)
+CHUNK_ROWS = 1000
+# Nombre maximal de lignes visitées estimé à partir du plan
+MAX_PLAN_COST = 5_000_000
+# Fréquence d'appel du progress handler (instructions de la VM SQLite)
+PROGRESS_STEPS = 10_000
+# Estimations par défaut quand sqlite_stat1 ne renseigne pas la table ou l'index
+DEFAULT_TABLE_ROWS = 1000
+DEFAULT_SEARCH_ROWS = 10
+
+# Actions autorisées pendant la préparation de la requête : lecture uniquement
+ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.DOTALL)
+FIRST_WORD_RE = re.compile(r"^\s*\(*\s*([A-Za-z]+)")
+LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+TABLE_ALIAS_RE = re.compile(
+    r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.IGNORECASE
+)
+ALIAS_KEYWORDS = {"where", "join", "inner", "left", "right", "cross", "natural", "on", "using",
+                  "group", "order", "limit", "union", "except", "intersect", "having", "window"}
+PLAN_SCAN_RE = re.compile(r"^SCAN (\w+)")
+PLAN_SEARCH_RE = re.compile(r"^SEARCH (\w+) USING (?:(INTEGER PRIMARY KEY)|(AUTOMATIC)[^(]*|(?:COVERING )?INDEX (\w+)|(PRIMARY KEY))\s*(\(.*\))?")
+
+
+class GuardError(Exception):
+    """Requête refusée ou interrompue par la garde ; `reason` explique pourquoi"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _code_only(sql):
+    """Requête sans littéraux ni commentaires (pour l'analyse des mots-clés)"""
+    return LITERAL_RE.sub(lambda m: " " if m.group(0).startswith(("--", "/*")) else "''", sql)
+
+
+def check_statement(sql):
+    """Vérifie qu'il s'agit d'une seule requête SELECT/WITH ; retourne la requête sans ';' final"""
+    sql = (sql or "").strip()
+    while sql.endswith(";"):
+        sql = sql[:-1].rstrip()
+    if not sql:
+        raise GuardError("requête vide")
+    code = _code_only(sql)
+    if ";" in code:
+        raise GuardError("plusieurs instructions SQL dans la même requête")
+    match = FIRST_WORD_RE.match(code)
+    if not match or match.group(1).upper() not in ("SELECT", "WITH"):
+        raise GuardError("seules les requêtes SELECT sont autorisées")
+    return sql
+
+
+def has_top_level_limit(sql):
+    """Vrai si la requête porte déjà un LIMIT hors des sous-requêtes"""
+    code = _code_only(sql)
+    depth = 0
+    for i, char in enumerate(code):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0 and LIMIT_RE.match(code, i) and (i == 0 or not code[i - 1].isalnum()):
+            return True
+    return False
+
+
+def _authorizer(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _row_size(row):
+    return sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in row)
+
+
+class TableStats:
+    """Nombre de lignes par table et sélectivité des index, lus dans sqlite_stat1 et le schéma"""
+
+    def __init__(self, rows, index_stats, aliases):
+        self.rows = rows
+        self.index_stats = index_stats
+        self.aliases = aliases
+
+    @classmethod
+    def from_connection(cls, conn):
+        rows, index_stats = {}, {}
+        try:
+            for table, index, stat in conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1"):
+                numbers = [int(n) for n in stat.split() if n.isdigit()]
+                if not numbers:
+                    continue
+                rows[table] = max(rows.get(table, 0), numbers[0])
+                # Pour une table WITHOUT ROWID, la clé primaire porte le nom de la table
+                index_stats[index or table] = numbers
+        except sqlite3.OperationalError:
+            pass  # pas de statistiques (ANALYZE jamais lancé)
+        aliases = {}
+        objects = conn.execute("SELECT name, type, sql FROM sqlite_master WHERE type IN ('table', 'view')").fetchall()
+        for name, kind, sql in objects:
+            if kind == "table":
+                aliases.setdefault(name, set()).add(name)
+        for name, kind, sql in objects:
+            if kind == "view" and sql:
+                cls._collect_aliases(sql, aliases)
+        return cls(rows, index_stats, aliases)
+
+    @staticmethod
+    def _collect_aliases(sql, aliases):
+        for table, alias in TABLE_ALIAS_RE.findall(_code_only(sql)):
+            if alias and alias.lower() not in ALIAS_KEYWORDS:
+                aliases.setdefault(alias, set()).add(table)
+
+    def table_rows(self, name, aliases):
+        tables = aliases.get(name) or {name}
+        counts = [self.rows[t] for t in tables if t in self.rows]
+        return max(counts) if counts else DEFAULT_TABLE_ROWS
+
+    def search_rows(self, index, constraint):
+        stats = self.index_stats.get(index)
+        equalities = constraint.count("=") if constraint else 0
+        if stats and 0 < equalities < len(stats):
+            return max(stats[equalities], 1)
+        return DEFAULT_SEARCH_ROWS
+
+
+def estimate_plan_cost(plan, stats, sql=""):
+    """Nombre de lignes visitées estimé : produit des boucles imbriquées d'un même niveau, somme des niveaux"""
+    aliases = {k: set(v) for k, v in stats.aliases.items()}
+    TableStats._collect_aliases(sql, aliases)
+    levels = {}
+    for _, parent, _, detail in plan:
+        factor = None
+        scan = PLAN_SCAN_RE.match(detail)
+        search = PLAN_SEARCH_RE.match(detail)
+        if detail.startswith("SCAN CONSTANT ROW"):
+            factor = 1
+        elif scan:
+            factor = stats.table_rows(scan.group(1), aliases)
+        elif search:
+            alias, integer_pk, automatic, index, primary_key, constraint = search.groups()
+            if integer_pk:
+                factor = 1
+            elif automatic:
+                factor = DEFAULT_SEARCH_ROWS
+            else:
+                tables = aliases.get(alias) or {alias}
+                candidates = [index] if index else sorted(tables)
+                factor = max(stats.search_rows(c, constraint) for c in candidates)
+        if factor is not None:
+            levels[parent] = levels.get(parent, 1) * factor
+    return sum(levels.values())
+
+
+class GuardedResult:
+    """Lignes lues sous la garde, avec la raison d'une éventuelle troncature"""
+
+    def __init__(self, columns, rows, truncated=None, elapsed=0.0):
+        self.columns = columns
+        self.rows = rows
+        self.truncated = truncated
+        self.elapsed = elapsed
+
+    def to_dataframe(self):
+        import pandas as pd
+        with span("dataframe"):
+            df = pd.DataFrame.from_records(self.rows, columns=self.columns)
+        df.attrs["garde"] = self.truncated
+        return df
+
+
+class QueryGuard:
+    """Exécute des requêtes non fiables avec contrôle du plan, budget de temps et plafonds"""
+
+    def __init__(self, max_rows=MAX_ROWS, max_bytes=MAX_BYTES, time_budget=TIME_BUDGET_S,
+                 max_plan_cost=MAX_PLAN_COST, table_stats=None):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.time_budget = time_budget
+        self.max_plan_cost = max_plan_cost
+        self.table_stats = table_stats
+        self.executed = 0
+        self.rejected = 0
+        self.interrupted = 0
+        self.truncated = 0
+
+    @classmethod
+    def from_connection(cls, conn, **kwargs):
+        return cls(table_stats=TableStats.from_connection(conn), **kwargs)
+
+    def prepare(self, sql, limit=True):
+        """Requête vérifiée, avec un LIMIT automatique (une ligne de plus pour détecter la troncature)"""
+        sql = check_statement(sql)
+        if limit and not has_top_level_limit(sql):
+            sql = f"{sql}\nLIMIT {self.max_rows + 1}"
+        return sql
+
+    def check_plan(self, conn, sql, params=None):
+        """Refuse les plans dont le coût estimé dépasse le budget (produits cartésiens, scans non bornés)"""
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or ()).fetchall()
+        stats = self.table_stats or TableStats.from_connection(conn)
+        cost = estimate_plan_cost(plan, stats, sql)
+        if cost > self.max_plan_cost:
+            scans = [row[3] for row in plan if row[3].startswith("SCAN")]
+            details = ", ".join(scans[:4]) + (" ..." if len(scans) > 4 else "")
+            raise GuardError(f"plan trop coûteux (~{cost} lignes visitées) : {details}")
+        return cost
+
+    @contextmanager
+    def _guarded(self, conn, sql, params=None, limit=True, check_cost=True):
+        """Vérifie la requête et active authorizer et budget de temps ; fournit (requête préparée, relance du budget)"""
+        deadline = [None]
+
+        def progress():
+            return 1 if time.monotonic() > deadline[0] else 0
+
+        def restart():
+            deadline[0] = time.monotonic() + self.time_budget
+
+        conn.set_authorizer(_authorizer)
+        try:
+            try:
+                sql = self.prepare(sql, limit)
+                if check_cost:
+                    with span("plan"):
+                        self.check_plan(conn, sql, params)
+                restart()
+                conn.set_progress_handler(progress, PROGRESS_STEPS)
+                yield sql, restart
+            except sqlite3.OperationalError as e:
+                if "interrupted" in str(e):
+                    raise GuardError(f"budget de temps dépassé ({self.time_budget:g} s)") from e
+                if "not authorized" in str(e):
+                    raise GuardError("accès refusé : lecture seule uniquement") from e
+                raise
+        except GuardError as e:
+            if e.reason.startswith("budget"):
+                self.interrupted += 1
+            else:
+                self.rejected += 1
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+            conn.set_authorizer(None)
+
+    @contextmanager
+    def cursor(self, conn, sql, params=None):
+        """Curseur sur la requête gardée : authorizer et budget de temps actifs jusqu'à la fin de la lecture"""
+        with self._guarded(conn, sql, params) as (prepared, _):
+            yield conn.execute(prepared, params or ())
+
+    def stream(self, conn, sql, params=None, chunk_size=None, check_cost=True):
+        """Lit le résultat par blocs (colonnes, lignes) de `chunk_size` lignes, sans LIMIT automatique.
+
+        La mémoire ne dépend que de la taille d'un bloc (CHUNK_ROWS par défaut). Le budget de temps
+        s'applique à chaque bloc, pour que la suite puisse être lue plus tard (pagination). Le coût
+        estimé du plan borne la lecture complète ; check_cost=False le lève quand seules quelques
+        pages sont lues, le budget de temps de chaque bloc restant la limite.
+        """
+        with self._guarded(conn, sql, params, limit=False, check_cost=check_cost) as (prepared, restart):
+            with span("sql"):
+                cur = conn.execute(prepared, params or ())
+            self.executed += 1
+            columns = [d[0] for d in cur.description]
+            try:
+                while True:
+                    restart()
+                    with span("sql"):
+                        rows = cur.fetchmany(chunk_size or CHUNK_ROWS)
+                    if not rows:
+                        return
+                    count("lignes", len(rows))
+                    yield columns, rows
+            finally:
+                cur.close()
+
+    def fetch(self, conn, sql, params=None):
+        """Lit le résultat dans la limite des plafonds de lignes et d'octets"""
+        start = time.monotonic()
+        rows, size, truncated = [], 0, None
+        with span("sql"), self.cursor(conn, sql, params) as cur:
+            columns = [d[0] for d in cur.description]
+            for row in cur:
+                if len(rows) >= self.max_rows:
+                    truncated = f"résultat tronqué à {self.max_rows} lignes"
+                    break
+                size += _row_size(row)
+                if size > self.max_bytes:
+                    truncated = f"résultat tronqué à {self.max_bytes // (1024 * 1024)} Mo"
+                    break
+                rows.append(row)
+        self.executed += 1
+        annotate(lignes=len(rows), tronque=truncated)
+        if truncated:
+            self.truncated += 1
+        return GuardedResult(columns, rows, truncated, time.monotonic() - start)
+
+    def read_dataframe(self, pool, sql, params=None):
+        """Exécute la requête sur une connexion du pool et retourne un DataFrame (attrs['garde'] si tronqué)"""
+        with pool.connection() as conn:
+            return self.fetch(conn, sql, params).to_dataframe()
+
+    def stats(self):
+        return {"executees": self.executed, "refusees": self.rejected,
+                "interrompues": self.interrupted, "tronquees": self.truncated}
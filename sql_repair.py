@@ -0,0 +1,261 @@
+"""Validation et réparation locales du SQL généré, avant exécution.
+
+Le texte du LLM est découpé en tokens : la prose et le markdown autour de la requête sont retirés,
+les apostrophes non doublées dans les littéraux ("Nb d'entretiens ...") sont réparées, puis la requête
+est compilée avec EXPLAIN sur le schéma réel et les tables ou colonnes inconnues sont remplacées par
+le nom connu le plus proche ; les littéraux de recruteurs, KPI et mois sont ramenés aux valeurs en
+base (entity_index.py). Le LLM n'est relancé (avec l'erreur précise) qu'en dernier recours.
+"""
+import difflib
+import re
+import sqlite3
+import threading
+from llm_cache import normalize_question
+from sql_guard import GuardError, check_statement
+
+# Nombre maximal de corrections d'identifiants successives
+MAX_IDENTIFIER_FIXES = 3
+# Similarité minimale (difflib) pour remplacer un identifiant inconnu
+IDENTIFIER_CUTOFF = 0.6
+
+# Mots-clés qui peuvent suivre un littéral : l'apostrophe qui les précède ferme la chaîne
+FOLLOW_KEYWORDS = {
+    "AND", "OR", "NOT", "IS", "IN", "LIKE", "GLOB", "BETWEEN", "ESCAPE", "COLLATE", "AS", "THEN", "ELSE",
+    "END", "WHEN", "FROM", "WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "OFFSET", "UNION", "EXCEPT",
+    "INTERSECT", "JOIN", "ON", "ASC", "DESC", "NULLS",
+}
+
+# Mots qui peuvent commencer une ligne de requête (après une ligne vide)
+SQL_WORDS = FOLLOW_KEYWORDS | {
+    "SELECT", "WITH", "LEFT", "INNER", "CROSS", "OUTER", "NATURAL", "USING", "CASE", "DISTINCT", "ALL", "BY",
+    "SUM", "COUNT", "AVG", "MIN", "MAX", "TOTAL", "ROUND", "COALESCE", "IFNULL", "CAST", "WINDOW", "OVER",
+}
+
+TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^']|'')*(?:'|$))
+  | (?P<quoted>"(?:[^"]|"")*(?:"|$)|`[^`]*(?:`|$)|\[[^\]]*(?:\]|$))
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<param>[?:@$]\w*)
+  | (?P<word>[^\W\d]\w*)
+  | (?P<op>\|\||<=|>=|<>|!=|==|<<|>>|.)
+""", re.VERBOSE | re.DOTALL)
+
+FENCE_RE = re.compile(r"```[A-Za-z]*\s*\n?(.*?)(?:```|$)", re.DOTALL)
+START_RE = re.compile(r"\b(SELECT|WITH)\b", re.IGNORECASE)
+MISSING_RE = re.compile(r"no such (column|table): (?:[\w\"]+\.)?\"?([^\s\"]+)\"?")
+
+
+def tokenize(sql):
+    """Liste de tokens (type, texte) : space, comment, string, quoted, number, param, word, op"""
+    return [(m.lastgroup, m.group(m.lastgroup)) for m in TOKEN_RE.finditer(sql)]
+
+
+def _closes_literal(sql, pos):
+    """Vrai si l'apostrophe juste avant `pos` ferme le littéral (et n'est pas une élision)"""
+    if pos < len(sql) and (sql[pos].isalnum() or sql[pos] == "_"):
+        return False
+    rest = sql[pos:].lstrip()
+    # Un littéral ne s'étend pas sur plusieurs lignes : une fin de ligne juste après ferme la chaîne
+    if not rest or rest[0] in ",);=<>!|+-*/%" or "\n" in sql[pos:len(sql) - len(rest)]:
+        return True
+    word = re.match(r"[A-Za-z_]+", rest)
+    return bool(word) and word.group(0).upper() in FOLLOW_KEYWORDS
+
+
+def repair_quotes(sql):
+    """Double les apostrophes internes des littéraux et ferme un littéral resté ouvert ; retourne (sql, réparations)"""
+    sql, located = _repair_quotes(sql)
+    return sql, [message for _, message in located]
+
+
+def _repair_quotes(sql):
+    """Comme repair_quotes, chaque réparation avec sa position dans la requête réparée"""
+    out, repairs = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end == -1 else end
+            out.append(sql[i:end])
+            i = end
+        elif c == '"':
+            end = sql.find('"', i + 1)
+            end = n if end == -1 else end + 1
+            out.append(sql[i:end])
+            i = end
+        elif c == "'":
+            base = sum(len(part) for part in out)
+            parts, j = ["'"], i + 1
+            while True:
+                k = sql.find("'", j)
+                if k == -1:
+                    parts.append(sql[j:] + "'")
+                    repairs.append((base + sum(len(part) for part in parts) - 1, "guillemet fermant ajouté"))
+                    j = n
+                    break
+                if sql.startswith("''", k):
+                    parts.append(sql[j:k + 2])
+                    j = k + 2
+                elif _closes_literal(sql, k + 1):
+                    parts.append(sql[j:k + 1])
+                    j = k + 1
+                    break
+                else:
+                    parts.append(sql[j:k] + "''")
+                    repairs.append((base + sum(len(part) for part in parts) - 2,
+                                    f"apostrophe doublée : {sql[max(i, k - 12):k + 12]!r}"))
+                    j = k + 1
+            out.append("".join(parts))
+            i = j
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out), repairs
+
+
+def extract_statement(text):
+    """Requête seule, sans markdown ni prose autour, apostrophes réparées ; retourne (sql, réparations)"""
+    text = (text or "").strip()
+    fenced = FENCE_RE.search(text)
+    text = (fenced.group(1) if fenced else text).replace("`", "")
+    start = START_RE.search(text)
+    if start is None:
+        return text.strip(), []
+    prose = fenced is not None or text[:start.start()].strip() != ""
+    text, located = _repair_quotes(text[start.start():])
+    tokens = tokenize(text)
+    kept = []
+    for position, (kind, value) in enumerate(tokens):
+        if kind == "op" and value == ";":
+            prose = prose or "".join(v for _, v in tokens[position + 1:]).strip() != ""
+            break
+        # Une ligne vide suivie d'autre chose que du SQL sépare la requête d'une explication en prose
+        if kind == "space" and value.count("\n") >= 2:
+            following = tokens[position + 1] if position + 1 < len(tokens) else None
+            if following and following[0] == "word" and following[1].upper() not in SQL_WORDS:
+                prose = True
+                break
+        kept.append(value)
+    sql = "".join(kept)
+    # Les apostrophes de la prose retirée ne comptent pas parmi les réparations de la requête
+    repairs = [message for position, message in located if position < len(sql)]
+    if prose:
+        repairs.insert(0, "markdown ou prose retirés")
+    return sql.strip(), repairs
+
+
+def replace_identifier(sql, old, new):
+    """Remplace un identifiant (nu ou entre guillemets), jamais à l'intérieur d'un littéral"""
+    target = old.lower()
+    out = []
+    for kind, value in tokenize(sql):
+        if kind == "word" and value.lower() == target:
+            value = new
+        elif kind == "quoted" and value[1:-1].lower() == target:
+            value = f'"{new}"'
+        out.append(value)
+    return "".join(out)
+
+
+class RepairResult:
+    """Requête après réparation locale : liste des corrections, erreur restante (None si valide)"""
+
+    def __init__(self, sql, repairs, error=None, retried=False):
+        self.sql = sql
+        self.repairs = repairs
+        self.error = error
+        self.retried = retried
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class SQLRepairer:
+    """Répare le SQL du LLM à partir des tables, colonnes et valeurs réellement présentes dans la base"""
+
+    def __init__(self, tables, entities=None):
+        self.tables = tables
+        self.entities = entities
+        self.columns = sorted({c for columns in tables.values() for c in columns})
+        self.checked = 0
+        self.valid = 0
+        self.repaired = 0
+        self.failed = 0
+        self.retries = 0
+        self.retries_ok = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_connection(cls, conn, entities=None):
+        names = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+        )]
+        tables = {name: [r[1] for r in conn.execute(f'PRAGMA table_info("{name}")')] for name in names}
+        return cls(tables, entities)
+
+    def closest(self, name, kind):
+        """Table ou colonne connue la plus proche (casse et accents ignorés), None si aucune"""
+        candidates = list(self.tables) if kind == "table" else self.columns
+        keys = {normalize_question(c).replace(" ", "_"): c for c in candidates}
+        match = difflib.get_close_matches(normalize_question(name).replace(" ", "_"), list(keys), n=1,
+                                          cutoff=IDENTIFIER_CUTOFF)
+        return keys[match[0]] if match else None
+
+    def validate(self, conn, sql, params=None):
+        """Message d'erreur de compilation (EXPLAIN, sans exécution), None si la requête est valide"""
+        try:
+            sql = check_statement(sql)
+            conn.execute(f"EXPLAIN {sql}", params or ())
+        except GuardError as e:
+            return e.reason
+        except sqlite3.Error as e:
+            return str(e)
+        return None
+
+    def repair(self, conn, text, params=None, retried=False):
+        """Extrait, répare et valide la requête ; retourne un RepairResult"""
+        sql, repairs = extract_statement(text)
+        if self.entities is not None:
+            # Littéraux ramenés aux valeurs canoniques ('Marienne' -> 'Mariéme', 'juilet' -> 'Juillet')
+            sql, literal_repairs = self.entities.resolve_sql(sql)
+            repairs += literal_repairs
+        error = self.validate(conn, sql, params)
+        for _ in range(MAX_IDENTIFIER_FIXES):
+            missing = MISSING_RE.search(error or "")
+            if not missing:
+                break
+            kind, name = missing.groups()
+            replacement = self.closest(name, kind)
+            if replacement is None or replacement.lower() == name.lower():
+                break
+            sql = replace_identifier(sql, name, replacement)
+            repairs.append(f"{'table' if kind == 'table' else 'colonne'} {name} -> {replacement}")
+            error = self.validate(conn, sql, params)
+        with self._lock:
+            self.checked += 1
+            if error:
+                self.failed += 1
+            elif repairs:
+                self.repaired += 1
+            else:
+                self.valid += 1
+            if retried:
+                self.retries += 1
+                self.retries_ok += error is None
+        return RepairResult(sql, repairs, error, retried)
+
+    def stats(self):
+        questions = self.checked - self.retries
+        return {
+            "verifiees": self.checked,
+            "valides": self.valid,
+            "reparees": self.repaired,
+            "echecs": self.failed,
+            "relances_llm": self.retries,
+            "relances_reussies": self.retries_ok,
+            "part_relance_llm": self.retries / questions if questions else 0.0,
+        }
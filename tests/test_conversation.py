@@ -0,0 +1,69 @@
+import pytest
+from conversation import Conversation
+from prompt_builder import PromptBuilder
+
+KPIS = ["Nb de candidats contactés", "Nb d'entretiens candidats Salariés", "Nb de candidats recrutés Salariés"]
+RECRUTEURS = ["Inès", "Pauline", "Samya", "Mariéme"]
+PERIODES = [(2024, 7, "Juillet"), (2024, 8, "Août"), (2024, 9, "Septembre")]
+PREMIERE = "Quel est le total des 'Nb de candidats contactés' par Inès en septembre ?"
+
+
+@pytest.fixture
+def builder():
+    return PromptBuilder([("rh_nom", "TEXT"), ("valeur", "INTEGER")], KPIS, RECRUTEURS, PERIODES)
+
+
+def ask(conversation, builder, question):
+    resolution = conversation.resolve(question, builder)
+    conversation.record(resolution, "SELECT 1")
+    return resolution
+
+
+def test_follow_up_with_marker_inherits_context(builder):
+    conversation = Conversation()
+    ask(conversation, builder, PREMIERE)
+    suite = ask(conversation, builder, "et Pauline ?")
+    assert suite.follow_up
+    assert suite.state["kpis"] == ["Nb de candidats contactés"]
+    assert suite.state["recruteurs"] == ["Pauline"]
+    assert suite.state["periodes"] == ["Septembre 2024"]
+
+
+def test_elliptical_question_is_a_follow_up(builder):
+    conversation = Conversation()
+    ask(conversation, builder, PREMIERE)
+    suite = ask(conversation, builder, "en août ?")
+    assert suite.follow_up
+    assert suite.state["recruteurs"] == ["Inès"]
+    assert suite.state["periodes"] == ["Août 2024"]
+
+
+def test_complete_questions_stay_standalone(builder):
+    conversation = Conversation()
+    ask(conversation, builder, PREMIERE)
+    ask(conversation, builder, "et Pauline ?")
+    meilleur = ask(conversation, builder, "Qui a le meilleur total en juillet ?")
+    assert not meilleur.follow_up
+    assert meilleur.text == "Qui a le meilleur total en juillet ?"
+    combien = ask(conversation, builder, "Combien de recrutements au total ?")
+    assert not combien.follow_up
+    assert "Pauline" not in combien.text and "contactés" not in combien.text
+
+
+@pytest.mark.parametrize("question", ["et qui a le plus en juillet ?", "et quel recruteur en août ?",
+                                      "et compare en juillet"])
+def test_ranking_follow_up_does_not_inherit_recruiters(builder, question):
+    conversation = Conversation()
+    ask(conversation, builder, PREMIERE)
+    suite = ask(conversation, builder, question)
+    assert suite.follow_up
+    assert suite.state["kpis"] == ["Nb de candidats contactés"]
+    assert not suite.state["recruteurs"]
+    assert "Inès" not in suite.text
+
+
+def test_politeness_keeps_context(builder):
+    conversation = Conversation()
+    ask(conversation, builder, PREMIERE)
+    assert not ask(conversation, builder, "merci").follow_up
+    assert ask(conversation, builder, "et Samya ?").state["kpis"] == ["Nb de candidats contactés"]
@@ -0,0 +1,15 @@
+import sqlite3
+import pytest
+from db import PoolTimeout, ReadPool
+
+
+def test_full_pool_times_out(tmp_path):
+    path = str(tmp_path / "recrutement.db")
+    sqlite3.connect(path).close()
+    pool = ReadPool(path, size=1, timeout=0.05)
+    held = pool._acquire()
+    with pytest.raises(PoolTimeout, match="aucune connexion de lecture libre"):
+        pool._acquire()
+    pool._idle.put(held)
+    assert pool._acquire() is held
+    pool.close()
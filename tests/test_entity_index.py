@@ -0,0 +1,53 @@
+import sqlite3
+import pytest
+from entity_index import EntityIndex
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE kpi_recrutement (rh_nom TEXT, mois TEXT, kpi_nom TEXT, valeur INTEGER)")
+    conn.executemany("INSERT INTO kpi_recrutement VALUES (?, ?, ?, 1)",
+                     [("Mariéme", "Juillet", "Nb entretiens candidats Salariés"),
+                      ("Inès", "Août", "Nb entretiens candidats Sous-Traitants"),
+                      ("Pauline", "Septembre", "Nb de candidats contactés")])
+    return conn
+
+
+@pytest.fixture
+def index(conn):
+    index = EntityIndex()
+    index.refresh(conn)
+    return index
+
+
+@pytest.mark.parametrize("column, literal, canonical", [
+    ("rh_nom", "Ines", "Inès"),
+    ("rh_nom", "marienne", "Mariéme"),
+    ("mois", "Juilet", "Juillet"),
+    ("mois", "aout", "Août"),
+    ("kpi_nom", "nb entretiens candidats salaries", "Nb entretiens candidats Salariés"),
+    # Contenu dans deux KPI : ambigu, laissé tel quel
+    ("kpi_nom", "Nb entretiens candidats", None),
+    ("rh_nom", "Zoé", None),
+])
+def test_lookup(index, column, literal, canonical):
+    assert index.lookup(column, literal) == canonical
+
+
+def test_resolve_sql_rewrites_compared_literals_only(index):
+    sql, repairs = index.resolve_sql(
+        "SELECT * FROM kpi_recrutement WHERE rh_nom NOT IN ('marienne', 'ines') AND 'juilet' = mois "
+        "AND kpi_nom = 'nb de candidats contactes' AND commentaire = 'ines'")
+    assert sql == ("SELECT * FROM kpi_recrutement WHERE rh_nom NOT IN ('Mariéme', 'Inès') AND 'Juillet' = mois "
+                   "AND kpi_nom = 'Nb de candidats contactés' AND commentaire = 'ines'")
+    assert len(repairs) == 4
+
+
+def test_refresh_follows_new_values(conn, index):
+    assert index.lookup("rh_nom", "Samya") is None
+    version = index.version
+    conn.execute("INSERT INTO kpi_recrutement VALUES ('Samya', 'Juillet', 'Nb de candidats contactés', 2)")
+    index.refresh(conn)
+    assert index.lookup("rh_nom", "samia") == "Samya"
+    assert index.version > version
@@ -0,0 +1,32 @@
+import pytest
+from fast_path import FastPathRouter
+
+KPI = "Nb de candidats contactés"
+
+
+def router(with_years=False):
+    return FastPathRouter([KPI], ["Inès", "Pauline"], ["Juillet", "Août", "Septembre"], with_years)
+
+
+def test_month_in_data_becomes_a_filter():
+    route = router().parse(f"Quel est le total des {KPI} par Inès en août ?")
+    assert route.mois == ["Août"]
+    assert "mois IN (?)" in route.sql
+
+
+def test_month_absent_from_data_falls_back_to_llm():
+    assert router().parse(f"Quel est le total des {KPI} par Inès en décembre ?") is None
+
+
+@pytest.mark.parametrize("question", [
+    f"Quel est le total des {KPI} par Inès en 2023 ?",
+    f"Quel est le total des {KPI} au T3 ?",
+])
+def test_year_or_quarter_on_flat_table_falls_back_to_llm(question):
+    assert router().parse(question) is None
+
+
+def test_year_filter_on_star_schema():
+    route = router(with_years=True).parse(f"Quel est le total des {KPI} par Inès en 2023 ?")
+    assert route.annees == [2023]
+    assert route.params == (KPI, "Inès", 2023)
@@ -0,0 +1,17 @@
+import os
+import sqlite3
+from ingest import ingest
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Inès.csv")
+
+
+def test_modifications_count_fact_rows_only(tmp_path):
+    db_path = str(tmp_path / "recrutement.db")
+    summary = ingest([SOURCE], db_path, log=lambda message: None)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT COUNT(*) FROM fact_kpi").fetchone()[0]
+    conn.close()
+    # Les agrégats mis à jour par les triggers ne sont pas des modifications
+    assert rows > 0
+    assert summary["modifiees"] == rows
+    assert ingest([SOURCE], db_path, force=True, log=lambda message: None)["modifiees"] == 0
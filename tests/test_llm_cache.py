@@ -0,0 +1,22 @@
+from llm_cache import LLMCache, normalize_question
+
+
+def test_operators_stay_in_the_key():
+    assert normalize_question("Recruteurs avec valeur > 10 ?") != normalize_question("Recruteurs avec valeur < 10 ?")
+    assert normalize_question("valeur >= 10") != normalize_question("valeur > 10")
+    assert normalize_question("taux de 10,5 %") != normalize_question("taux de 105 %")
+
+
+def test_case_accents_and_punctuation_are_ignored():
+    assert normalize_question("Total d'Août ?") == normalize_question("total d aout")
+    assert normalize_question("taux de 10,5%") == normalize_question("Taux de 10.5 % !")
+
+
+def test_questions_differing_by_an_operator_do_not_share_an_answer(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.db"))
+    greater = cache.get_or_compute("core.generate_sql", "Recruteurs avec valeur > 10", "contexte",
+                                   lambda: "SELECT rh_nom FROM kpi_recrutement WHERE valeur > 10")
+    lower = cache.get_or_compute("core.generate_sql", "Recruteurs avec valeur < 10", "contexte",
+                                 lambda: "SELECT rh_nom FROM kpi_recrutement WHERE valeur < 10")
+    assert greater != lower
+    assert cache.get("core.generate_sql", "recruteurs avec valeur > 10 ?", "contexte") == greater
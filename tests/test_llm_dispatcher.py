@@ -0,0 +1,15 @@
+from llm_dispatcher import LLMDispatcher
+
+
+def request(content):
+    return {"model": "llama3-70b-8192", "temperature": 0, "max_tokens": 300,
+            "messages": [{"role": "system", "content": "Schéma"}, {"role": "user", "content": content}]}
+
+
+def test_key_keeps_operators_and_case():
+    dispatcher = LLMDispatcher(client_factory=None)
+    key = dispatcher._key(request("Recruteurs avec valeur > 10"))
+    assert key == dispatcher._key(request("Recruteurs avec valeur > 10"))
+    assert key != dispatcher._key(request("Recruteurs avec valeur < 10"))
+    assert key != dispatcher._key(request("recruteurs avec valeur > 10"))
+    assert key != dispatcher._key(request("Recruteurs avec valeur > 10 ?"))
@@ -0,0 +1,46 @@
+import pytest
+from partitions import needed_quarters, where_conjuncts
+
+# Trimestres archivés de 2023-T1 à 2024-T1
+ARCHIVES = {(2023, 1): "a", (2023, 2): "b", (2023, 3): "c", (2023, 4): "d", (2024, 1): "e"}
+ALL = sorted(ARCHIVES)
+
+
+@pytest.mark.parametrize("sql", [
+    # Tri des mois par CASE : pas un filtre
+    "SELECT rh_nom, SUM(valeur) AS total FROM kpi_recrutement GROUP BY rh_nom "
+    "ORDER BY CASE WHEN mois = 'Juillet' THEN 1 WHEN mois = 'Août' THEN 2 ELSE 3 END",
+    # Agrégat conditionnel : SUM(valeur) lit tout l'historique
+    "SELECT SUM(CASE WHEN annee = 2024 THEN valeur END) AS v2024, SUM(valeur) AS total FROM kpi_recrutement",
+    "SELECT * FROM kpi_recrutement WHERE annee = 2024 OR mois = 'Juillet'",
+    "SELECT * FROM kpi_recrutement WHERE annee NOT IN (2024)",
+    "SELECT * FROM kpi_recrutement WHERE NOT annee = 2024",
+    "SELECT * FROM kpi_recrutement WHERE rh_nom IN (SELECT rh_nom FROM kpi_recrutement WHERE annee = 2024)",
+    "SELECT * FROM kpi_recrutement WHERE annee = 2024 UNION ALL SELECT * FROM kpi_recrutement WHERE annee = 2023",
+    "WITH t AS (SELECT * FROM kpi_recrutement WHERE annee = 2024) SELECT * FROM t",
+    "SELECT rh_nom, SUM(valeur) FROM kpi_recrutement GROUP BY rh_nom HAVING MAX(annee) = 2024",
+    "SELECT * FROM kpi_recrutement WHERE commentaire = 'x AND annee = 2024'",
+])
+def test_attaches_everything_when_filters_do_not_bound_the_read(sql):
+    assert needed_quarters(sql, None, ARCHIVES) == ALL
+
+
+@pytest.mark.parametrize("sql, params, expected", [
+    ("SELECT * FROM kpi_recrutement WHERE annee = 2023 AND mois IN ('Juillet', 'Août')", None, [(2023, 3)]),
+    ("SELECT * FROM kpi_recrutement WHERE kpi_nom = ? AND annee IN (?) AND trimestre BETWEEN 1 AND 2 "
+     "ORDER BY rh_nom", ("Nb d'entretiens", 2023), [(2023, 1), (2023, 2)]),
+    ("SELECT * FROM kpi_recrutement WHERE (k.annee >= 2024)", None, [(2024, 1)]),
+    ("SELECT * FROM kpi_recrutement WHERE mois = 'aout' ORDER BY CASE WHEN mois = 'Août' THEN 1 END", None,
+     [(2023, 3)]),
+    # Seule la conjonction simple élague ; celle qui contient un CASE est ignorée
+    ("SELECT * FROM kpi_recrutement WHERE annee = 2023 AND CASE WHEN mois = 'Juillet' THEN 1 END = 1", None,
+     [(2023, 1), (2023, 2), (2023, 3), (2023, 4)]),
+    ("SELECT * FROM kpi_recrutement WHERE annee = 2025", None, []),
+])
+def test_prunes_on_top_level_where_conjuncts(sql, params, expected):
+    assert needed_quarters(sql, params, ARCHIVES) == expected
+
+
+def test_where_conjuncts_split_on_top_level_and_only():
+    sql = "SELECT * FROM v WHERE (a = 1 AND b = 2) AND c BETWEEN 1 AND 3 AND d = 'x AND y' GROUP BY a"
+    assert where_conjuncts(sql) == ["a = 1 AND b = 2", "c BETWEEN 1 AND 3", "d = 'x AND y'"]
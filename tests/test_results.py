@@ -0,0 +1,39 @@
+import sqlite3
+import pytest
+import core
+from db import ReadPool
+from results import page_sql, fetch_page, iter_pages
+
+SQL = "SELECT rh_nom, mois, valeur FROM kpi_recrutement ORDER BY rowid"
+
+
+@pytest.fixture(autouse=True)
+def pool(tmp_path, monkeypatch):
+    """Petite base plate dans tmp_path : la base du dépôt n'est jamais ouverte"""
+    path = str(tmp_path / "recrutement.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE kpi_recrutement (rh_nom TEXT, mois TEXT, kpi_nom TEXT, valeur INTEGER)")
+    couples = [(rh, mois) for rh in ("Inès", "Pauline", "Samya") for mois in ("Juillet", "Août", "Septembre")] * 4
+    conn.executemany("INSERT INTO kpi_recrutement VALUES (?, ?, 'Nb de candidats contactés', ?)",
+                     [(rh, mois, n) for n, (rh, mois) in enumerate(couples)])
+    conn.commit()
+    conn.close()
+    pool = ReadPool(path)
+    # Garde, réécriture et routeur sont reconstruits sur cette base
+    monkeypatch.setattr(core, "_resources", {})
+    monkeypatch.setattr(core, "get_pool", lambda: pool)
+    yield pool
+    pool.close()
+
+
+def test_page_sql_skips_previous_pages():
+    assert page_sql(SQL + " ;", 3, 10) == SQL + "\nLIMIT 11 OFFSET 30"
+    assert page_sql(SQL + " LIMIT 5", 0, 10) == f"SELECT * FROM (\n{SQL} LIMIT 5\n)\nLIMIT 11 OFFSET 0"
+
+
+def test_fetch_page_matches_streamed_pages():
+    pages = list(iter_pages(SQL, page_size=7))
+    for expected in (pages[0], pages[2], pages[-1]):
+        page = fetch_page(SQL, number=expected.number, page_size=7)
+        assert (page.columns, page.rows, page.has_more) == (expected.columns, expected.rows, expected.has_more)
+    assert fetch_page(SQL, number=len(pages), page_size=7).rows == []
@@ -0,0 +1,45 @@
+import sqlite3
+from schema import data_version
+
+
+def flat_table():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE kpi_recrutement (rh_nom TEXT, mois TEXT, kpi_nom TEXT, valeur INTEGER)")
+    conn.executemany("INSERT INTO kpi_recrutement VALUES (?, ?, ?, ?)",
+                     [("Inès", "Juillet", "Nb de candidats contactés", 10),
+                      ("Pauline", "Juillet", "Nb de candidats contactés", 12)])
+    return conn
+
+
+def test_flat_table_version_follows_updates():
+    conn = flat_table()
+    versions = {data_version(conn)}
+    conn.execute("UPDATE kpi_recrutement SET valeur = valeur + 100 WHERE rh_nom = 'Inès'")
+    versions.add(data_version(conn))
+    conn.execute("UPDATE kpi_recrutement SET rh_nom = 'Mariéme' WHERE rh_nom = 'Pauline'")
+    versions.add(data_version(conn))
+    assert len(versions) == 3
+
+
+def test_flat_table_version_is_stable_without_writes():
+    conn = flat_table()
+    assert data_version(conn) == data_version(conn)
+
+
+def test_flat_table_is_hashed_again_only_after_a_write(tmp_path):
+    path = str(tmp_path / "recrutement.db")
+    writer = flat_table()
+    writer.commit()
+    writer.execute("VACUUM INTO ?", (path,))
+    reader = sqlite3.connect(path)
+    statements = []
+    reader.set_trace_callback(statements.append)
+    version = data_version(reader)
+    assert data_version(reader) == version
+    assert sum("ORDER BY rowid" in s for s in statements) == 1
+    # Écriture par une autre connexion (ingest.py, updates.py) : nouvelle empreinte
+    other = sqlite3.connect(path)
+    other.execute("UPDATE kpi_recrutement SET valeur = valeur + 1 WHERE rh_nom = 'Inès'")
+    other.commit()
+    assert data_version(reader) != version
+    assert sum("ORDER BY rowid" in s for s in statements) == 2
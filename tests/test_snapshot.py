@@ -0,0 +1,22 @@
+import sqlite3
+import pytest
+from snapshot import load_dataframe
+
+pd = pytest.importorskip("pandas")
+
+
+def test_flat_database_without_snapshot_is_read_with_sql(tmp_path):
+    path = str(tmp_path / "recrutement.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE kpi_recrutement (rh_nom TEXT, mois TEXT, kpi_nom TEXT, valeur INTEGER, "
+                 "commentaire TEXT, periode_recrutement TEXT)")
+    conn.executemany("INSERT INTO kpi_recrutement VALUES (?, ?, ?, ?, NULL, NULL)",
+                     [("Inès", "Juillet", "Nb de candidats contactés", 10),
+                      ("Inès", "Juillet", "Nombre de présentations clients", 2),
+                      ("Pauline", "Août", "Nb de candidats contactés", 12)])
+    conn.commit()
+    conn.close()
+    df = load_dataframe(["rh_nom", "valeur"], {"kpi_nom": "Nb de candidats contactés"},
+                        directory=str(tmp_path / "snapshots"), db_path=path)
+    assert df.to_dict("records") == [{"rh_nom": "Inès", "valeur": 10}, {"rh_nom": "Pauline", "valeur": 12}]
+    assert "annee" not in load_dataframe(directory=str(tmp_path / "snapshots"), db_path=path).columns
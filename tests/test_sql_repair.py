@@ -0,0 +1,55 @@
+import pytest
+from sql_repair import _closes_literal, extract_statement
+
+PROSE = "markdown ou prose retirés"
+
+
+@pytest.mark.parametrize("sql, pos, closes", [
+    ("'aujourd'hui'", 9, False),
+    ("'aujourd'hui'", 13, True),
+    ("IN ('Nb d'entretiens', 'Nb')", 9, False),
+    ("IN ('Nb d'entretiens', 'Nb')", 21, True),
+    ("= 'Juillet' AND mois", 11, True),
+    ("= 'Juillet'\nORDER", 11, True),
+    ("= 'l'équipe'", 5, False),
+])
+def test_closes_literal(sql, pos, closes):
+    assert _closes_literal(sql, pos) is closes
+
+
+def test_elision_inside_in_list():
+    sql, repairs = extract_statement(
+        "SELECT * FROM kpi_recrutement WHERE kpi_nom IN ('Nb d'entretiens', 'Nb de candidats contactés')")
+    assert sql == "SELECT * FROM kpi_recrutement WHERE kpi_nom IN ('Nb d''entretiens', 'Nb de candidats contactés')"
+    assert len(repairs) == 1
+
+
+def test_elision_in_aujourdhui():
+    sql, _ = extract_statement("SELECT * FROM kpi_recrutement WHERE commentaire = 'aujourd'hui'")
+    assert sql == "SELECT * FROM kpi_recrutement WHERE commentaire = 'aujourd''hui'"
+
+
+def test_prose_after_blank_line():
+    sql, repairs = extract_statement(
+        "SELECT rh_nom FROM kpi_recrutement WHERE mois = 'Juillet'\n\nCette requête liste les recruteurs.")
+    assert sql == "SELECT rh_nom FROM kpi_recrutement WHERE mois = 'Juillet'"
+    assert repairs == [PROSE]
+    # L'apostrophe de la prose retirée n'est pas une réparation de la requête
+    assert extract_statement("SELECT mois FROM kpi_recrutement\n\nL'explication suit.")[1] == [PROSE]
+
+
+def test_blank_line_inside_query_is_kept():
+    assert extract_statement("SELECT rh_nom\n\nFROM kpi_recrutement") == ("SELECT rh_nom\n\nFROM kpi_recrutement", [])
+
+
+def test_prose_after_semicolon():
+    sql, repairs = extract_statement("SELECT rh_nom FROM kpi_recrutement; Cette requête liste l'équipe.")
+    assert sql == "SELECT rh_nom FROM kpi_recrutement"
+    assert repairs == [PROSE]
+    assert extract_statement("SELECT rh_nom FROM kpi_recrutement;") == ("SELECT rh_nom FROM kpi_recrutement", [])
+
+
+def test_fenced_block():
+    sql, repairs = extract_statement("Voici la requête :\n```sql\nSELECT mois FROM kpi_recrutement\n```")
+    assert sql == "SELECT mois FROM kpi_recrutement"
+    assert repairs == [PROSE]
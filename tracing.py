@@ -0,0 +1,297 @@
+"""Traces par question : étapes chronométrées, jetons Groq, lignes lues et hits de cache.
+
+Les traces sont écrites dans traces.db (SQLite) ou dans un fichier JSONL si RH_CHAT_TRACES se termine
+par .jsonl. Avec RH_CHAT_PROFILE=1, chaque question est aussi profilée (cProfile) dans profiles/.
+"""
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACE_PATH = os.getenv("RH_CHAT_TRACES", os.path.join(BASE_DIR, "traces.db"))
+PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+PROFILE_ENABLED = os.getenv("RH_CHAT_PROFILE", "").lower() in ("1", "true", "oui")
+# Traces perdues (base indisponible) : signalées dans les journaux, jamais à l'utilisateur
+logger = logging.getLogger("rh_chat.tracing")
+
+# Nombre de traces récentes prises en compte par les statistiques
+STATS_WINDOW = 1000
+PERCENTILES = [50, 95, 99]
+
+_current = contextvars.ContextVar("rh_chat_trace", default=None)
+
+
+class Trace:
+    """Trace d'une question : étapes (nom, début, durée en ms) et attributs libres"""
+
+    def __init__(self, question, app):
+        self.trace_id = uuid.uuid4().hex
+        self.question = question
+        self.app = app
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+        self.spans = []
+        self.attrs = {}
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.spans.append((name, (start - self._start) * 1000, (end - start) * 1000))
+
+    def annotate(self, **attrs):
+        self.attrs.update(attrs)
+
+    def count(self, key, n=1):
+        self.attrs[key] = self.attrs.get(key, 0) + n
+
+    def finish(self, error=None):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        self.error = error
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "app": self.app,
+            "question": self.question,
+            "debut": self.started_at,
+            "duree_ms": self.duration_ms,
+            "erreur": self.error,
+            "attributs": self.attrs,
+            "etapes": [{"nom": n, "debut_ms": s, "duree_ms": d} for n, s, d in self.spans],
+        }
+
+
+class SQLiteSink:
+    """Traces stockées dans SQLite (une ligne par trace, une ligne par étape)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS traces (
+                trace_id TEXT PRIMARY KEY,
+                app TEXT,
+                question TEXT,
+                debut REAL,
+                duree_ms REAL,
+                erreur TEXT,
+                attributs TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_traces_debut ON traces (debut);
+            CREATE TABLE IF NOT EXISTS trace_etapes (
+                trace_id TEXT NOT NULL,
+                nom TEXT NOT NULL,
+                debut_ms REAL,
+                duree_ms REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_trace_etapes_trace ON trace_etapes (trace_id);
+        """)
+
+    def write(self, record):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO traces (trace_id, app, question, debut, duree_ms, erreur, attributs) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record["trace_id"], record["app"], record["question"], record["debut"], record["duree_ms"],
+                 record["erreur"], json.dumps(record["attributs"], ensure_ascii=False)),
+            )
+            self._conn.executemany(
+                "INSERT INTO trace_etapes (trace_id, nom, debut_ms, duree_ms) VALUES (?, ?, ?, ?)",
+                [(record["trace_id"], e["nom"], e["debut_ms"], e["duree_ms"]) for e in record["etapes"]],
+            )
+
+    def load(self, limit=STATS_WINDOW):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT trace_id, app, question, debut, duree_ms, erreur, attributs "
+                "FROM traces ORDER BY debut DESC LIMIT ?", (limit,)
+            ).fetchall()
+            ids = [r[0] for r in rows]
+            spans = {}
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                for trace_id, nom, debut_ms, duree_ms in self._conn.execute(
+                    f"SELECT trace_id, nom, debut_ms, duree_ms FROM trace_etapes "
+                    f"WHERE trace_id IN ({', '.join('?' for _ in chunk)})", chunk
+                ):
+                    spans.setdefault(trace_id, []).append({"nom": nom, "debut_ms": debut_ms, "duree_ms": duree_ms})
+        return [
+            {"trace_id": r[0], "app": r[1], "question": r[2], "debut": r[3], "duree_ms": r[4], "erreur": r[5],
+             "attributs": json.loads(r[6] or "{}"), "etapes": spans.get(r[0], [])}
+            for r in rows
+        ]
+
+
+class JsonlSink:
+    """Traces ajoutées à un fichier JSONL (une trace par ligne)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def load(self, limit=STATS_WINDOW):
+        if not os.path.exists(self.path):
+            return []
+        with self._lock, open(self.path, encoding="utf-8") as f:
+            lines = f.readlines()[-limit:]
+        return [json.loads(line) for line in reversed(lines) if line.strip()]
+
+
+def open_sink(path=TRACE_PATH):
+    return JsonlSink(path) if path.endswith(".jsonl") else SQLiteSink(path)
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_sink():
+    """Destination des traces partagée par le processus"""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = open_sink()
+    return _sink
+
+
+class _NullTrace:
+    """Trace inactive : les appels d'instrumentation hors d'une question ne coûtent rien"""
+
+    @contextmanager
+    def span(self, name):
+        yield
+
+    def annotate(self, **attrs):
+        pass
+
+    def count(self, key, n=1):
+        pass
+
+
+_null = _NullTrace()
+
+
+def current_trace():
+    return _current.get() or _null
+
+
+def span(name):
+    """Chronomètre une étape de la trace en cours (sans effet hors d'une trace)"""
+    return current_trace().span(name)
+
+
+def annotate(**attrs):
+    current_trace().annotate(**attrs)
+
+
+def count(key, n=1):
+    current_trace().count(key, n)
+
+
+def record_usage(response):
+    """Reporte dans la trace les jetons consommés d'une réponse Groq"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    trace = current_trace()
+    trace.count("jetons_prompt", getattr(usage, "prompt_tokens", 0) or 0)
+    trace.count("jetons_reponse", getattr(usage, "completion_tokens", 0) or 0)
+
+
+@contextmanager
+def trace(question, app, sink=None, profile=None):
+    """Trace une question de bout en bout et l'écrit dans la destination à la fin"""
+    current = Trace(question, app)
+    token = _current.set(current)
+    profiler = None
+    if PROFILE_ENABLED if profile is None else profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile_path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{current.trace_id[:8]}.prof")
+            profiler.dump_stats(profile_path)
+            current.annotate(profil=profile_path)
+        _current.reset(token)
+        current.finish(error)
+        try:
+            (sink or get_sink()).write(current.to_dict())
+        except (OSError, sqlite3.Error) as e:
+            # Une trace perdue ne doit jamais faire échouer la question
+            logger.warning("Trace non enregistrée : %s", e)
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered), -(-p * len(ordered) // 100)) - 1)
+    return ordered[rank]
+
+
+def stats(limit=STATS_WINDOW, slowest=5, sink=None):
+    """Percentiles par étape, questions les plus lentes et taux de hits sur les dernières traces"""
+    records = (sink or get_sink()).load(limit)
+    durations = {}
+    for record in records:
+        if record["duree_ms"] is not None:
+            durations.setdefault("total", []).append(record["duree_ms"])
+        for etape in record["etapes"]:
+            durations.setdefault(etape["nom"], []).append(etape["duree_ms"])
+    etapes = {
+        nom: {"n": len(values), **{f"p{p}": round(_percentile(values, p), 1) for p in PERCENTILES}}
+        for nom, values in durations.items()
+    }
+    lentes = sorted((r for r in records if r["duree_ms"] is not None), key=lambda r: r["duree_ms"], reverse=True)
+    attrs = [r["attributs"] for r in records]
+    llm_lookups = [a["cache_llm"] for a in attrs if "cache_llm" in a]
+    return {
+        "traces": len(records),
+        "erreurs": sum(1 for r in records if r["erreur"]),
+        "etapes": etapes,
+        "plus_lentes": [(round(r["duree_ms"], 1), r["app"], r["question"]) for r in lentes[:slowest]],
+        "hit_rate_cache_llm": llm_lookups.count("hit") / len(llm_lookups) if llm_lookups else None,
+        "jetons_prompt": sum(a.get("jetons_prompt", 0) for a in attrs),
+        "jetons_reponse": sum(a.get("jetons_reponse", 0) for a in attrs),
+    }
+
+
+def format_stats(summary):
+    """Vue texte des statistiques pour la ligne de commande"""
+    lines = [f"{summary['traces']} questions tracées, {summary['erreurs']} en erreur"]
+    lines.append(f"{'étape':<14}{'n':>6}" + "".join(f"{'p' + str(p) + ' (ms)':>12}" for p in PERCENTILES))
+    for nom, values in sorted(summary["etapes"].items(), key=lambda item: -item[1]["p50"]):
+        lines.append(f"{nom:<14}{values['n']:>6}" + "".join(f"{values[f'p{p}']:>12.1f}" for p in PERCENTILES))
+    if summary["hit_rate_cache_llm"] is not None:
+        lines.append(f"Cache LLM : {summary['hit_rate_cache_llm']:.0%} de hits")
+    lines.append(f"Jetons Groq : {summary['jetons_prompt']} prompt, {summary['jetons_reponse']} réponse")
+    if summary["plus_lentes"]:
+        lines.append("Questions les plus lentes :")
+        for duree, app, question in summary["plus_lentes"]:
+            lines.append(f"  {duree:>9.1f} ms  [{app}] {question}")
+    return "\n".join(lines)
@@ -1,7 +1,8 @@
-import sqlite3
+from db import open_write_connection
+from schema import bump_data_version
 
-# Connexion à la base de données
-conn = sqlite3.connect("recrutement.db")
+# Connexion d'écriture à la base de données
+conn = open_write_connection()
 cursor = conn.cursor()
 
 # Requête de mise à jour
@@ -11,6 +12,9 @@ cursor.execute("""
     WHERE rh_nom = 'Merienne'
 """)
 
+# Les indicateurs mis en cache pour l'ancienne version des données seront recalculés
+bump_data_version(conn)
+
 # Valider et fermer
 conn.commit()
 conn.close()
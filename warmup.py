@@ -0,0 +1,351 @@
+"""Réponses préparées d'avance pour les questions de référence, étiquetées par version des données.
+
+Usage : python warmup.py [--questions questions.txt] [--sans-totaux] [--force]
+
+Les questions de la revue hebdomadaire (exemples de la CLI, fichier de questions de référence et
+total de chaque KPI par recruteur et par mois du trimestre courant) sont préparées après chaque
+chargement : requête SQL (voie rapide ou Groq), première page du résultat, graphique rendu et
+indicateurs, gardés dans warmup.db avec la version des données. Les applications Streamlit les
+servent sans appel ni rendu. Quand la version change, chaque réponse périmée est relue : si son
+résultat est identique, elle est seulement revalidée ; sinon graphique et indicateurs sont recalculés.
+Depuis les applications, cette mise à jour tourne en tâche de fond, après les questions des utilisateurs.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from db import BASE_DIR
+from llm_cache import normalize_question
+from results import PAGE_SIZE
+
+WARMUP_PATH = os.getenv("RH_CHAT_WARMUP", os.path.join(BASE_DIR, "warmup.db"))
+# Questions de référence supplémentaires (JSONL ou une question par ligne), facultatif
+QUESTIONS_PATH = os.getenv("RH_CHAT_WARMUP_QUESTIONS", os.path.join(BASE_DIR, "questions_reference.txt"))
+
+# Question type préparée pour chaque recruteur x KPI x mois du trimestre courant
+TOTAL_TEMPLATE = "Quel est le total des '{kpi}' par {rh} en {mois} ?"
+# Lignes lues par bloc pour l'empreinte du résultat
+CHUNK_ROWS = 5000
+# Style du graphique des applications Streamlit (courbes par recruteur)
+CHART_OPTIONS = dict(kind="line", legend_title="rh_nom", figsize=(10, 5), rotation=45)
+
+# Journal du rafraîchissement en arrière-plan (aucune sortie à l'écran depuis les applications)
+logger = logging.getLogger("rh_chat.warmup")
+
+
+class PreparedAnswer:
+    """Réponse préparée : requête, première page du résultat, graphique (PNG) et indicateurs"""
+
+    def __init__(self, question, version, sql, params, description, columns, rows, has_more, digest, kpi,
+                 chart, insights, prepared_at):
+        self.question = question
+        self.version = version
+        self.sql = sql
+        self.params = tuple(params) if params is not None else None
+        self.description = description
+        self.columns = columns
+        self.rows = rows
+        self.has_more = has_more
+        self.digest = digest
+        self.kpi = kpi
+        self.chart = chart
+        self.insights = insights
+        self.prepared_at = prepared_at
+
+    def describe(self):
+        date = time.strftime("%d/%m %H:%M", time.localtime(self.prepared_at))
+        return f"{self.description or 'requête générée'} (réponse préparée le {date})"
+
+    def page(self):
+        """Première page du résultat, comme results.fetch_page"""
+        from results import Page
+        rows = [tuple(row) for row in self.rows[:PAGE_SIZE]]
+        return Page(0, PAGE_SIZE, self.columns, rows, self.has_more or len(self.rows) > PAGE_SIZE)
+
+
+class WarmupStore:
+    """Réponses préparées dans SQLite, une par question (forme normalisée)"""
+
+    def __init__(self, path=WARMUP_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS reponses (
+                cle TEXT PRIMARY KEY,
+                question TEXT,
+                version TEXT,
+                sql TEXT,
+                params TEXT,
+                description TEXT,
+                colonnes TEXT,
+                lignes TEXT,
+                suite INTEGER,
+                empreinte TEXT,
+                kpi TEXT,
+                graphique BLOB,
+                indicateurs TEXT,
+                prepare_le REAL
+            )
+        """)
+
+    def get(self, question):
+        """Réponse préparée pour la question, quelle que soit sa version (None si absente)"""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT question, version, sql, params, description, colonnes, lignes, suite, empreinte, kpi,
+                       graphique, indicateurs, prepare_le
+                FROM reponses WHERE cle = ?
+            """, (normalize_question(question),)).fetchone()
+        if row is None:
+            return None
+        question, version, sql, params, description, columns, rows, has_more, digest, kpi, chart, insights, at = row
+        return PreparedAnswer(question, version, sql, json.loads(params), description, json.loads(columns),
+                              json.loads(rows), bool(has_more), digest, kpi, chart, json.loads(insights), at)
+
+    def put(self, answer):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reponses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_question(answer.question), answer.question, answer.version, answer.sql,
+                 json.dumps(list(answer.params) if answer.params is not None else None, default=str),
+                 answer.description, json.dumps(answer.columns, ensure_ascii=False),
+                 json.dumps(answer.rows, ensure_ascii=False, default=str), int(answer.has_more), answer.digest,
+                 answer.kpi, answer.chart, json.dumps(answer.insights, ensure_ascii=False), answer.prepared_at),
+            )
+
+    def revalidate(self, question, version):
+        """Résultat inchangé : la réponse vaut aussi pour la nouvelle version des données"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE reponses SET version = ? WHERE cle = ?", (version, normalize_question(question)))
+
+    def retain(self, questions):
+        """Supprime les réponses des questions qui ne sont plus dans la liste de référence"""
+        keys = {normalize_question(q) for q in questions}
+        with self._lock, self._conn:
+            stored = [k for (k,) in self._conn.execute("SELECT cle FROM reponses")]
+            self._conn.executemany("DELETE FROM reponses WHERE cle = ?", [(k,) for k in stored if k not in keys])
+
+    def questions(self):
+        with self._lock:
+            return [q for (q,) in self._conn.execute("SELECT question FROM reponses ORDER BY question")]
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM reponses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "perimees": self.stale, "entries": size}
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_store():
+    """Réponses préparées partagées par le processus"""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = WarmupStore()
+    return _default_store
+
+
+# --- Questions de référence ---
+
+def read_question_file(path=QUESTIONS_PATH):
+    """Questions du fichier de référence (même format que le mode batch), liste vide s'il n'existe pas"""
+    from core import read_questions
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [question for _, question in read_questions(f)]
+
+
+def total_questions():
+    """Total de chaque KPI par recruteur et par mois du trimestre courant (partition courante)"""
+    from core import get_pool
+    from schema import object_type
+    with get_pool().connection() as conn:
+        if object_type(conn, "fact_kpi") != "table":
+            # Ancienne table plate : un seul trimestre
+            combinations = conn.execute("SELECT DISTINCT rh_nom, kpi_nom, mois FROM kpi_recrutement").fetchall()
+        else:
+            # main. : les trimestres archivés (vues temporaires de partitions.py) ne sont pas courants
+            last = conn.execute("SELECT MAX(periode_id) FROM main.fact_kpi").fetchone()[0]
+            if last is None:
+                return []
+            annee, mois = divmod(last, 100)
+            first = annee * 100 + (mois - 1) // 3 * 3 + 1
+            combinations = conn.execute("""
+                SELECT r.rh_nom, k.kpi_nom, p.mois
+                FROM (SELECT DISTINCT rh_id, kpi_id, periode_id FROM main.fact_kpi
+                      WHERE periode_id BETWEEN ? AND ?) AS f
+                JOIN dim_rh AS r USING (rh_id) JOIN dim_kpi AS k USING (kpi_id)
+                JOIN dim_periode AS p USING (periode_id)
+                ORDER BY r.rh_nom, k.kpi_nom, f.periode_id
+            """, (first, last)).fetchall()
+    return [TOTAL_TEMPLATE.format(kpi=kpi.strip(), rh=rh, mois=mois) for rh, kpi, mois in combinations]
+
+
+def canonical_questions(with_totals=True, path=QUESTIONS_PATH):
+    """Questions préparées : exemples de la CLI, fichier de référence, totaux du trimestre courant"""
+    from core import EXAMPLE_QUESTIONS
+    questions = list(EXAMPLE_QUESTIONS) + read_question_file(path)
+    if with_totals:
+        questions += total_questions()
+    # Une seule fois par forme normalisée, dans l'ordre d'origine
+    unique = {}
+    for question in questions:
+        unique.setdefault(normalize_question(question), question)
+    return list(unique.values())
+
+
+# --- Préparation ---
+
+def _read_result(sql, params):
+    """Première page, présence d'une suite et empreinte de tout le résultat (lu par blocs, sous la garde)"""
+    from core import stream_sql
+    digest = hashlib.sha256()
+    columns, first, total = [], [], 0
+    chunks = stream_sql(sql, params, CHUNK_ROWS)
+    try:
+        for columns, rows in chunks:
+            if len(first) < PAGE_SIZE:
+                first += [list(row) for row in rows[:PAGE_SIZE - len(first)]]
+            total += len(rows)
+            digest.update(json.dumps(rows, ensure_ascii=False, default=str).encode("utf-8"))
+    finally:
+        chunks.close()
+    digest.update(json.dumps(columns).encode("utf-8"))
+    return columns, first, total > PAGE_SIZE, digest.hexdigest()
+
+
+def _render(sql, params, kpi):
+    from charts import render_chart
+    from results import aggregate_trends
+    trends = aggregate_trends(sql, params)
+    if not trends or not trends.totals:
+        return None
+    return render_chart(trends.pivot(), title=f"Évolution de {kpi} par recruteur", **CHART_OPTIONS)
+
+
+def prepare(question, version, previous=None, store=None):
+    """Prépare (ou revalide) la réponse à une question ; retourne "preparee" ou "revalidee" """
+    from core import extract_kpi_name, get_router
+    from insights import query_insights
+    store = store or get_store()
+    route = get_router().route(question)
+    if route:
+        description, sql, params = route.describe(), route.sql, route.params
+    else:
+        # Même génération que la CLI et interface.py (prompt et cache LLM communs, réparation locale)
+        from core import generate_sql
+        description, sql, params = None, generate_sql(question), None
+    columns, rows, has_more, digest = _read_result(sql, params)
+    params = tuple(params) if params is not None else None
+    if previous is not None and (previous.sql, previous.params, previous.digest) == (sql, params, digest):
+        store.revalidate(question, version)
+        return "revalidee"
+    kpi = extract_kpi_name(question, default=None)
+    chart = None
+    if kpi and all(c in columns for c in ("rh_nom", "mois", "valeur")):
+        chart = _render(sql, params, kpi)
+    store.put(PreparedAnswer(question, version, sql, params, description, columns, rows, has_more, digest, kpi,
+                             chart, query_insights(sql, params), time.time()))
+    return "preparee"
+
+
+def refresh(questions=None, force=False, log=print):
+    """Met les réponses à jour pour la version courante des données ; retourne le décompte par statut.
+
+    Sans liste (après un chargement), prépare les questions de référence et oublie les autres.
+    """
+    from core import data_version
+    store = get_store()
+    reference = questions is None
+    questions = canonical_questions() if reference else questions
+    version = data_version()
+    counts = {"preparee": 0, "revalidee": 0, "a_jour": 0, "erreur": 0}
+    start = time.perf_counter()
+    for question in questions:
+        previous = store.get(question)
+        if previous is not None and previous.version == version and not force:
+            counts["a_jour"] += 1
+            continue
+        try:
+            counts[prepare(question, version, None if force else previous, store)] += 1
+        except Exception as e:
+            counts["erreur"] += 1
+            log(f"! {question} : {e}")
+    if reference:
+        store.retain(questions)
+    log(f"+ réponses préparées (version {version}) : {counts['preparee']} calculées, {counts['revalidee']} "
+        f"revalidées, {counts['a_jour']} à jour, {counts['erreur']} en erreur en {time.perf_counter() - start:.1f}s")
+    return counts
+
+
+# --- Service depuis les applications ---
+
+_background = {"version": None, "thread": None}
+_background_lock = threading.Lock()
+
+
+def refresh_in_background(version):
+    """Met à jour, une fois par version des données, les réponses périmées dans un thread de priorité basse"""
+    with _background_lock:
+        thread = _background["thread"]
+        if _background["version"] == version or (thread is not None and thread.is_alive()):
+            return False
+        _background["version"] = version
+
+        def run():
+            from llm_dispatcher import PRIORITY_BACKGROUND, priority
+            # Les appels Groq éventuels passent après ceux des utilisateurs
+            with priority(PRIORITY_BACKGROUND):
+                refresh(get_store().questions(), log=logger.info)
+
+        _background["thread"] = threading.Thread(target=run, name="rh-chat-warmup", daemon=True)
+        _background["thread"].start()
+    return True
+
+
+def lookup(question):
+    """Réponse préparée valable pour la version courante des données, sinon None.
+
+    Une réponse périmée n'est pas servie : sa mise à jour (et celle des autres) part en tâche de fond.
+    """
+    from core import data_version
+    store = get_store()
+    answer = store.get(question)
+    if answer is None:
+        store.misses += 1
+        return None
+    version = data_version()
+    if answer.version != version:
+        store.stale += 1
+        refresh_in_background(version)
+        return None
+    store.hits += 1
+    return answer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", default=QUESTIONS_PATH, help="fichier des questions de référence")
+    parser.add_argument("--sans-totaux", action="store_true",
+                        help="ne prépare pas les totaux recruteur x KPI x mois du trimestre courant")
+    parser.add_argument("--force", action="store_true", help="recalcule aussi les réponses à jour")
+    args = parser.parse_args()
+    questions = canonical_questions(not args.sans_totaux, args.questions)
+    refresh(questions, args.force)
+    get_store().retain(questions)
+
+
+if __name__ == "__main__":
+    main()